@@ -0,0 +1,527 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specif
+
+# micro benchmarks of the decoding hot paths
+
+import os
+import sys
+import time
+import random
+import shutil
+import struct
+import argparse
+import binascii
+import tempfile
+import uuid
+from buffer import Buffer
+import sstmd
+import sstgen
+import sstable2json
+import ssttypes
+from sstidx import IndexInfo
+from sstable import SSTableReader20, SSTableFileName, Row, RangeTombstone, EXPIRATION_MASK
+
+def vintbytes(value):
+    # unsigned vint encoding as written by Cassandra
+    if value < 0x80:
+        return chr(value)
+    extra = 1
+    while extra < 8 and value >= 1 << (7 * (extra + 1)):
+        extra += 1
+    if extra == 8:
+        first = 0xff
+    else:
+        first = (0xff << (8 - extra)) & 0xff | (value >> (8 * extra))
+    return chr(first) + "".join([chr((value >> (8 * i)) & 0xff) for i in xrange(extra - 1, -1, -1)])
+
+def bytewisevint(buf):
+    # the byte at a time decoder the table driven one replaced
+    byte = buf.unpack_signed_byte()
+    if byte & 0x80 != 0x80:
+        return byte
+    mask = 0x80
+    extrabytes = 0
+    while byte & mask != 0:
+        extrabytes = extrabytes + 1
+        mask = mask >> 1
+    mask = 0x80
+    i = 0
+    while i < extrabytes - 1:
+        mask = mask >> 1
+        mask = mask | 0x80
+        i = i + 1
+    mask = (~mask & 0xff)
+    val = (byte & mask)
+    i = 0
+    while i < extrabytes:
+        val = val << 8
+        byte = buf.unpack_signed_byte()
+        val = val | (byte & 0xff)
+        i = i + 1
+    return val
+
+def vintdata(count):
+    # a mix of small lengths and flags, sizes and full timestamps
+    random.seed(count)
+    values = []
+    for i in xrange(count):
+        bits = random.choice([6, 6, 6, 13, 20, 27, 51])
+        values.append(random.getrandbits(bits))
+    return (values, "".join([vintbytes(v) for v in values]))
+
+def timeit(name, count, fn):
+    start = time.time()
+    result = fn()
+    elapsed = time.time() - start
+    print "%-24s %8.3f s %10.0f /s" % (name, elapsed, count / elapsed)
+    return result
+
+def timebytes(name, size, fn):
+    # fn returns the number of cells or entries it decoded
+    start = time.time()
+    count = fn()
+    elapsed = time.time() - start
+    print "%-24s %8.3f s %10.0f /s %8.1f MB/s" % (name, elapsed, count / elapsed, size / elapsed / 1048576)
+    return count
+
+def benchvint(count):
+    (values, data) = vintdata(count)
+    def bytewise():
+        buf = Buffer(data)
+        return [bytewisevint(buf) for i in xrange(count)]
+    def single():
+        buf = Buffer(data)
+        return [buf.unpack_vint() for i in xrange(count)]
+    def batched():
+        buf = Buffer(data)
+        result = []
+        # batches of the size a row header reads
+        for i in xrange(count / 8):
+            result.extend(buf.unpack_vints(8))
+        result.extend(buf.unpack_vints(count % 8))
+        return result
+    for (name, fn) in [("vint bytewise", bytewise), ("vint unpack_vint", single), ("vint unpack_vints", batched)]:
+        if timeit(name, count, fn) != values:
+            print >> sys.stderr, "%s decoded wrong values" % (name)
+            sys.exit(1)
+
+def celldata(count):
+    # live cells with every eighth one expiring, as unpack_column_value
+    # reads them after the cell name
+    random.seed(count)
+    cells = []
+    for i in xrange(count):
+        ts = 1581757206044154 + i
+        if i % 8 == 0:
+            cells.append(struct.pack('>Biiqi', EXPIRATION_MASK, 86400, 1581843606, ts, 4) + struct.pack('>f', random.random()))
+        else:
+            cells.append(struct.pack('>Bqi', 0, ts, 4) + struct.pack('>f', random.random()))
+    return "".join(cells)
+
+class CellReader(SSTableReader20):
+    # decodes cells straight from memory, without sstable files
+    def __init__(self, data, reusecells):
+        self.buf = Buffer(data)
+        self.verbose = False
+        self.reusecells = reusecells
+        self.cells = {}
+
+def benchcells(count):
+    data = celldata(count)
+    def decode(reusecells):
+        reader = CellReader(data, reusecells)
+        total = 0
+        for i in xrange(count):
+            total += reader.unpack_column_value("c").ts
+        return total
+    expected = None
+    for (name, reusecells) in [("cells allocated", False), ("cells reused", True)]:
+        total = timeit(name, count, lambda: decode(reusecells))
+        if expected != None and total != expected:
+            print >> sys.stderr, "%s decoded wrong values" % (name)
+            sys.exit(1)
+        expected = total
+    def skip():
+        # what a projection does with the cells of other columns
+        reader = CellReader(data, False)
+        for i in xrange(count):
+            reader.skip_column_value()
+        return reader.buf.remaining()
+    if timeit("cells skipped", count, skip) != 0:
+        print >> sys.stderr, "cells skipped did not reach the end of the data"
+        sys.exit(1)
+
+M = "org.apache.cassandra.db.marshal."
+ROW_MIN_TIMESTAMP = 1442880000000000
+ROW_MIN_LOCAL_DELETION_TIME = 1442880000
+ROW_MIN_TTL = 10
+ROW_TIMESTAMP = 1581757206044154
+ROW_LOCAL_DELETION_TIME = 1581757306
+# the clustering, static and regular columns of the 3.x rows benchmark
+ROW_CLUSTERING = [M + "Int32Type", M + "ReversedType(%sUTF8Type)" % (M)]
+ROW_STATIC = [("s", M + "UTF8Type")]
+ROW_REGULAR = [("a", M + "Int32Type"), ("b", M + "UTF8Type"), ("c", M + "DoubleType"), ("d", M + "TimeUUIDType"),
+    ("l", M + "ListType(%sInt32Type)" % (M)), ("m", M + "MapType(%sUTF8Type,%sInt32Type)" % (M, M)),
+    ("t", M + "SetType(%sUTF8Type)" % (M)), ("u", M + "UserType(ks,75,6e:%sInt32Type,7a:%sUTF8Type)" % (M, M))]
+WIDE_REGULAR = [("w%d" % (i), M + "Int32Type") for i in xrange(70)]
+
+def vintdata3(s):
+    return vintbytes(len(s)) + s
+
+def deletion3(deletion):
+    # a (markedForDeleteAt, localDeletionTime) as deltas from the minimums
+    return vintbytes(deletion[0] - ROW_MIN_TIMESTAMP) + vintbytes(deletion[1] - ROW_MIN_LOCAL_DELETION_TIME)
+
+class PartitionBuilder:
+    # encodes 3.x rows as Cassandra's UnfilteredSerializer writes them,
+    # along with the (clustering, name, hex value, timestamp, flags, local
+    # deletion time, ttl) cells and ("t", start, end, markedForDeleteAt,
+    # localDeletionTime) tombstones the decoder should return
+    def __init__(self, key):
+        self.parts = [struct.pack('>H', len(key)), key, struct.pack('>iq', 0x7fffffff, -0x8000000000000000)]
+        self.cells = []
+        self.openmarker = None
+
+    def row(self, flags, clustering, ts, cells, extflags=None, columns="", ttl=None, deletion=None):
+        # clustering is a list of (encoded value, text) or None for empty
+        # values, cells are (encoded cell, expected cell or None), ttl is
+        # the (ttl, expiration) of the row
+        if extflags != None:
+            flags |= 0x80
+        self.parts.append(chr(flags))
+        if extflags != None:
+            self.parts.append(chr(extflags))
+        text = ""
+        if clustering != None:
+            header = 0
+            values = []
+            texts = []
+            for i in xrange(len(clustering)):
+                if clustering[i] == None:
+                    header |= 1 << (2 * i)
+                    texts.append("")
+                else:
+                    values.append(clustering[i][0])
+                    texts.append(clustering[i][1])
+            self.parts.append(vintbytes(header) + "".join(values))
+            text = ":".join(texts)
+        self.parts.append(vintbytes(0) + vintbytes(0))
+        if flags & 0x04:
+            self.parts.append(vintbytes(ts - ROW_MIN_TIMESTAMP))
+        if flags & 0x08:
+            self.parts.append(vintbytes(ttl[0] - ROW_MIN_TTL) + vintbytes(ttl[1] - ROW_MIN_LOCAL_DELETION_TIME))
+        if flags & 0x10:
+            self.parts.append(deletion3(deletion))
+            self.cells.append(("t", text, text) + deletion)
+        self.parts.append(columns)
+        for (data, expected) in cells:
+            self.parts.append(data)
+            if expected == None:
+                continue
+            if expected[0] == None:
+                # a complex deletion, a tombstone of the column
+                column = "%s:%s" % (text, expected[1])
+                self.cells.append(("t", column, column) + expected[2:])
+            else:
+                self.cells.append((text,) + expected)
+
+    def marker(self, kind, clustering, deletions):
+        # a range tombstone bound or boundary, clustering is a list of
+        # (encoded value, text) and deletions of (markedForDeleteAt,
+        # localDeletionTime)
+        text = ":".join([t for (v, t) in clustering])
+        self.parts.append(chr(0x02) + chr(kind) + struct.pack('>H', len(clustering)))
+        self.parts.append(vintbytes(0) + "".join([v for (v, t) in clustering]))
+        self.parts.append(vintbytes(0) + vintbytes(0) + "".join([deletion3(d) for d in deletions]))
+        if kind in (1, 7):
+            self.openmarker = text
+            return
+        self.cells.append(("t", self.openmarker or "", text) + deletions[0])
+        self.openmarker = None
+        if kind in (2, 5):
+            self.openmarker = text
+
+    def data(self):
+        return "".join(self.parts) + chr(0x01)
+
+def cell3(name, value, variable=False, ts=None, rowts=None, path=None, flags=0, ttl=None, rowttl=None):
+    # a cell with its own or the row timestamp and ttl and an optional
+    # path, the values of variable length types are written after their
+    # length
+    parts = []
+    if ts == None:
+        flags |= 0x08
+        ts = rowts
+    if rowttl != None:
+        flags |= 0x12
+    if value == None:
+        flags |= 0x04
+    parts.append(chr(flags))
+    if flags & 0x08 == 0:
+        parts.append(vintbytes(ts - ROW_MIN_TIMESTAMP))
+    localdeletiontime = None
+    if rowttl != None:
+        (ttl, localdeletiontime) = rowttl
+    elif flags & 0x03:
+        localdeletiontime = ROW_LOCAL_DELETION_TIME
+        parts.append(vintbytes(localdeletiontime - ROW_MIN_LOCAL_DELETION_TIME))
+        if flags & 0x02:
+            parts.append(vintbytes(ttl - ROW_MIN_TTL))
+    if path != None:
+        parts.append(vintdata3(path))
+        name = "%s:%s" % (name, binascii.hexlify(path))
+    if value != None:
+        if variable:
+            parts.append(vintdata3(value))
+        else:
+            parts.append(value)
+    return ("".join(parts), (name, binascii.hexlify(value or ""), ts, flags, localdeletiontime, ttl))
+
+def complex3(count, name=None, deletion=None):
+    # the cell count of a complex column, after its deletion if it has one
+    if deletion == None:
+        return (vintbytes(count), None)
+    return (deletion3(deletion) + vintbytes(count), (None, name) + deletion)
+
+def rowsdata(count):
+    # partitions of the regular table, count cells in total
+    rng = random.Random(count)
+    partitions = []
+    cells = 0
+    p = 0
+    while cells < count:
+        builder = PartitionBuilder(struct.pack('>i', p))
+        p += 1
+        ts = ROW_TIMESTAMP + p
+        text = "static%d" % (p)
+        builder.row(0x04 | 0x40, None, ts, [cell3("s", text, True, rowts=ts)], extflags=0x01)
+        for i in xrange(8):
+            clustering = [(struct.pack('>i', i), "%d" % (i)), (vintdata3("r%d" % (i)), "r%d" % (i))]
+            kind = i % 4
+            if kind == 0:
+                # every column, the cells of the complex ones follow their
+                # count and are named by their paths
+                c = [cell3("a", struct.pack('>i', rng.randint(-1000, 1000)), rowts=ts),
+                    cell3("b", "text%d" % (i), True, rowts=ts),
+                    cell3("c", struct.pack('>d', rng.random()), rowts=ts),
+                    cell3("d", uuid.UUID(int=rng.getrandbits(128), version=1).bytes, rowts=ts),
+                    complex3(2),
+                    cell3("l", struct.pack('>i', 1), rowts=ts, path=uuid.UUID(int=1, version=1).bytes),
+                    cell3("l", struct.pack('>i', 2), rowts=ts, path=uuid.UUID(int=2, version=1).bytes),
+                    complex3(1),
+                    cell3("m", struct.pack('>i', 5), rowts=ts, path="k"),
+                    complex3(2),
+                    cell3("t", None, rowts=ts, path="x"),
+                    cell3("t", None, rowts=ts, path="y"),
+                    complex3(2),
+                    cell3("u", struct.pack('>i', 7), rowts=ts, path=struct.pack('>h', 0)),
+                    cell3("u", "zip", True, rowts=ts, path=struct.pack('>h', 1))]
+                builder.row(0x04 | 0x40, clustering, ts, c)
+            elif kind == 1:
+                # a and l only, l after a complex deletion with an
+                # expiring element of its own timestamp
+                c = [cell3("a", struct.pack('>i', i), rowts=ts),
+                    complex3(1, "l", (ts - 5, ROW_LOCAL_DELETION_TIME - 6)),
+                    cell3("l", struct.pack('>i', 3), ts=ts + 1, path=uuid.UUID(int=3, version=1).bytes, flags=0x02, ttl=60)]
+                builder.row(0x04 | 0x20, clustering, ts, c, columns=vintbytes(0xff & ~0x11))
+            elif kind == 2:
+                # a deleted cell between the bounds of two range tombstones
+                # joined by a boundary
+                prefix = [clustering[0]]
+                builder.marker(1, prefix, [(ts - 10, ROW_LOCAL_DELETION_TIME - 10)])
+                c = [cell3("b", None, True, ts=ts, flags=0x01)]
+                builder.row(0x04, clustering, ts, c, columns=vintbytes(0xff & ~0x02))
+                builder.marker(5, prefix, [(ts - 10, ROW_LOCAL_DELETION_TIME - 10), (ts - 20, ROW_LOCAL_DELETION_TIME - 20)])
+                builder.marker(6, prefix, [(ts - 20, ROW_LOCAL_DELETION_TIME - 20)])
+            else:
+                # an empty text clustering value, a row ttl its cell uses
+                # and a row deletion
+                rowttl = (3600, ROW_LOCAL_DELETION_TIME + 3600)
+                c = [cell3("a", struct.pack('>i', -i), rowts=ts, rowttl=rowttl)]
+                builder.row(0x04 | 0x08 | 0x10, [clustering[0], None], ts, c, columns=vintbytes(0xff & ~0x01), ttl=rowttl, deletion=(ts - 1, ROW_LOCAL_DELETION_TIME))
+        partitions.append((builder.data(), builder.cells))
+        cells += len(builder.cells)
+    return partitions
+
+def widedata():
+    # 70 columns, rows of a few of them (present indexes are written) and
+    # of most of them (missing indexes are written)
+    builder = PartitionBuilder("wide")
+    ts = ROW_TIMESTAMP
+    few = [3, 40, 69]
+    columns = vintbytes(70 - len(few)) + "".join([vintbytes(i) for i in few])
+    builder.row(0x04, [(struct.pack('>i', 0), "0"), (vintdata3("w"), "w")], ts, [cell3("w%d" % (i), struct.pack('>i', i), rowts=ts) for i in few], columns=columns)
+    missing = [0, 64, 65]
+    columns = vintbytes(len(missing)) + "".join([vintbytes(i) for i in missing])
+    present = [i for i in xrange(70) if i not in missing]
+    builder.row(0x04, [(struct.pack('>i', 1), "1"), (vintdata3("w"), "w")], ts, [cell3("w%d" % (i), struct.pack('>i', i), rowts=ts) for i in present], columns=columns)
+    return (builder.data(), builder.cells)
+
+class HeaderStats:
+    # the part of the metadata 3.x rows read
+    def __init__(self):
+        self.esmintimestap = ROW_MIN_TIMESTAMP
+        self.esminlocaldeletiontime = ROW_MIN_LOCAL_DELETION_TIME
+        self.esminttl = ROW_MIN_TTL
+
+class RowReader(SSTableReader20):
+    # decodes 3.x partitions straight from memory
+    def __init__(self, data, regular):
+        self.buf = Buffer(data)
+        self.verbose = False
+        self.metadata = HeaderStats()
+        self.decoder = ssttypes.SchemaDecoder(ROW_CLUSTERING, ROW_STATIC, regular)
+
+def decodedcells(row):
+    cells = []
+    for cell in row.cells:
+        if isinstance(cell, RangeTombstone):
+            cells.append(("t", cell.mincol, cell.maxcol, cell.deletiontime.markedForDeleteAt, cell.deletiontime.localDeletionTime))
+        else:
+            (clustering, name, value, ts, flags, localdeletiontime, ttl) = cell
+            cells.append((clustering, name, binascii.hexlify(value or ""), ts, flags, localdeletiontime, ttl))
+    return cells
+
+def benchrows(count):
+    (data, expected) = widedata()
+    if decodedcells(Row(None, None, RowReader(data, WIDE_REGULAR), False)) != expected:
+        print >> sys.stderr, "3.x rows of a column subset decoded wrong cells"
+        sys.exit(1)
+    partitions = rowsdata(count)
+    total = sum([len(cells) for (data, cells) in partitions])
+    def decode():
+        return [Row(None, None, RowReader(data, ROW_REGULAR), False) for (data, cells) in partitions]
+    rows = timeit("3.x rows", total, decode)
+    for i in xrange(len(partitions)):
+        if decodedcells(rows[i]) != partitions[i][1]:
+            print >> sys.stderr, "3.x rows decoded wrong cells in partition %d" % (i)
+            sys.exit(1)
+
+# the sstables are generated once per run with a fixed seed, so every run
+# of a given count reads the same files
+CELLS_PER_PARTITION = 20
+SEED = 1
+tempdir = None
+generated = {}
+
+def generatedsstable(count, compressed):
+    global tempdir
+    if (count, compressed) not in generated:
+        if tempdir == None:
+            tempdir = tempfile.mkdtemp(prefix="benchmark")
+        table = "uncompressed"
+        if compressed:
+            table = "compressed"
+        directory = sstgen.tabledirectory(tempdir, "benchmark", table)
+        writer = sstgen.SSTableWriter20(directory, "benchmark", table, compressed=compressed)
+        partitions = max(count / CELLS_PER_PARTITION, 1)
+        sstgen.generate(writer, partitions, CELLS_PER_PARTITION, 4, (8, 32), 86400, 0.1, 0.01, 0.0, SEED)
+        sstable = SSTableFileName.parse(writer.close(), False)
+        generated[(count, compressed)] = (sstable, decodeall(sstable, compressed))
+    return generated[(count, compressed)]
+
+def openreader(sstable, compressed):
+    return SSTableReader20(sstable.indexfile(), sstable.datafile(), sstable.compfile(), compressed, True, False)
+
+def decodeall(sstable, compressed):
+    # decodes every cell the way an export does, without writing anything
+    reader = openreader(sstable, compressed)
+    cells = 0
+    while reader.hasnext():
+        row = reader.next()
+        while row.hasnextcolumn():
+            row.nextcolumn()
+            cells += 1
+    reader.buf.close()
+    return cells
+
+def datasize(sstable, compressed):
+    # throughput is measured over the uncompressed data
+    reader = openreader(sstable, compressed)
+    size = reader.buf.datasize
+    if compressed:
+        size = reader.buf.compmetadata.uncompressedlen
+    reader.buf.close()
+    return size
+
+def benchbuffer(count):
+    (sstable, cells) = generatedsstable(count, False)
+    timebytes("Buffer cells", datasize(sstable, False), lambda: decodeall(sstable, False))
+
+def benchcompressed(count):
+    (sstable, cells) = generatedsstable(count, True)
+    timebytes("CompressedBuffer cells", datasize(sstable, True), lambda: decodeall(sstable, True))
+
+def benchindex(count):
+    (sstable, cells) = generatedsstable(count, True)
+    size = os.stat(sstable.indexfile()).st_size
+    timebytes("IndexInfo.parse", size, lambda: IndexInfo.parse(sstable.indexfile()).rowcount)
+
+def benchmetadata(count):
+    # Statistics.db is small, it is parsed over and over and every field
+    # is decoded
+    (sstable, cells) = generatedsstable(count, True)
+    size = os.stat(sstable.statfile()).st_size
+    repeat = max(count / 1000, 1)
+    def parse():
+        for i in xrange(repeat):
+            sstmd.SSTableMetadata.parse(sstable.statfile(), sstable.sstversion).loadall()
+        return repeat
+    timebytes("SSTableMetadata.parse", size * repeat, parse)
+
+def benchexport(count):
+    (sstable, cells) = generatedsstable(count, True)
+    def export():
+        reader = openreader(sstable, True)
+        out = open(os.devnull, 'w')
+        sstable2json.export20(reader, out)
+        out.close()
+        reader.buf.close()
+        return cells
+    timebytes("export20 json", datasize(sstable, True), export)
+
+BENCHMARKS = {
+    "buffer": benchbuffer,
+    "cells": benchcells,
+    "compressed": benchcompressed,
+    "export": benchexport,
+    "index": benchindex,
+    "metadata": benchmetadata,
+    "rows": benchrows,
+    "vint": benchvint,
+}
+
+def main():
+    parser = argparse.ArgumentParser(prog="benchmark")
+    parser.add_argument("-n", "--count", help="number of values decoded by each benchmark", type=int, default=1000000)
+    parser.add_argument("benchmarks", type=str, nargs="*", help="benchmarks to run (%s), all by default" % (", ".join(sorted(BENCHMARKS.keys()))))
+    args = parser.parse_args()
+    names = args.benchmarks
+    if len(names) == 0:
+        names = sorted(BENCHMARKS.keys())
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark %s" % (name))
+    try:
+        for name in names:
+            BENCHMARKS[name](args.count)
+    finally:
+        if tempdir != None:
+            shutil.rmtree(tempdir)
+
+if __name__ == "__main__":
+    main()
@@ -17,25 +17,74 @@
 
 # a stand alone script to read rows and columns in a given SSTable
 
+import os
+import mmap
 import struct
 from datetime import datetime
 import uuid
 
+# precompiled formats, all SSTable components are big endian
+INT = struct.Struct('>i')
+SHORT = struct.Struct('>h')
+BYTE = struct.Struct('>B')
+SIGNED_BYTE = struct.Struct('>b')
+LONGLONG = struct.Struct('>Q')
+FLOAT = struct.Struct('>f')
+DOUBLE = struct.Struct('>d')
+EMPTY = memoryview('')
+
+# vint decoding tables indexed by the first byte: the number of extra
+# bytes is the count of its leading one bits, the rest of it are the high
+# bits of the value
+def leadingones(byte):
+    count = 0
+    while count < 8 and byte & (0x80 >> count) != 0:
+        count += 1
+    return count
+
+VINT_EXTRA_BYTES = tuple([leadingones(i) for i in xrange(256)])
+VINT_FIRST_MASK = tuple([0xff >> (VINT_EXTRA_BYTES[i] + 1) for i in xrange(256)])
+# formats reading the extra bytes near the start of a buffer, with the
+# shift of each unpacked part
+VINT_TAILS = (None,
+    (struct.Struct('>B'), (0,)),
+    (struct.Struct('>H'), (0,)),
+    (struct.Struct('>BH'), (16, 0)),
+    (struct.Struct('>I'), (0,)),
+    (struct.Struct('>BI'), (32, 0)),
+    (struct.Struct('>HI'), (32, 0)),
+    (struct.Struct('>BHI'), (48, 32, 0)),
+    (struct.Struct('>Q'), (0,)))
+VINT_VALUE_MASK = tuple([(1 << (7 * (extra + 1))) - 1 for extra in xrange(8)] + [(1 << 64) - 1])
+VINT_MAX_SIZE = 9
+
 debug = 0
 class Buffer:
     def __init__(self, buf):
+        self.setbuffer(buf)
+        if (debug):
+            print "buflen: %d" % (self.buflen)
+
+    def setbuffer(self, buf):
+        # byte fields are returned as slices of this view, they
+        # reference the buffer instead of copying out of it
         self.buf = buf
+        self.view = memoryview(buf)
         self.offset = 0
         self.buflen = len(buf)
-        if (debug):
-            print "buflen: %d" % (self.buflen)
 
     def readbytes(self, count):
-        if self.remaining() >= count:
-            return
-        if (debug):
-            print "count: ",count
-        self.rebuffer()
+        # a field can span more than one rebuffer worth of data
+        while self.remaining() < count:
+            if (debug):
+                print "count: ",count
+            self.rebuffer()
+
+    def readview(self, length):
+        self.readbytes(length)
+        value = self.view[self.offset:self.offset+length]
+        self.offset += length
+        return value
 
     def rebuffer(self):
         if (debug):
@@ -43,83 +92,71 @@ class Buffer:
         raise NotImplementedError("Not Implemented")
         
     def unpack_int(self):
-        int_size = struct.calcsize('i')
-        self.readbytes(int_size)
-        value = struct.unpack('>i', self.buf[self.offset:self.offset+int_size])[0]
-        self.offset += int_size
+        self.readbytes(INT.size)
+        value = INT.unpack_from(self.buf, self.offset)[0]
+        self.offset += INT.size
         return value
 
     def unpack_short(self):
-        short_size = struct.calcsize('h')
-        self.readbytes(short_size)
-        value = struct.unpack('>h', self.buf[self.offset:self.offset+short_size])[0]
-        self.offset += short_size
+        self.readbytes(SHORT.size)
+        value = SHORT.unpack_from(self.buf, self.offset)[0]
+        self.offset += SHORT.size
         return value
 
     def unpack_byte(self):
-        byte_size = struct.calcsize('B')
-        self.readbytes(byte_size)
-        value = struct.unpack('>B', self.buf[self.offset:self.offset+byte_size])[0]
-        self.offset += byte_size
+        self.readbytes(BYTE.size)
+        value = BYTE.unpack_from(self.buf, self.offset)[0]
+        self.offset += BYTE.size
         return value
 
     def unpack_signed_byte(self):
-        byte_size = struct.calcsize('b')
-        self.readbytes(byte_size)
-        value = struct.unpack('>b', self.buf[self.offset:self.offset+byte_size])[0]
-        self.offset += byte_size
+        self.readbytes(SIGNED_BYTE.size)
+        value = SIGNED_BYTE.unpack_from(self.buf, self.offset)[0]
+        self.offset += SIGNED_BYTE.size
         return value
 
+    def unpack_struct(self, fmt):
+        # several fixed width fields with one precompiled format
+        self.readbytes(fmt.size)
+        values = fmt.unpack_from(self.buf, self.offset)
+        self.offset += fmt.size
+        return values
+
     def unpack_utf_string(self):
         length = self.unpack_short()
         if length == 0:
-            return ""
+            return EMPTY
         if (debug):
             print "length: %d" % (length)
-        self.readbytes(length)
-        format = '%ds' % length
-        value = struct.unpack(format, self.buf[self.offset:self.offset+length])[0]
-        self.offset += length
-        return value
+        return self.readview(length)
 
     def unpack_longlong(self):
-        longlong_size = struct.calcsize('Q')
-        self.readbytes(longlong_size)
-        value = struct.unpack('>Q', self.buf[self.offset:self.offset+longlong_size])[0]
-        self.offset += longlong_size
+        self.readbytes(LONGLONG.size)
+        value = LONGLONG.unpack_from(self.buf, self.offset)[0]
+        self.offset += LONGLONG.size
         return value
 
     def unpack_float(self):
-        float_size = struct.calcsize('f')
-        self.readbytes(float_size)
-        value = struct.unpack('>f', self.buf[self.offset:self.offset+float_size])[0]
-        self.offset += float_size
+        self.readbytes(FLOAT.size)
+        value = FLOAT.unpack_from(self.buf, self.offset)[0]
+        self.offset += FLOAT.size
         return value
 
     def unpack_double(self):
-        double_size = struct.calcsize('d')
-        self.readbytes(double_size)
-        value = struct.unpack('>d', self.buf[self.offset:self.offset+double_size])[0]
-        self.offset += double_size
+        self.readbytes(DOUBLE.size)
+        value = DOUBLE.unpack_from(self.buf, self.offset)[0]
+        self.offset += DOUBLE.size
         return value
 
     def unpack_data(self):
         length = self.unpack_int()
         if length > 0:
-            self.readbytes(length)
-            format = '%ds' % length
-            value = struct.unpack(format, self.buf[self.offset:self.offset+length])[0]
-            self.offset += length
-            return value
+            return self.readview(length)
         return None
 
     def unpack_bytes(self, length):
         if length > 0:
-            self.readbytes(length)
-            format = '%ds' % length
-            value = struct.unpack(format, self.buf[self.offset:self.offset+length])[0]
-            self.offset += length
-            return value
+            return self.readview(length)
         return None
 
     def unpack_date(self):
@@ -136,10 +173,7 @@ class Buffer:
         length = self.unpack_short()
         if length == 0:
             return ""
-        self.readbytes(length)
-        format = '%ds' % length
-        value = struct.unpack(format, self.buf[self.offset:self.offset+length])[0]
-        self.offset += length
+        value = self.readview(length).tobytes()
         x = uuid.UUID(bytes=value)
         return str(x)
 
@@ -154,46 +188,45 @@ class Buffer:
         return "true"
 
     def unpack_vint(self):
-        byte = self.unpack_signed_byte()
-        # MSB bit test
-        if byte & 0x80 != 0x80:
-            return byte
-        # Get number of extra bytes to read
-        mask = 0x80
-        extrabytes = 0
-        while byte & mask != 0:            
-            extrabytes = extrabytes + 1
-            mask = mask >> 1
-        mask = 0x80
-        i = 0
-        while i < extrabytes - 1:
-            mask = mask >> 1
-            mask = mask | 0x80
-            i = i + 1
-        mask = (~mask & 0xff)
-        val = (byte & mask)
-        i = 0
-        while i < extrabytes:
-            val = val << 8
-            byte = self.unpack_signed_byte()
-            val = val | (byte & 0xff)
-            i = i + 1
-        return val
+        self.readbytes(1)
+        first = BYTE.unpack_from(self.buf, self.offset)[0]
+        extra = VINT_EXTRA_BYTES[first]
+        if extra == 0:
+            self.offset += 1
+            return first
+        self.readbytes(extra + 1)
+        (value, self.offset) = decodevint(self.buf, self.offset, first, extra)
+        return value
+
+    def unpack_vints(self, count):
+        # decodes count consecutive vints, in a single pass when the
+        # buffer surely holds all of them
+        if self.remaining() < count * VINT_MAX_SIZE:
+            return [self.unpack_vint() for i in xrange(count)]
+        buf = self.buf
+        offset = self.offset
+        values = []
+        for i in xrange(count):
+            first = BYTE.unpack_from(buf, offset)[0]
+            extra = VINT_EXTRA_BYTES[first]
+            if extra == 0:
+                values.append(first)
+                offset += 1
+            else:
+                (value, offset) = decodevint(buf, offset, first, extra)
+                values.append(value)
+        self.offset = offset
+        return values
 
     def unpack_vintlendata(self):
         length = self.unpack_vint()
         if length > 0:
-            self.readbytes(length)
-            format = '%ds' % length
-            value = struct.unpack(format, self.buf[self.offset:self.offset+length])[0]
-            self.offset += length
-            return value
+            return self.readview(length)
         return None
 
     def skip_data(self):
         length = self.unpack_int()
-        if length > 0:
-            self.offset += length
+        self.skip_bytes(length)
 
     def skip_bytes(self, length):
         if length > 0:
@@ -210,3 +243,48 @@ class Buffer:
 
     def seek(self, off):
         self.offset = off
+
+def decodevint(buf, offset, first, extra):
+    # value and end offset of the vint at offset, given its first byte and
+    # the number of extra bytes following it
+    end = offset + extra + 1
+    if end >= LONGLONG.size:
+        # the big endian long ending with the vint holds all of it, only
+        # the low 7 bits of each of its bytes are value bits
+        return (LONGLONG.unpack_from(buf, end - LONGLONG.size)[0] & VINT_VALUE_MASK[extra], end)
+    value = first & VINT_FIRST_MASK[first]
+    (fmt, shifts) = VINT_TAILS[extra]
+    tail = 0
+    for (part, shift) in zip(fmt.unpack_from(buf, offset + 1), shifts):
+        tail |= part << shift
+    return ((value << (extra * 8)) | tail, end)
+
+class MappedBuffer(Buffer):
+    def __init__(self, filename):
+        self.datasize = os.stat(filename).st_size
+        self.file = open(filename, 'r')
+        if self.datasize > 0:
+            self.buf = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.buf = ''
+        # the whole file is addressable, so there is nothing to rebuffer
+        # and seek is just an offset change
+        self.view = None
+        self.offset = 0
+        self.buflen = self.datasize
+
+    def readview(self, length):
+        # python2 can't take a memoryview of an mmap, slicing it copies
+        # only the requested field
+        self.readbytes(length)
+        value = memoryview(self.buf[self.offset:self.offset+length])
+        self.offset += length
+        return value
+
+    def rebuffer(self):
+        raise EOFError("read past the end of data at offset %d (data size %d)" % (self.offset, self.datasize))
+
+    def close(self):
+        if self.datasize > 0:
+            self.buf.close()
+        self.file.close()
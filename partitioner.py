@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specif
+
+# token calculation for the Cassandra partitioners
+
+import hashlib
+import binascii
+import itertools
+import multiprocessing
+import struct
+
+MASK64 = 0xffffffffffffffff
+C1 = 0x87c37b91114253d5
+C2 = 0x4cf5ad432745937f
+LONG_MIN_VALUE = -0x8000000000000000
+LONG_MAX_VALUE = 0x7fffffffffffffff
+BLOCK = struct.Struct('<QQ')
+
+def rotl64(v, n):
+    return ((v << n) | (v >> (64 - n))) & MASK64
+
+def fmix(k):
+    k ^= k >> 33
+    k = (k * 0xff51afd7ed558ccd) & MASK64
+    k ^= k >> 33
+    k = (k * 0xc4ceb9fe1a85ec53) & MASK64
+    k ^= k >> 33
+    return k
+
+def signed64(v):
+    if v & 0x8000000000000000:
+        return v - (1 << 64)
+    return v
+
+def murmur3hash(key, seed=0):
+    # port of org.apache.cassandra.utils.MurmurHash.hash3_x64_128, including
+    # its sign extension of the tail bytes, returns the two signed halves
+    length = len(key)
+    nblocks = length >> 4
+    h1 = seed
+    h2 = seed
+    for i in xrange(nblocks):
+        k1, k2 = BLOCK.unpack_from(key, i * 16)
+        k1 = (k1 * C1) & MASK64
+        k1 = rotl64(k1, 31)
+        k1 = (k1 * C2) & MASK64
+        h1 ^= k1
+        h1 = rotl64(h1, 27)
+        h1 = (h1 + h2) & MASK64
+        h1 = (h1 * 5 + 0x52dce729) & MASK64
+        k2 = (k2 * C2) & MASK64
+        k2 = rotl64(k2, 33)
+        k2 = (k2 * C1) & MASK64
+        h2 ^= k2
+        h2 = rotl64(h2, 31)
+        h2 = (h2 + h1) & MASK64
+        h2 = (h2 * 5 + 0x38495ab5) & MASK64
+
+    tail = struct.unpack('%db' % (length & 15), key[nblocks * 16:])
+    k1 = 0
+    k2 = 0
+    for i in xrange(len(tail) - 1, 7, -1):
+        k2 ^= (tail[i] << ((i - 8) * 8)) & MASK64
+    if len(tail) > 8:
+        k2 = (k2 * C2) & MASK64
+        k2 = rotl64(k2, 33)
+        k2 = (k2 * C1) & MASK64
+        h2 ^= k2
+    for i in xrange(min(len(tail), 8) - 1, -1, -1):
+        k1 ^= (tail[i] << (i * 8)) & MASK64
+    if len(tail) > 0:
+        k1 = (k1 * C1) & MASK64
+        k1 = rotl64(k1, 31)
+        k1 = (k1 * C2) & MASK64
+        h1 ^= k1
+
+    h1 ^= length
+    h2 ^= length
+    h1 = (h1 + h2) & MASK64
+    h2 = (h2 + h1) & MASK64
+    h1 = fmix(h1)
+    h2 = fmix(h2)
+    h1 = (h1 + h2) & MASK64
+    h2 = (h2 + h1) & MASK64
+    return (signed64(h1), signed64(h2))
+
+def murmur3token(key):
+    token = murmur3hash(key)[0]
+    if token == LONG_MIN_VALUE:
+        return LONG_MAX_VALUE
+    return token
+
+def randomtoken(key):
+    # Calculate MD5 digest and convert it to 2's complement form
+    token = long(hashlib.md5(key).hexdigest(), 16)
+    bits = 128
+    if ((token & (1 << (bits - 1))) != 0):
+        token = token - (1 << bits)
+    return abs(token)
+
+def bytestoken(key):
+    return key
+
+PARTITIONERS = {
+    'org.apache.cassandra.dht.Murmur3Partitioner': murmur3token,
+    'org.apache.cassandra.dht.RandomPartitioner': randomtoken,
+    'org.apache.cassandra.dht.ByteOrderedPartitioner': bytestoken,
+    'org.apache.cassandra.dht.OrderPreservingPartitioner': bytestoken,
+}
+
+ALIASES = {
+    'murmur3': 'org.apache.cassandra.dht.Murmur3Partitioner',
+    'random': 'org.apache.cassandra.dht.RandomPartitioner',
+    'byteordered': 'org.apache.cassandra.dht.ByteOrderedPartitioner',
+}
+
+# keys handed to a worker process at a time in batch mode
+BATCH_SIZE = 10000
+
+def gettokenfunction(partitioner):
+    partitioner = ALIASES.get(partitioner, partitioner)
+    if partitioner not in PARTITIONERS:
+        raise ValueError("partitioner %s not supported" % (partitioner))
+    return PARTITIONERS[partitioner]
+
+def parsetoken(partitioner, text):
+    # tokens are numbers, except for the byte ordered partitioners where
+    # the token is the key itself given in hex format
+    if gettokenfunction(partitioner) == bytestoken:
+        return binascii.unhexlify(text)
+    return int(text)
+
+def formattoken(token):
+    # the text parsetoken reads back, byte tokens in hex format
+    if isinstance(token, str):
+        return binascii.hexlify(token)
+    return "%d" % (token)
+
+def tokenbatch(task):
+    # formats one batch of input lines as key<TAB>token lines
+    (lines, partitioner, hexkeys) = task
+    token = gettokenfunction(partitioner)
+    out = []
+    for line in lines:
+        key = line.rstrip("\r\n")
+        if key == "":
+            continue
+        if hexkeys:
+            out.append("%s\t%s\n" % (key, formattoken(token(binascii.unhexlify(key)))))
+        else:
+            out.append("%s\t%s\n" % (key, formattoken(token(key))))
+    return "".join(out)
+
+def batches(lines, partitioner, hexkeys):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) == BATCH_SIZE:
+            yield (batch, partitioner, hexkeys)
+            batch = []
+    if len(batch) > 0:
+        yield (batch, partitioner, hexkeys)
+
+def tokenize(lines, out, partitioner, hexkeys, workers):
+    # streams key<TAB>token for every line, in input order. A single batch
+    # is done inline, larger inputs are spread over a process pool
+    gettokenfunction(partitioner)
+    tasks = batches(lines, partitioner, hexkeys)
+    head = list(itertools.islice(tasks, 2))
+    tasks = itertools.chain(head, tasks)
+    if len(head) < 2 or workers <= 1:
+        for task in tasks:
+            out.write(tokenbatch(task))
+        return
+    pool = multiprocessing.Pool(workers)
+    for text in pool.imap(tokenbatch, tasks):
+        out.write(text)
+    pool.close()
+    pool.join()
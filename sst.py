@@ -17,12 +17,19 @@
 
 # a stand alone script to read metadata of a given SSTable
 from sstmd import SSTableMetadata
+from sstmdcache import MetadataCache
+from sstscan import findsstables
 from sstidx import IndexInfo
-from sstable import SSTableFileName,SSTableReader
+from sstable import SSTableFileName,SSTableReader,SSTableReader20
 import sstable2json
+import sstnpy
+import sststats
+import partitioner
 import argparse
+import binascii
 import sys
 import os
+import time
 
 
 parser = argparse.ArgumentParser(prog="sst")
@@ -31,37 +38,201 @@ parser.add_argument("-i", "--index", help="display SSTable index information", a
 parser.add_argument("-d", "--data", help="display SSTable data in json format", action="store_true")
 parser.add_argument("-c", "--cql", help="display SSTable cql rows", action="store_true")
 parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
-parser.add_argument("sstable", type=str, help="SSTable file")
+parser.add_argument("--prefetch", help="number of compressed chunks to read ahead", type=int, default=0)
+parser.add_argument("--threads", help="number of threads decompressing read ahead chunks", type=int, default=1)
+parser.add_argument("-k", "--key", help="export only the partition with this key (in hex format)", type=str)
+parser.add_argument("--start-token", help="export only partitions with a token greater than this one", type=str)
+parser.add_argument("--end-token", help="export only partitions with a token up to and including this one", type=str)
+parser.add_argument("--write-buffer", help="bytes of JSON output collected before each write, 0 writes through", type=int, default=sstable2json.WRITE_BUFFER_SIZE)
+parser.add_argument("-f", "--format", help="data export format, npy writes column files to the --output directory", choices=["json", "ndjson", "npy"], default="json")
+parser.add_argument("-o", "--output", help="directory for the npy export", type=str)
+parser.add_argument("--columns", help="export only these columns, a comma separated list of names", type=str)
+parser.add_argument("-j", "--jobs", help="number of processes exporting partition ranges in parallel", type=int, default=1)
+parser.add_argument("--min-timestamp", help="skip sstables without cells written at or after this time (microseconds)", type=int)
+parser.add_argument("--max-timestamp", help="skip sstables without cells written at or before this time (microseconds)", type=int)
+parser.add_argument("--clustering-start", help="skip sstables without rows from this clustering prefix on, hex components separated by ':'", type=str)
+parser.add_argument("--clustering-end", help="skip sstables without rows up to this clustering prefix, hex components separated by ':'", type=str)
+parser.add_argument("--live-only", help="skip sstables whose cells are all deleted or expired", action="store_true")
+parser.add_argument("--metadata-cache", help="file caching the parsed metadata, only new or changed SSTables are parsed", type=str)
+parser.add_argument("--histograms", help="with -m, display the partition size and cell count percentiles of all SSTables of each table", action="store_true")
+parser.add_argument("--gc-grace", help="gc_grace_seconds the droppable tombstones of --histograms are counted with", type=int, default=864000)
+parser.add_argument("--stats", help="write counters and per stage timings of the run to stderr as JSON at exit", action="store_true")
+parser.add_argument("sstables", type=str, nargs="+", help="SSTable files, or directories searched for SSTables")
 args = parser.parse_args()
-option = "metadata"
 verbose = False
 if args.verbose:
     verbose = True
-if args.sstable is None:
-    print "please specify sstable file"
-    sys.exit(1)
-filename = args.sstable
-sstable = SSTableFileName.parse(filename, verbose)
+    # keep the JSON in step with the diagnostics printed while parsing
+    args.write_buffer = 0
+pruning = args.live_only or (args.min_timestamp, args.max_timestamp, args.clustering_start, args.clustering_end) != (None, None, None, None)
 
-if args.metadata:
-    metadata = SSTableMetadata.parse(sstable.statfile(), sstable.sstversion)
-    print metadata
-elif args.index:
-    index = IndexInfo.parse(sstable.indexfile())
-    print index
-elif args.data:
-    if os.path.isfile(sstable.datafile()) != True:
-        print "%s not exists" % sstable.datafile()
-        sys.exit(1)
+def clusteringprefix(text):
+    # hex components separated by ':', as cell names are printed
+    if text is None:
+        return None
+    return [binascii.unhexlify(c) for c in text.split(":")]
 
-    if os.path.isfile(sstable.datafile()) != True:
-        print "%s not exists" % sstable.datafile()
-        sys.exit(1)
+def readmetadata(sstable):
+    if cache != None:
+        return cache.parse(sstable.statfile(), sstable.sstversion)
+    return SSTableMetadata.parse(sstable.statfile(), sstable.sstversion)
 
-    compressed = True
-    if os.path.isfile(sstable.compfile()) != True:
-        compressed = False
+def pruned(sstable):
+    # skips sstables whose metadata rules out any matching data without
+    # reading their Data.db
+    metadata = readmetadata(sstable)
+    if metadata.overlapstime(args.min_timestamp, args.max_timestamp) != True:
+        return True
+    if metadata.overlapsclustering(clusteringprefix(args.clustering_start), clusteringprefix(args.clustering_end)) != True:
+        return True
+    if args.live_only and metadata.isexpired(int(time.time())):
+        return True
+    return False
 
-    reader = SSTableReader(sstable.indexfile(), sstable.datafile(), sstable.compfile(), compressed, args.cql, args.verbose)
-    sstable2json.export(reader)
+def unsupported3x():
+    # options the 3.x reader does not implement yet
+    options = []
+    if args.key != None:
+        options.append("--key")
+    if args.start_token != None or args.end_token != None:
+        options.append("--start-token/--end-token")
+    if args.jobs > 1:
+        options.append("--jobs")
+    if args.columns != None:
+        options.append("--columns")
+    return options
 
+def separate():
+    # the arrays of several sstables are the elements of one outer array
+    global exported
+    if wrapped and exported > 0:
+        sys.stdout.write(",\n")
+    exported += 1
+
+def process(sstable, output):
+    if args.metadata and args.histograms:
+        table = os.path.dirname(os.path.abspath(sstable.datafile()))
+        if table not in histograms:
+            # numpy is only needed for the histograms
+            from ssthist import TableHistograms
+            histograms[table] = TableHistograms(int(time.time()) - args.gc_grace)
+            tables.append(table)
+        histograms[table].add(readmetadata(sstable))
+    elif args.metadata:
+        metadata = readmetadata(sstable)
+        print metadata
+    elif args.index:
+        count = 0
+        for (key, pos) in IndexInfo.iterate(sstable.indexfile()):
+            print "key: %s position: %d" % (binascii.hexlify(key), pos)
+            count += 1
+        print "row count: %d" % (count)
+    elif args.data:
+        if os.path.isfile(sstable.datafile()) != True:
+            print >> sys.stderr, "%s not exists" % sstable.datafile()
+            return False
+
+        compressed = True
+        if os.path.isfile(sstable.compfile()) != True:
+            compressed = False
+
+        if args.format == "npy" and output is None:
+            print >> sys.stderr, "please specify the output directory of the npy export"
+            return False
+
+        columns = None
+        if args.columns != None:
+            columns = args.columns.split(",")
+
+        if sstable.sstversion >= 'ma':
+            if args.format != "json":
+                print >> sys.stderr, "%s export is not supported for version %s" % (args.format, sstable.sstversion)
+                return False
+            options = unsupported3x()
+            if len(options) > 0:
+                print >> sys.stderr, "%s not supported for version %s" % (", ".join(options), sstable.sstversion)
+                return False
+            separate()
+            reader = SSTableReader(sstable.indexfile(), sstable.datafile(), sstable.compfile(), compressed, args.cql, args.verbose, prefetch=args.prefetch, workers=args.threads)
+            sstable2json.export(reader, blocksize=args.write_buffer)
+        elif args.key:
+            separate()
+            reader = SSTableReader20(sstable.indexfile(), sstable.datafile(), sstable.compfile(), compressed, args.cql, args.verbose)
+            reader.setcolumns(columns)
+            sstable2json.export20key(reader, binascii.unhexlify(args.key))
+        else:
+            starttoken = None
+            endtoken = None
+            if args.start_token != None or args.end_token != None:
+                name = readmetadata(sstable).partitioner
+                if args.start_token != None:
+                    starttoken = partitioner.parsetoken(name, args.start_token)
+                if args.end_token != None:
+                    endtoken = partitioner.parsetoken(name, args.end_token)
+            separate()
+            if args.jobs > 1 and args.format != "npy":
+                sstable2json.export20parallel(sstable.indexfile(), sstable.datafile(), sstable.compfile(), compressed, args.cql, args.jobs, starttoken, endtoken, blocksize=args.write_buffer, ndjson=(args.format == "ndjson"), columns=columns)
+            else:
+                reader = SSTableReader20(sstable.indexfile(), sstable.datafile(), sstable.compfile(), compressed, args.cql, args.verbose, prefetch=args.prefetch, workers=args.threads)
+                reader.setcolumns(columns)
+                if starttoken != None or endtoken != None:
+                    reader.settokenrange(starttoken, endtoken)
+                if args.format == "npy":
+                    sstnpy.export20npy(reader, output)
+                elif args.format == "ndjson":
+                    sstable2json.export20ndjson(reader, blocksize=args.write_buffer)
+                else:
+                    sstable2json.export20(reader, blocksize=args.write_buffer)
+    return True
+
+cache = None
+if args.metadata_cache != None:
+    cache = MetadataCache(args.metadata_cache)
+filenames = []
+for filename in args.sstables:
+    if os.path.isdir(filename):
+        filenames.extend([files.sstable.datafile() for files in findsstables(filename)])
+    else:
+        filenames.append(filename)
+histograms = {}
+tables = []
+stats = None
+if args.stats:
+    stats = sststats.enable()
+status = 0
+wrapped = args.data and args.format == "json" and len(filenames) > 1
+exported = 0
+if wrapped:
+    sys.stdout.write("[\n")
+for filename in filenames:
+    sstable = SSTableFileName.parse(filename, verbose)
+    if sstable == None:
+        print >> sys.stderr, "%s is not an sstable file" % (filename)
+        status = 1
+        continue
+    if pruning and pruned(sstable):
+        if verbose:
+            print >> sys.stderr, "%s skipped by its metadata" % (filename)
+        continue
+    output = args.output
+    if output != None and len(filenames) > 1:
+        # one directory per sstable, under one per table
+        datafile = os.path.abspath(sstable.datafile())
+        output = os.path.join(output, os.path.basename(os.path.dirname(datafile)), os.path.basename(datafile)[:-len("-Data.db")])
+    start = time.time()
+    if process(sstable, output) != True:
+        status = 1
+    if stats != None:
+        stats.count("sstables")
+        stats.addtime("export", time.time() - start)
+if wrapped:
+    sys.stdout.write("]\n")
+for table in tables:
+    print "%s\n%s" % (table, histograms[table])
+if stats != None:
+    stats.report()
+if cache != None:
+    cache.close()
+    if verbose:
+        print >> sys.stderr, "metadata cache: %d hits %d misses" % (cache.hits, cache.misses)
+sys.exit(status)
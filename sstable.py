@@ -23,9 +23,19 @@ import struct
 import binascii
 import lz4.block
 import re
+import time
+import collections
+import json
+import threading
+from multiprocessing.pool import ThreadPool
 import binascii 
-from buffer import Buffer
+from buffer import Buffer, MappedBuffer, INT
+from sstidx import IndexInfo
 import sstmd
+import partitioner
+import sstfilter
+import sststats
+import ssttypes
 
 LIVE_MASK            = 0x00
 DELETION_MASK        = 0x01
@@ -35,10 +45,121 @@ COUNTER_UPDATE_MASK  = 0x08
 RANGE_TOMBSTONE_MASK = 0x10
 INT_MAX_VALUE = 0x7fffffff
 LONG_MIN_VALUE = 0x8000000000000000
-BUFFSIZE = 65536
+SUMMARY_POSITION = struct.Struct('<q')
+# timestamp and value length of a cell, read together
+CELL_TIMESTAMP_LENGTH = struct.Struct('>Qi')
+# value length of a skipped cell, after its timestamp or after the extra
+# fields of counter and expiring cells
+SKIP_CELL = struct.Struct('>8xi')
+SKIP_LONG_CELL = struct.Struct('>16xi')
+CHUNK_CACHE_SIZE = 8 * 1024 * 1024
+# 3.x unfiltered (row) flags, extended flags and cell flags
+END_OF_PARTITION     = 0x01
+IS_MARKER            = 0x02
+HAS_TIMESTAMP        = 0x04
+HAS_TTL              = 0x08
+HAS_DELETION         = 0x10
+HAS_COMPLEX_DELETION = 0x20
+HAS_ALL_COLUMNS      = 0x40
+EXTENSION_FLAG       = 0x80
+IS_STATIC            = 0x01
+# the ordinals of the range tombstone marker kinds opening a range, and
+# of the boundaries closing one and opening the next
+START_BOUND_KINDS    = (1, 7)
+BOUNDARY_KINDS       = (2, 5)
+CELL_IS_DELETED      = 0x01
+CELL_IS_EXPIRING     = 0x02
+CELL_HAS_EMPTY_VALUE = 0x04
+CELL_USE_ROW_TIMESTAMP = 0x08
+CELL_USE_ROW_TTL     = 0x10
+
+class ChunkCache:
+    def __init__(self, capacity):
+        # capacity is a budget in uncompressed bytes
+        self.capacity = capacity
+        self.size = 0
+        self.chunks = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chunkno):
+        chunk = self.chunks.pop(chunkno, None)
+        if chunk is None:
+            self.misses += 1
+            return None
+        # re-insert to mark it as most recently used
+        self.chunks[chunkno] = chunk
+        self.hits += 1
+        return chunk
+
+    def put(self, chunkno, chunk):
+        if len(chunk) > self.capacity:
+            return
+        old = self.chunks.pop(chunkno, None)
+        if old is not None:
+            self.size -= len(old)
+        self.chunks[chunkno] = chunk
+        self.size += len(chunk)
+        while self.size > self.capacity:
+            evicted = self.chunks.popitem(last=False)[1]
+            self.size -= len(evicted)
+
+    def __repr__(self):
+        return "chunks: %d size: %d capacity: %d hits: %d misses: %d" % (len(self.chunks), self.size, self.capacity, self.hits, self.misses)
+
+class ChunkPrefetcher:
+    def __init__(self, buffer, depth, workers):
+        # keeps up to depth chunks ahead of the consumer being read and
+        # decompressed on a pool of threads, file reads and lz4 both
+        # release the GIL so the workers overlap with the parser
+        self.buffer = buffer
+        self.depth = depth
+        self.pool = ThreadPool(workers)
+        self.local = threading.local()
+        self.files = []
+        self.lock = threading.Lock()
+        self.pending = collections.deque()
+        self.nextchunkno = 0
+
+    def get(self, chunkno):
+        while len(self.pending) > 0 and self.pending[0][0] < chunkno:
+            self.pending.popleft()
+        if len(self.pending) == 0 or self.pending[0][0] != chunkno:
+            # random access, restart the pipeline at the requested chunk
+            self.pending.clear()
+            self.nextchunkno = chunkno
+            self.fill()
+        result = self.pending.popleft()[1]
+        self.fill()
+        return result.get()
+
+    def fill(self):
+        while len(self.pending) < self.depth and self.nextchunkno < self.buffer.compmetadata.chunkcount:
+            result = self.pool.apply_async(self.load, (self.nextchunkno,))
+            self.pending.append((self.nextchunkno, result))
+            self.nextchunkno += 1
+
+    def load(self, chunkno):
+        # each worker reads through its own file handle
+        f = getattr(self.local, 'file', None)
+        if f is None:
+            f = open(self.buffer.datafile, 'r')
+            self.local.file = f
+            with self.lock:
+                self.files.append(f)
+        return self.buffer.loadchunk(f, chunkno)
+
+    def close(self):
+        self.pending.clear()
+        self.pool.terminate()
+        self.pool.join()
+        with self.lock:
+            for f in self.files:
+                f.close()
+            self.files = []
 
 class CompressedBuffer(Buffer):
-    def __init__(self, datafile, compfile, verbose):
+    def __init__(self, datafile, compfile, verbose, cachesize=CHUNK_CACHE_SIZE, prefetch=0, workers=1):
         self.compmetadata = CompressionInfo.parse(compfile)
         self.verbose = verbose
         if (self.verbose):
@@ -46,11 +167,18 @@ class CompressedBuffer(Buffer):
         self.datasize = os.stat(datafile).st_size
         if (self.verbose):
             print " data size %d" % (self.datasize)
+        self.datafile = datafile
         self.file = open(datafile, 'r')
+        self.cache = ChunkCache(cachesize)
+        self.stats = sststats.current
+        self.prefetcher = None
+        if prefetch > 0:
+            self.prefetcher = ChunkPrefetcher(self, prefetch, workers)
         self.chunkno = 0
         self.remaininglen = self.datasize
         self.buflen = 0
         self.buf = None
+        self.view = None
         self.offset = 0
         self.buflen = 0
 
@@ -60,21 +188,40 @@ class CompressedBuffer(Buffer):
         seekpos = self.compmetadata.chunkoffsets[skipchunkcount]
         if (self.verbose):
             print "row-pos: %d chunklen: %d skipchunkcount: %d seekpos: %d skipbytes: %d" % (pos, self.compmetadata.chunklen, skipchunkcount, seekpos, skipbytes)
-        self.file.seek(seekpos)
         self.buf = None
+        self.view = None
         self.offset = 0
         self.buflen = 0
         self.chunkno = skipchunkcount
         self.rebuffer()
         self.offset = skipbytes
 
+    def position(self):
+        # uncompressed position of offset, every chunk but the last one
+        # holds chunklen bytes
+        end = min(self.chunkno * self.compmetadata.chunklen, self.compmetadata.uncompressedlen)
+        return end - (self.buflen - self.offset)
+
+    def skip_bytes(self, length):
+        if length <= 0:
+            return
+        if self.offset + length <= self.buflen:
+            self.offset += length
+            return
+        # skipped chunks are neither read nor decompressed
+        pos = self.position() + length
+        if pos >= self.compmetadata.uncompressedlen:
+            self.chunkno = self.compmetadata.chunkcount
+            self.setbuffer('')
+            return
+        self.seek(pos)
+
     def rebuffer(self):
         if (self.verbose):
             print "buflen: %d offset: %d" % (self.buflen, self.offset)        
-        self.buf = self.nextchunk()
-        assert self.buf != None
-        self.offset = 0
-        self.buflen = len(self.buf)
+        buf = self.nextchunk()
+        assert buf != None
+        self.setbuffer(buf)
         if (self.verbose):
             print "buflen: %d" % (self.buflen)
 
@@ -86,27 +233,62 @@ class CompressedBuffer(Buffer):
     def nextchunk(self):
         if self.chunkno >= self.compmetadata.chunkcount:
             return
-        if (self.chunkno + 1 < self.compmetadata.chunkcount):
-            chunklen = self.compmetadata.chunkoffsets[self.chunkno + 1] - self.compmetadata.chunkoffsets[self.chunkno]
-            chunk = self.file.read(chunklen)
-        else:
-            chunk = self.file.read()
-        if (self.verbose):
-            print "chunklen: ", len(chunk)
+        b = self.readchunk(self.chunkno)
         self.chunkno += 1
-        newbuf = bytearray('')
         if self.remaining() > 0:
             if (self.verbose):
                 print "remaining: %d remaining data: %s" % (self.remaining(), self.get_remaining())
-            b1 = self.get_remaining()
-            newbuf.extend(b1)
-        b = self.uncompress_chunk(chunk)
+            return self.get_remaining() + b
+        return b
+
+    def readchunk(self, chunkno):
+        b = self.cache.get(chunkno)
+        if b is not None:
+            if self.stats != None:
+                self.stats.count("chunk cache hits")
+            return b
+        if self.prefetcher != None:
+            b = self.prefetcher.get(chunkno)
+        else:
+            if (self.verbose):
+                start, end = self.chunkbounds(chunkno)
+                print "chunklen: ", end - start
+            b = self.loadchunk(self.file, chunkno)
         if (self.verbose):
             print "uncompressed chunklen: ", len(b)
             self.hexdump(b)
-        newbuf.extend(b)
-        #newbuf = self.uncompress_chunk(chunk)
-        return str(newbuf)
+        self.cache.put(chunkno, b)
+        return b
+
+    def loadchunk(self, f, chunkno):
+        # reads and decompresses a chunk through the file handle f
+        start, end = self.chunkbounds(chunkno)
+        f.seek(start)
+        if self.stats == None:
+            return self.uncompress_chunk(f.read(end - start))
+        t0 = time.time()
+        chunk = f.read(end - start)
+        t1 = time.time()
+        b = self.uncompress_chunk(chunk)
+        self.stats.addtime("decompress", time.time() - t1)
+        self.stats.addtime("read", t1 - t0)
+        self.stats.count("bytes read", len(chunk))
+        self.stats.count("bytes decompressed", len(b))
+        self.stats.count("chunks decompressed")
+        return b
+
+    def chunkbounds(self, chunkno):
+        start = self.compmetadata.chunkoffsets[chunkno]
+        if (chunkno + 1 < self.compmetadata.chunkcount):
+            end = self.compmetadata.chunkoffsets[chunkno + 1]
+        else:
+            end = self.datasize
+        return (start, end)
+
+    def close(self):
+        if self.prefetcher != None:
+            self.prefetcher.close()
+        self.file.close()
 
     def uncompress_chunk(self, compressed):
         # skip checksum
@@ -128,66 +310,51 @@ class CompressedBuffer(Buffer):
         f.write(b)
         f.close()
 
-class UncompressedBuffer(Buffer):
+class UncompressedBuffer(MappedBuffer):
     def __init__(self, datafile, verbose):
-        self.datasize = os.stat(datafile).st_size
-        self.file = open(datafile, 'r')
-        self.buf = None
-        self.offset = 0
-        self.buflen = 0
-        self.nextchunk = 0
+        MappedBuffer.__init__(self, datafile)
         self.verbose = verbose
-
-    def rebuffer(self):
+        self.stats = sststats.current
+        # the mapped data up to here is counted as read
+        self.counted = 0
+        if self.stats != None:
+            # the plain readbytes is kept when the stats are off
+            self.readbytes = self.countedreadbytes
         if (self.verbose):
-            print "buflen: %d offset: %d" % (self.buflen, self.offset)
-        newbuf = bytearray('')
-        if self.remaining() > 0:
-            if (self.verbose):
-                print "remaining: %d remaining data: %s" % (self.remaining(), self.get_remaining())
-            b1 = self.get_remaining()
-            newbuf.extend(b1)
-        if self.nextchunk + BUFFSIZE < self.datasize:
-            newbuf.extend(self.file.read(BUFFSIZE))
-            self.nextchunk = self.nextchunk + BUFFSIZE
-        else:
-            newbuf.extend(self.file.read())
-            self.nextchunk = self.datasize
-        self.buf = str(newbuf)
-        #assert self.buf != None
-        self.buflen = len(self.buf)
-        self.offset = 0
-        if (self.verbose):
-            print "buflen: %d nextchunk: %d datasize: %d" % (self.buflen, self.nextchunk, self.datasize)
+            print "mapped data size %d" % (self.datasize)
 
-class IndexInfo:
-    def __init__(self, entries):
-        self.entries = entries
-        self.rowcount = len(self.entries)
+    def countread(self, end=None):
+        # counts the mapped data passed over since the last count
+        if end == None:
+            end = self.offset
+        if self.stats != None and end > self.counted:
+            self.stats.count("bytes read", end - self.counted)
+        self.counted = max(self.counted, end)
 
-    def parse(self, filename):
-        size = os.stat(filename).st_size
-        remaining = size
-        f = open(filename, 'r')
-        buf = Buffer(f.read())
-        f.close()
-        entries = []
-        while buf.remaining() > 0:
-            key = buf.unpack_utf_string()
-            pos = buf.unpack_longlong()
-            buf.skip_data()
-            entries.append((key, pos))
-        return IndexInfo(entries)
-    parse = classmethod(parse)
+    def countedreadbytes(self, count):
+        MappedBuffer.readbytes(self, count)
+        self.countread(self.offset + count)
+
+    def seek(self, off):
+        self.countread()
+        MappedBuffer.seek(self, off)
+        self.counted = off
+
+    def close(self):
+        self.countread()
+        MappedBuffer.close(self)
 
 class IndexSummary:
-     def __init__(self, offsetCount, fullSamplingSummarySize, minIndexInterval, samplingLevel, first, last):
+     def __init__(self, offsetCount, fullSamplingSummarySize, minIndexInterval, samplingLevel, first, last, keys, positions):
          self.offsetCount = offsetCount
          self.fullSamplingSummarySize = fullSamplingSummarySize
          self.minIndexInterval = minIndexInterval
          self.samplingLevel = samplingLevel
          self.first = first
          self.last = last
+         # sampled partition keys and their positions in Index.db
+         self.keys = keys
+         self.positions = positions
 
      def parse(self, filename):
          size = os.stat(filename).st_size
@@ -200,13 +367,42 @@ class IndexSummary:
          offheapSize = buf.unpack_longlong()
          samplingLevel = buf.unpack_int()
          fullSamplingSummarySize = buf.unpack_int()
-         buf.skip_bytes(offsetCount * 4)
-         buf.skip_bytes(offheapSize - offsetCount * 4);
-         first = buf.unpack_data()
-         last = buf.unpack_data()
-         return IndexSummary(offsetCount, fullSamplingSummarySize, minIndexInterval, samplingLevel, first, last)
+         # the offsets and the entries they point at are written in native
+         # (little endian) byte order, offsets are relative to the start of
+         # the offsets themselves
+         base = buf.offset
+         offsets = struct.unpack_from('<%di' % offsetCount, buf.buf, base)
+         keys = []
+         positions = []
+         for i in xrange(offsetCount):
+             start = base + offsets[i]
+             if i + 1 < offsetCount:
+                 end = base + offsets[i + 1]
+             else:
+                 end = base + offheapSize
+             keys.append(buf.buf[start:end - 8])
+             positions.append(SUMMARY_POSITION.unpack_from(buf.buf, end - 8)[0])
+         buf.skip_bytes(offheapSize)
+         first = buf.unpack_data().tobytes()
+         last = buf.unpack_data().tobytes()
+         return IndexSummary(offsetCount, fullSamplingSummarySize, minIndexInterval, samplingLevel, first, last, keys, positions)
      parse = classmethod(parse)
 
+     def search(self, key, token):
+         # binary search for the last sampled key that sorts before or at
+         # key in partitioner order, -1 if key sorts before all of them
+         target = (token(key), key)
+         lo = 0
+         hi = len(self.keys)
+         while lo < hi:
+             mid = (lo + hi) / 2
+             k = self.keys[mid]
+             if target < (token(k), k):
+                 hi = mid
+             else:
+                 lo = mid + 1
+         return lo - 1
+
 class CompressionInfo:
     def __init__(self, classname, pc, params, datalen, clen, cc, offsets):
         self.classname = classname
@@ -223,12 +419,12 @@ class CompressionInfo:
         f = open(filename, 'r')
         buf = Buffer(f.read())
         f.close()
-        classname = buf.unpack_utf_string()
+        classname = buf.unpack_utf_string().tobytes()
         paramcount = buf.unpack_int()
         params = {}
         for i in xrange(paramcount):
-            name = buf.unpack_utf_string()
-            value = buf.unpack_utf_string()
+            name = buf.unpack_utf_string().tobytes()
+            value = buf.unpack_utf_string().tobytes()
             params[name] = value
         chunklen = buf.unpack_int()
         uncompressedlen = buf.unpack_longlong()
@@ -244,49 +440,162 @@ class CompressionInfo:
         return "class: %s paramcount: %d chunklen: %d uncompressedlen: %d chunkcount: %d" % (self.classname, self.paramcount, self.chunklen, self.uncompressedlen, self.chunkcount)
 
 class SSTableReader20:
-    def __init__(self, indexfile, datafile, compfile, compressed, cqlrow, verbose):
-        print "verbose: ",verbose
-        self.index = IndexInfo.parse(indexfile)
-        print "row count: ",self.index.rowcount
+    def __init__(self, indexfile, datafile, compfile, compressed, cqlrow, verbose, cachesize=CHUNK_CACHE_SIZE, prefetch=0, workers=1, reusecells=False):
+        if (verbose):
+            print "verbose: ",verbose
+        self.indexfile = indexfile
         if compressed:
-            self.buf = CompressedBuffer(datafile, compfile, verbose)
+            self.buf = CompressedBuffer(datafile, compfile, verbose, cachesize, prefetch, workers)
         else:
             self.buf = UncompressedBuffer(datafile, verbose)
         self.entryindex = 0
+        self.endentry = None
+        # set while scanning partitions by their Data.db position alone
+        self.noindex = False
         self.currow = None
         self.sstable = SSTableFileName.parse(datafile, verbose)
         self.cqlrow = cqlrow
         self.verbose = verbose
+        self.reusecells = reusecells
+        self.cells = {}
+        self.projection = None
+        self.stats = sststats.current
         #extract metadata
         self.metadata = sstmd.SSTableMetadata.parse(self.sstable.statfile(), self.sstable.sstversion)
 
+    def __getattr__(self, name):
+        # Index.db is loaded on first use, point lookups through seek
+        # only read the summary and one index interval
+        if name == 'index':
+            self.index = IndexInfo.parse(self.indexfile)
+            if (self.verbose):
+                print "row count: ",self.index.rowcount
+            return self.index
+        if name == 'bloomfilter':
+            self.bloomfilter = None
+            if os.path.isfile(self.sstable.filterfile()):
+                self.bloomfilter = sstfilter.BloomFilter.parse(self.sstable.filterfile(), self.sstable.sstversion)
+            return self.bloomfilter
+        if name == 'decoder':
+            # the 3.x column types from the serialization header, resolved
+            # once instead of on every row
+            self.decoder = ssttypes.SchemaDecoder.frommetadata(self.metadata)
+            if (self.verbose):
+                print self.decoder
+            return self.decoder
+        raise AttributeError(name)
+
     def hasnext(self):
         if self.currow != None:
             while (self.currow.hasnextcolumn()):
                 self.currow.nextcolumn()
-        return self.entryindex < self.index.rowcount
+            if self.stats != None:
+                # cells decoded or skipped by a projection
+                self.stats.count("cells", self.currow.colscannedcount)
+                self.currow.colscannedcount = 0
+        if self.entryindex == None:
+            # resuming a scan after seek
+            self.entryindex = self.index.indexof(self.currow.indexentry[1]) + 1
+        if self.endentry == None:
+            self.endentry = self.index.rowcount
+        return self.entryindex < self.endentry
 
     def next(self):
         i = self.entryindex
         self.entryindex += 1
-        if i + 1 < self.index.rowcount:
-            rowsize = self.index.entries[i + 1][1] - self.index.entries[i][1]
+        if self.noindex:
+            # partitions are stored back to back, the buffer is already at
+            # the start of the next one
+            self.currow = Row20((None, None), self.buf.datasize, self, self.verbose)
         else:
-            rowsize = self.buf.datasize
-        self.currow = Row(self.index.entries[i], rowsize, self, self.verbose)
+            if i + 1 < self.index.rowcount:
+                rowsize = self.index.entries[i + 1][1] - self.index.entries[i][1]
+            else:
+                rowsize = self.buf.datasize
+            self.currow = Row20(self.index.entries[i], rowsize, self, self.verbose)
+        if self.stats != None:
+            self.stats.count("partitions")
         return self.currow
 
+    def setrange(self, start, end):
+        # restrict the scan to the index entries [start, end)
+        self.entryindex = start
+        self.endentry = min(end, self.index.rowcount)
+        self.noindex = False
+        self.currow = None
+        if start < self.endentry:
+            self.buf.seek(self.index.entries[start][1])
+
+    def setpositionrange(self, start, count):
+        # restrict the scan to the count partitions stored from Data.db
+        # position start on, without reading Index.db
+        self.entryindex = 0
+        self.endentry = count
+        self.noindex = True
+        self.currow = None
+        if count > 0:
+            self.buf.seek(start)
+
+    def settokenrange(self, start, end):
+        # restrict the scan to the partitions with start < token <= end
+        (first, last) = self.tokenbounds(start, end)
+        self.setrange(first, last)
+
+    def tokenbounds(self, start, end):
+        # partitions are stored in token order, so the index entries in the
+        # range (start, end] are found by binary search, a None bound is open
+        if start != None and end != None and start >= end:
+            raise ValueError("wrapping token range (%s, %s] is not supported" % (start, end))
+        token = partitioner.gettokenfunction(self.metadata.partitioner)
+        first = 0
+        last = self.index.rowcount
+        if start != None:
+            first = self.firstafter(token, start)
+        if end != None:
+            last = self.firstafter(token, end)
+        return (first, last)
+
+    def firstafter(self, token, bound):
+        # index of the first partition with a token greater than bound
+        lo = 0
+        hi = self.index.rowcount
+        while lo < hi:
+            mid = (lo + hi) / 2
+            if token(self.index.key(mid)) <= bound:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
     def seek(self, rowkey):
-        for i in xrange(self.index.rowcount):
-            if self.index.entries[i][0].find(rowkey) != -1:
-                self.entryindex = i + 1
-                if i + 1 < self.index.rowcount:
-                    rowsize = self.index.entries[i + 1][1] - self.index.entries[i][1]
-                else:
-                    rowsize = self.buf.datasize
-                self.buf.seek(self.index.entries[i][1])
-                self.currow = Row(self.index.entries[i], rowsize, self)
-                return self.currow
+        if self.bloomfilter != None and self.bloomfilter.mightContain(rowkey) == False:
+            return None
+        summary = self.metadata.summary
+        (start, end) = (0, None)
+        if summary != None:
+            token = partitioner.gettokenfunction(self.metadata.partitioner)
+            i = summary.search(rowkey, token)
+            if i < 0:
+                return None
+            # the key can only be in the index interval that starts at the
+            # sampled key found above
+            start = summary.positions[i]
+            if i + 1 < len(summary.positions):
+                end = summary.positions[i + 1]
+        # without Summary.db the whole index is searched
+        entry = IndexInfo.lookup(self.indexfile, rowkey, start, end)
+        if entry == None:
+            return None
+        (key, pos, nextpos) = entry
+        if nextpos != None:
+            rowsize = nextpos - pos
+        else:
+            rowsize = self.buf.datasize
+        self.buf.seek(pos)
+        self.entryindex = None
+        self.noindex = False
+        self.currow = Row20((key, pos), rowsize, self, self.verbose)
+        return self.currow
 
     def unpack_deletion_time(self):
         localDeletionTime = self.buf.unpack_int()
@@ -296,7 +605,7 @@ class SSTableReader20:
     def unpack_column_name(self):
         if (self.cqlrow):
             return self.unpack_composite_column_name()
-        name = self.buf.unpack_utf_string()
+        name = self.buf.unpack_utf_string().tobytes()
         if (self.verbose):
             print "\ncolumn name: %s" % (name)        
         return name
@@ -308,6 +617,9 @@ class SSTableReader20:
         if l == 0:
             return None
         name = ""
+        # make the whole composite resident so a chunk boundary can't
+        # move the offsets underneath the loop below
+        self.buf.readbytes(l)
         pos = self.buf.offset
         firstcomp = True
         while self.buf.offset < pos + l:
@@ -331,122 +643,276 @@ class SSTableReader20:
             print "\ncolumn name: %s" % (name)
         return name
 
-    def unpack_column_value(self, name):
+    def setcolumns(self, columns):
+        # decode only the cells of these columns, None decodes all of them
+        if columns is None:
+            self.projection = None
+        elif self.cqlrow:
+            self.projection = set([binascii.hexlify(c) for c in columns])
+        else:
+            self.projection = set(columns)
+
+    def projected(self, name):
+        # CQL cell names end with the hex column name
+        if self.cqlrow:
+            name = name[name.rfind(":") + 1:]
+        return name in self.projection
+
+    def skip_column_value(self):
+        # skips a cell by its lengths without decoding it, range tombstones
+        # apply to all columns so their flag is returned to decode them
         flag = self.buf.unpack_byte()
+        if (flag & RANGE_TOMBSTONE_MASK) != 0:
+            return flag
+        if (flag & (COUNTER_MASK | EXPIRATION_MASK)) != 0:
+            length = self.buf.unpack_struct(SKIP_LONG_CELL)[0]
+        else:
+            length = self.buf.unpack_struct(SKIP_CELL)[0]
+        self.buf.skip_bytes(length)
+        return None
+
+    def unpack_column_value(self, name, flag=None):
+        if flag is None:
+            flag = self.buf.unpack_byte()
         if (self.verbose):
             print "column type: 0x%02x" % (flag)
         if (flag & RANGE_TOMBSTONE_MASK) != 0:
-            maxcol = self.buf.unpack_utf_string()
+            maxcol = self.buf.unpack_utf_string().tobytes()
             deletiontime = self.unpack_deletion_time()
-            return RangeTombstone(name, maxcol, deletiontime)
+            return self.newcell(RangeTombstone, name, maxcol, deletiontime)
         else:
             if ((flag & COUNTER_MASK) != 0):
                 timestampOfLastDelete = self.buf.unpack_longlong()
                 ts = self.buf.unpack_longlong()
                 value = self.buf.unpack_data()
-                return CounterColumn(name, ts, value, timestampOfLastDelete)
+                return self.newcell(CounterColumn, name, ts, value, timestampOfLastDelete)
             elif (flag & EXPIRATION_MASK) != 0:
                 ttl = self.buf.unpack_int()
                 expiration = self.buf.unpack_int()
                 ts = self.buf.unpack_longlong()
                 value = self.buf.unpack_data()
-                return ExpiringColumn(name, ts, ttl, expiration, value)
+                return self.newcell(ExpiringColumn, name, ts, ttl, expiration, value)
             else:
-                ts = self.buf.unpack_longlong()
-                value = self.buf.unpack_data()
+                (ts, length) = self.buf.unpack_struct(CELL_TIMESTAMP_LENGTH)
+                value = self.buf.unpack_bytes(length)
                 if (flag & COUNTER_UPDATE_MASK) != 0:
-                    return CounterUpdateColumn(name, ts, value)
+                    return self.newcell(CounterUpdateColumn, name, ts, value)
                 elif (flag & DELETION_MASK) != 0:
-                    return DeletedColumn(name, ts, value)
+                    return self.newcell(DeletedColumn, name, ts, value)
                 else:
-                    return Column(name, LIVE_MASK, ts, value)
+                    return self.newcell(Column, name, LIVE_MASK, ts, value)
+
+    def newcell(self, cls, *args):
+        # in reuse mode every cell class has a single instance that is
+        # refilled for each cell, so a cell is only valid until the next
+        # one is read
+        if self.reusecells:
+            cell = self.cells.get(cls)
+            if cell is None:
+                cell = cls.__new__(cls)
+                self.cells[cls] = cell
+            cell.__init__(*args)
+            return cell
+        return cls(*args)
 
     def unpack_clustering_key(self):
-        # get the cluster types
-        ckey = ""
-        print self.metadata.clusteringtypes
-        for type in self.metadata.clusteringtypes:
-            if ckey != "":
-                ckey = ckey + ":"
-            if type == 'org.apache.cassandra.db.marshal.FloatType':
-                val = self.buf.unpack_float()
-                ckey = ckey + ("%.2f" % val)
-            elif type == 'org.apache.cassandra.db.marshal.Int32Type':
-                val = self.buf.unpack_int()
-                ckey = ckey + ("%d" % val)
-        print "Clustering key: " + ckey
+        values = self.decoder.unpack_clustering(self.buf)
+        if (self.verbose):
+            print "clustering key: " + self.decoder.format_clustering(values)
+        return values
 
     def unpack_unfiltered_sizes(self):
-        cursize = self.buf.unpack_vint()
-        prevsize = self.buf.unpack_vint()
-        print "unfiltered size: ",cursize," prev unfiltered size: ",prevsize
+        (cursize, prevsize) = self.buf.unpack_vints(2)
+        if (self.verbose):
+            print "unfiltered size: ",cursize," prev unfiltered size: ",prevsize
+        return (cursize, prevsize)
 
 class SSTableReader(SSTableReader20):
-    def __init__(self, indexfile, datafile, compfile, compressed, cqlrow, verbose):
-        print "Readers"
-        print "verbose: ",verbose
-        self.index = IndexInfo.parse(indexfile)
-        print "row count: ",self.index.rowcount
-        if compressed:
-            self.buf = CompressedBuffer(datafile, compfile, verbose)
-        else:
-            self.buf = UncompressedBuffer(datafile, verbose)
-        self.entryindex = 0
-        self.currow = None
-        self.sstable = SSTableFileName.parse(datafile, verbose)
-        self.cqlrow = cqlrow
-        self.verbose = verbose
-        #extract metadata
-        self.metadata = sstmd.SSTableMetadata.parse(self.sstable.statfile(), self.sstable.sstversion)
+    def __init__(self, indexfile, datafile, compfile, compressed, cqlrow, verbose, cachesize=CHUNK_CACHE_SIZE, prefetch=0, workers=1, reusecells=False):
+        SSTableReader20.__init__(self, indexfile, datafile, compfile, compressed, cqlrow, verbose, cachesize, prefetch, workers, reusecells)
 
     def hasnext(self):
         if self.buf.remaining() > 0:
-            print "read next row"
             return True
-        return False
+        # a compressed buffer only holds the current chunk
+        return isinstance(self.buf, CompressedBuffer) and self.buf.position() < self.buf.compmetadata.uncompressedlen
 
     def next(self):
-        i = self.entryindex
-        self.entryindex += 1
-        if i + 1 < self.index.rowcount:
-            rowsize = self.index.entries[i + 1][1] - self.index.entries[i][1]
-        else:
-            rowsize = self.buf.datasize
-        self.currow = Row(self.index.entries[i], rowsize, self, self.verbose)
+        # partitions are read up to their end of partition flag, so the
+        # 3.x Index.db isn't needed for a scan
+        self.currow = Row(None, None, self, self.verbose)
+        if self.stats != None:
+            # the whole partition is decoded when it is read
+            self.stats.count("partitions")
+            self.stats.count("cells", len(self.currow.cells))
         return self.currow
 
 class Row:
+    # a 3.x partition, its rows, cells and tombstones are decoded when it
+    # is read
     def __init__(self, indexentry, size, reader, verbose):
         self.indexentry = indexentry
         self.size = size
         self.reader = reader
-        self.columncount = 0
         self.verbose = verbose
+        self.decoder = reader.decoder
+        self.mintimestamp = reader.metadata.esmintimestap
+        self.minlocaldeletiontime = reader.metadata.esminlocaldeletiontime
+        self.minttl = reader.metadata.esminttl
 
         self.key = self.reader.buf.unpack_utf_string()
         if (self.verbose):
-            print "row key: " + self.key
+            print "row key: " + self.key.tobytes()
 
         # extract the deletion time
         self.deletiontime = self.reader.unpack_deletion_time()
         if (self.verbose):
             print "deletion time: ",self.deletiontime.localDeletionTime
 
-        flags = self.reader.buf.unpack_short()
-        self.reader.unpack_clustering_key()
+        # (clustering, column name, value, timestamp, flags, local deletion
+        # time, ttl) of every cell, and a RangeTombstone for every row,
+        # complex column or range deletion
+        self.cells = []
+        # the clustering the open range tombstone starts at
+        self.openmarker = None
+        while self.unpack_unfiltered():
+            pass
+
+    def unpack_deletion(self, buf):
+        # both fields are deltas from the EncodingStats minimums
+        (ts, localdeletiontime) = buf.unpack_vints(2)
+        return DeletionTime(ts + self.mintimestamp, localdeletiontime + self.minlocaldeletiontime)
+
+    def unpack_unfiltered(self):
+        buf = self.reader.buf
+        flags = buf.unpack_byte()
+        if flags & END_OF_PARTITION:
+            return False
+        extflags = 0
+        if flags & EXTENSION_FLAG:
+            extflags = buf.unpack_byte()
+        if flags & IS_MARKER:
+            self.unpack_marker(buf)
+            return True
+        columns = self.decoder.regular
+        clustering = ""
+        if extflags & IS_STATIC:
+            columns = self.decoder.static
+        else:
+            clustering = self.decoder.format_clustering(self.reader.unpack_clustering_key())
         self.reader.unpack_unfiltered_sizes()
-        ts = self.reader.buf.unpack_vint()
-        print "timestamp: ",ts
-        flags = self.reader.buf.unpack_byte()
-        len = self.reader.buf.unpack_vint()
-        print "len: ",len
-        val = self.reader.buf.unpack_bytes(len)
-        print "value: %s" % val
-        self.reader.buf.unpack_byte()
+        # the liveness info cells without a timestamp or ttl of their own use
+        rowts = None
+        rowttl = None
+        rowexpiration = None
+        if flags & HAS_TIMESTAMP:
+            rowts = buf.unpack_vint() + self.mintimestamp
+        if flags & HAS_TTL:
+            (ttl, expiration) = buf.unpack_vints(2)
+            rowttl = ttl + self.minttl
+            rowexpiration = expiration + self.minlocaldeletiontime
+        if flags & HAS_DELETION:
+            self.cells.append(RangeTombstone(clustering, clustering, self.unpack_deletion(buf)))
+        if flags & HAS_ALL_COLUMNS == 0:
+            columns = self.unpack_columns(buf, columns)
+        for (name, type) in columns:
+            if type.complex:
+                if flags & HAS_COMPLEX_DELETION:
+                    column = "%s:%s" % (clustering, name)
+                    self.cells.append(RangeTombstone(column, column, self.unpack_deletion(buf)))
+                for i in xrange(buf.unpack_vint()):
+                    self.unpack_cell(buf, clustering, name, type, rowts, rowttl, rowexpiration)
+            else:
+                self.unpack_cell(buf, clustering, name, type, rowts, rowttl, rowexpiration)
+        return True
+
+    def unpack_columns(self, buf, columns):
+        # the columns of a row that doesn't have all of them
+        count = len(columns)
+        if count < 64:
+            # a bitmap of the missing ones
+            missing = buf.unpack_vint()
+            return [columns[i] for i in xrange(count) if missing & (1 << i) == 0]
+        # the number of missing columns, then the indexes of the present
+        # ones when they are fewer, of the missing ones otherwise
+        missingcount = buf.unpack_vint()
+        if count - missingcount < count / 2:
+            return [columns[i] for i in buf.unpack_vints(count - missingcount)]
+        missing = set(buf.unpack_vints(missingcount))
+        return [columns[i] for i in xrange(count) if i not in missing]
+
+    def unpack_marker(self, buf):
+        # a range tombstone bound, or a boundary closing one and opening
+        # the next. The tombstone is kept when it is closed
+        kind = buf.unpack_byte()
+        size = buf.unpack_short()
+        clustering = self.decoder.format_clustering(self.decoder.unpack_clustering(buf, size))
+        self.reader.unpack_unfiltered_sizes()
+        deletiontime = self.unpack_deletion(buf)
+        if (self.verbose):
+            print "range tombstone marker: %d %s" % (kind, clustering)
+        if kind in START_BOUND_KINDS:
+            self.openmarker = clustering
+            return
+        self.cells.append(RangeTombstone(self.openmarker or "", clustering, deletiontime))
+        self.openmarker = None
+        if kind in BOUNDARY_KINDS:
+            # the start deletion of the next range follows the end one
+            buf.unpack_vints(2)
+            self.openmarker = clustering
+
+    def unpack_cell(self, buf, clustering, name, type, rowts, rowttl, rowexpiration):
+        flags = buf.unpack_byte()
+        ts = rowts
+        if flags & CELL_USE_ROW_TIMESTAMP == 0:
+            ts = buf.unpack_vint() + self.mintimestamp
+        localdeletiontime = None
+        ttl = None
+        if flags & CELL_USE_ROW_TTL:
+            localdeletiontime = rowexpiration
+            ttl = rowttl
+        elif flags & (CELL_IS_DELETED | CELL_IS_EXPIRING):
+            localdeletiontime = buf.unpack_vint() + self.minlocaldeletiontime
+            if flags & CELL_IS_EXPIRING:
+                ttl = buf.unpack_vint() + self.minttl
+        if type.complex:
+            # complex cells are named by their path, in hex format
+            path = buf.unpack_vintlendata()
+            name = "%s:%s" % (name, binascii.hexlify(path or ""))
+            type = type.celltype(path)
+        value = None
+        if flags & CELL_HAS_EMPTY_VALUE == 0:
+            value = type.unpack(buf)
+        if (self.verbose):
+            print "cell: %s %s %s %d 0x%02x" % (clustering, name, type.format(value), ts, flags)
+        self.cells.append((clustering, name, value, ts, flags, localdeletiontime, ttl))
 
     def getdeletioninfo(self):
         return self.deletiontime
 
+    def __repr__(self):
+        # the "cells" of the JSON export, clustering values are formatted
+        # by their types and cell values in hex format. Deleted, expiring
+        # cells and tombstones get the suffixes of the 2.x export
+        cells = []
+        for cell in self.cells:
+            if isinstance(cell, RangeTombstone):
+                cells.append("[%s,%s,%d,\"t\",%d]" % (jsonname(cell.mincol), jsonname(cell.maxcol), cell.deletiontime.markedForDeleteAt, cell.deletiontime.localDeletionTime))
+                continue
+            (clustering, name, value, ts, flags, localdeletiontime, ttl) = cell
+            name = jsonname(clustering + ":" + name)
+            if flags & CELL_IS_DELETED:
+                # like 2.x, the value of a tombstone is its local deletion time
+                cells.append("[%s,\"%s\",%d,\"d\"]" % (name, binascii.hexlify(INT.pack(localdeletiontime)), ts))
+            elif flags & CELL_IS_EXPIRING:
+                cells.append("[%s,\"%s\",%d,\"e\",%d,%d]" % (name, binascii.hexlify(value or ""), ts, ttl, localdeletiontime))
+            else:
+                cells.append("[%s,\"%s\",%d]" % (name, binascii.hexlify(value or ""), ts))
+        return "\"cells\": [" + ",\n\t".join(cells)
+
+def jsonname(name):
+    return json.dumps(name.decode('utf-8', 'replace'))
+
 class Row20:
     def __init__(self, indexentry, size, reader, verbose):
         self.indexentry = indexentry
@@ -457,7 +923,7 @@ class Row20:
 
         self.key = self.reader.buf.unpack_utf_string()
         if (self.verbose):
-            print "row key: " + self.key
+            print "row key: " + self.key.tobytes()
         if self.reader.sstable.sstversion < 'd':
             self.size = self.reader.buf.unpack_int()
         elif self.reader.sstable.sstversion < 'ja':
@@ -471,6 +937,7 @@ class Row20:
         if self.reader.sstable.sstversion < 'ja':
             self.columncount = self.reader.buf.unpack_int()
         self.colname = None
+        self.colflag = None
         self.eof = False
         if self.reader.sstable.sstversion < 'ja':
             if self.columncount == 0:
@@ -479,19 +946,8 @@ class Row20:
         if reader.cqlrow:
             if (self.verbose):
                 print "parsing CQL Row"
-            if self.reader.sstable.sstversion == 'md':
-                flags = self.reader.buf.unpack_short()
-                self.reader.unpack_clustering_key()
-                self.reader.unpack_unfiltered_sizes()
-                ts = self.reader.buf.unpack_vint()
-                print "timestamp: ",ts
-                flags = self.reader.buf.unpack_byte()
-                len = self.reader.buf.unpack_vint()
-                print "len: ",len
-                self.reader.buf.unpack_bytes(len)
-                self.reader.buf.unpack_byte()
-                print "end of partition"
-                return
+            if self.reader.sstable.sstversion >= 'ma':
+                raise ValueError("version %s partitions are read by SSTableReader" % (self.reader.sstable.sstversion))
             if (self.verbose):
                 print "parsing clustering key"
             self.reader.unpack_composite_column_name()
@@ -507,60 +963,82 @@ class Row20:
     def hasnextcolumn(self):
         if (self.verbose):
             print "hasnextcolumn"
-        if self.columncount > 0 and self.colscannedcount >= self.columncount:
-            self.eof = True
-        if self.eof == True:
-            return False
-        self.colname = self.reader.unpack_column_name()
-        if self.colname == None or self.colname == "":
-            self.eof = True
-            self.colname = None
-        else:
+        while True:
+            if self.columncount > 0 and self.colscannedcount >= self.columncount:
+                self.eof = True
+            if self.eof == True:
+                return False
+            self.colname = self.reader.unpack_column_name()
+            if self.colname == None or self.colname == "":
+                self.eof = True
+                self.colname = None
+                return False
             self.colscannedcount = self.colscannedcount + 1
-        return self.colname != None
+            if self.reader.projection is None or self.reader.projected(self.colname):
+                return True
+            # cells of other columns are skipped here
+            self.colflag = self.reader.skip_column_value()
+            if self.colflag != None:
+                return True
 
     def nextcolumn(self):
-        return self.reader.unpack_column_value(self.colname)
+        flag = self.colflag
+        self.colflag = None
+        return self.reader.unpack_column_value(self.colname, flag)
 
     def getdeletioninfo(self):
         return self.deletiontime
 
-class Column:
+# the cell classes are slotted, there is one instance per decoded cell
+class Column(object):
+    __slots__ = ('name', 'type', 'ts', 'value')
+
     def __init__(self, name, type, ts, value):
         self.name = name
         self.type = type
         self.ts = ts
         self.value = value
-	if value is None:
-		self.value = ''
+        if value is None:
+            self.value = ''
 
 class CounterColumn(Column):
+    __slots__ = ('timestampOfLastDelete',)
+
     def __init__(self, name, ts, value, timestampOfLastDelete):
         Column.__init__(self, name, COUNTER_MASK, ts, value)
         self.timestampOfLastDelete = timestampOfLastDelete
 
 class CounterUpdateColumn(Column):
+    __slots__ = ()
+
     def __init__(self, name, ts, value):
         Column.__init__(self, name, COUNTER_UPDATE_MASK, ts, value)
-        
 
 class ExpiringColumn(Column):
+    __slots__ = ('ttl', 'expiration')
+
     def __init__(self, name, ts, ttl, expiration, value):
         Column.__init__(self, name, EXPIRATION_MASK, ts, value)
         self.ttl = ttl
         self.expiration = expiration
 
 class DeletedColumn(Column):
+    __slots__ = ()
+
     def __init__(self, name, ts, value):
         Column.__init__(self, name, DELETION_MASK, ts, value)
 
-class RangeTombstone:
+class RangeTombstone(object):
+    __slots__ = ('mincol', 'maxcol', 'deletiontime')
+
     def __init__(self, mincol, maxcol, deletiontime):
         self.mincol = mincol
         self.maxcol = maxcol
         self.deletiontime = deletiontime
 
-class DeletionTime:
+class DeletionTime(object):
+    __slots__ = ('markedForDeleteAt', 'localDeletionTime')
+
     def __init__(self, markedForDeleteAt, localDeletionTime):
         self.markedForDeleteAt = markedForDeleteAt
         self.localDeletionTime = localDeletionTime
@@ -587,17 +1065,18 @@ class SSTableFileName:
         if i != -1:
             basedir = filename[0:i]
         name = os.path.basename(filename)
-        m = re.compile(r'(.*)-(.*)-(.*)-(.*)-(.*).db').match(name)
+        # the component is followed by its extension, .db for most of them
+        m = re.compile(r'(.*)-(.*)-(.*)-(.*)-([^.]*)\.[^.]*$').match(name)
         if m != None:
             ks = m.groups()[0]
             cf = m.groups()[1]
             sstver = m.groups()[2]
             gen = m.groups()[3]
             comp = m.groups()[4]
-            return SSTableFileName(basedir, "2.*", ks, cf, sstver, gen, None. comp)
+            return SSTableFileName(basedir, "2.*", ks, cf, sstver, gen, None, comp)
         else:
             # Check if it is a latest version >= 3.0
-            m = re.compile(r'(.*)-(.*)-(.*)-(.*).db').match(name)
+            m = re.compile(r'(.*)-(.*)-(.*)-([^.]*)\.[^.]*$').match(name)
             if m != None:
                 sstver = m.groups()[0]
                 gen = m.groups()[1]
@@ -615,11 +1094,25 @@ class SSTableFileName:
         return self.componentfile("Data")
     def compfile(self):
         return self.componentfile("CompressionInfo")  
+    def filterfile(self):
+        return self.componentfile("Filter")
+    def tocfile(self):
+        return "%s-TOC.txt" % (self.prefix())
+    def crcfile(self):
+        return self.componentfile("CRC")
+    def digestfile(self, algorithm):
+        return "%s-Digest.%s" % (self.prefix(), algorithm)
 
-    def componentfile(self, comp):
+    def prefix(self):
+        # the path shared by all component files of this sstable
         if self.version == "2.*":
-            return "%s/%s-%s-%s-%s-%s.db" % (self.basedir, self.keyspace, self.columnfamily, self.sstversion, self.generation, comp)
-        return "%s/%s-%s-%s-%s.db" % (self.basedir, self.sstversion, self.generation, self.format, comp)
+            name = "%s-%s-%s-%s" % (self.keyspace, self.columnfamily, self.sstversion, self.generation)
+        else:
+            name = "%s-%s-%s" % (self.sstversion, self.generation, self.format)
+        return os.path.join(self.basedir, name)
+
+    def componentfile(self, comp):
+        return "%s-%s.db" % (self.prefix(), comp)
 
     def __repr__(self):
         return "keyspace: %s columnfamily: %s version: %s generation: %s component: %s" % (self.keyspace, self.columnfamily, self.sstversion, self.generation, self.component)
@@ -18,74 +18,223 @@
 # a stand alone script to read rows and columns in a given SSTable
 
 import os
+import time
 import binascii
 import argparse
+import bisect
+import multiprocessing
+import sststats
 from sstable import *
 
-def export(reader):
+# uncompressed bytes of Data.db decoded by one parallel export task, the
+# JSON text of a task is handed back in one piece so it is kept small
+PARALLEL_TASK_SIZE = 4 * 1024 * 1024
+
+# bytes of JSON collected before they are handed to the output file
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+class BlockWriter:
+    # collects small strings and writes them out in large blocks, a
+    # blocksize of 0 writes every string through immediately
+    def __init__(self, out, blocksize=WRITE_BUFFER_SIZE):
+        self.out = out
+        self.blocksize = blocksize
+        self.parts = []
+        self.size = 0
+        self.stats = sststats.current
+
+    def write(self, s):
+        self.parts.append(s)
+        self.size += len(s)
+        if self.size >= self.blocksize:
+            self.flush()
+
+    def writeall(self, chunks):
+        for s in chunks:
+            self.write(s)
+
+    def flush(self):
+        if self.stats != None:
+            start = time.time()
+            self.stats.count("bytes written", self.size)
+        if len(self.parts) > 0:
+            self.out.write("".join(self.parts))
+            self.parts = []
+            self.size = 0
+        self.out.flush()
+        if self.stats != None:
+            self.stats.addtime("write", time.time() - start)
+
+def export(reader, out=sys.stdout, blocksize=WRITE_BUFFER_SIZE):
+    writer = BlockWriter(out, blocksize)
+    writer.write("[\n")
     firstrow = True
-    print "["
     while reader.hasnext():
-        "read rowa"
         if firstrow == True:
             firstrow = False
         else:
-            sys.stdout.write(",\n")
+            writer.write(",\n")
         row = reader.next()
-        sys.stdout.write("{\"key\": \"%s\",\n" % binascii.hexlify(row.key))
+        writer.write("{\"key\": \"%s\",\n" % binascii.hexlify(row.key))
         if row.getdeletioninfo().islive() == False:
-            sys.stdout.write(" \"metadata\": ")
-            sys.stdout.write("{");
-            sys.stdout.write("\"deletionInfo\": ")
-            sys.stdout.write("{\"markedForDeleteAt\": %d" %  row.getdeletioninfo().markedForDeleteAt)
-            sys.stdout.write(", \"localDeletionTime\": %d}" %  row.getdeletioninfo().localDeletionTime)
-            sys.stdout.write("}")
-            sys.stdout.write(",\n")
-
-        sys.stdout.write(" ");
-        print row
-        sys.stdout.write("]}")
-    sys.stdout.write("\n]\n")
-
-def export20(reader):
+            writer.write(" %s,\n" % rowmetadata(row))
+        writer.write(" %s\n]}" % (row))
+    writer.write("\n]\n")
+    writer.flush()
+
+def export20(reader, out=sys.stdout, blocksize=WRITE_BUFFER_SIZE):
+    writer = BlockWriter(out, blocksize)
+    writer.write("[\n")
     firstrow = True
-    print "["
     while reader.hasnext():
         if firstrow == True:
             firstrow = False
         else:
-            sys.stdout.write(",\n")
-        row = reader.next()
-        sys.stdout.write("{\"key\": \"%s\",\n" % binascii.hexlify(row.key))
-        if row.getdeletioninfo().islive() == False:
-            sys.stdout.write(" \"metadata\": ")
-            sys.stdout.write("{");
-            sys.stdout.write("\"deletionInfo\": ")
-            sys.stdout.write("{\"markedForDeleteAt\": %d" %  row.getdeletioninfo().markedForDeleteAt)
-            sys.stdout.write(", \"localDeletionTime\": %d}" %  row.getdeletioninfo().localDeletionTime)
-            sys.stdout.write("}")
-            sys.stdout.write(",\n")
-
-        sys.stdout.write(" ");
-        firstcol = True
-        sys.stdout.write("\"cells\": [")
-        while row.hasnextcolumn():
-            if firstcol == True:
-                firstcol = False
-            else:
-                sys.stdout.write(",\n\t")
-            column = row.nextcolumn()
-            if isinstance(column, RangeTombstone):
-                sys.stdout.write("[\"%s\",\"%s\",%d,\"t\",%d]" % (column.mincol,column.maxcol,column.deletiontime.markedForDeleteAt,column.deletiontime.localDeletionTime))
-            else:
-                if isinstance(column, DeletedColumn):
-                    sys.stdout.write("[\"%s\",\"%s\",%d,\"d\"]" % (column.name, binascii.hexlify(column.value), column.ts))
-                elif isinstance(column, ExpiringColumn):
-                    sys.stdout.write("[\"%s\",\"%s\",%d,\"e\",%d,%d]" % (column.name, binascii.hexlify(column.value), column.ts,column.ttl,column.expiration))
-                elif isinstance(column, CounterColumn):
-                    sys.stdout.write("[\"%s\",\"%s\",%d,\"c\",%d]" % (column.name, binascii.hexlify(column.value), column.ts, column.timestampOfLastDelete))
-                else:
-                    sys.stdout.write("[\"%s\",\"%s\",%d]" % (column.name, binascii.hexlify(column.value), column.ts))
-        sys.stdout.write("]}")
-    sys.stdout.write("\n]\n")
+            writer.write(",\n")
+        writer.writeall(row20json(reader.next()))
+    writer.write("\n]\n")
+    writer.flush()
+
+def export20ndjson(reader, out=sys.stdout, blocksize=WRITE_BUFFER_SIZE):
+    # one partition per line, so the output can be split and loaded in parallel
+    writer = BlockWriter(out, blocksize)
+    while reader.hasnext():
+        writer.writeall(row20json(reader.next(), True))
+        writer.write("\n")
+    writer.flush()
+
+def export20key(reader, key, out=sys.stdout):
+    writer = BlockWriter(out)
+    writer.write("[\n")
+    row = reader.seek(key)
+    if row != None:
+        writer.writeall(row20json(row))
+        writer.write("\n")
+    writer.write("]\n")
+    writer.flush()
 
+def rowmetadata(row):
+    deletioninfo = row.getdeletioninfo()
+    return "\"metadata\": {\"deletionInfo\": {\"markedForDeleteAt\": %d, \"localDeletionTime\": %d}}" % (deletioninfo.markedForDeleteAt, deletioninfo.localDeletionTime)
+
+def row20json(row, ndjson=False):
+    # generates the JSON text of a 2.x row, one chunk per cell. The ndjson
+    # form holds the same fields on a single line
+    if ndjson:
+        (fieldsep, indent, cellsep) = (", ", "", ",")
+    else:
+        (fieldsep, indent, cellsep) = (",\n", " ", ",\n\t")
+    head = "{\"key\": \"%s\"%s" % (binascii.hexlify(row.key), fieldsep)
+    if row.getdeletioninfo().islive() == False:
+        head += indent + rowmetadata(row) + fieldsep
+    yield head + indent + "\"cells\": ["
+    hexlify = binascii.hexlify
+    sep = ""
+    while row.hasnextcolumn():
+        column = row.nextcolumn()
+        if isinstance(column, RangeTombstone):
+            yield "%s[\"%s\",\"%s\",%d,\"t\",%d]" % (sep, column.mincol, column.maxcol, column.deletiontime.markedForDeleteAt, column.deletiontime.localDeletionTime)
+        elif isinstance(column, DeletedColumn):
+            yield "%s[\"%s\",\"%s\",%d,\"d\"]" % (sep, column.name, hexlify(column.value), column.ts)
+        elif isinstance(column, ExpiringColumn):
+            yield "%s[\"%s\",\"%s\",%d,\"e\",%d,%d]" % (sep, column.name, hexlify(column.value), column.ts, column.ttl, column.expiration)
+        elif isinstance(column, CounterColumn):
+            yield "%s[\"%s\",\"%s\",%d,\"c\",%d]" % (sep, column.name, hexlify(column.value), column.ts, column.timestampOfLastDelete)
+        else:
+            yield "%s[\"%s\",\"%s\",%d]" % (sep, column.name, hexlify(column.value), column.ts)
+        sep = cellsep
+    yield "]}"
+
+# the reader of a parallel export worker process, opened once by the pool
+# initializer and moved to the partitions of every task
+rangereader = None
+
+def openrangereader(indexfile, datafile, compfile, compressed, cqlrow, columns, withstats):
+    global rangereader
+    if withstats:
+        sststats.enable()
+    rangereader = SSTableReader20(indexfile, datafile, compfile, compressed, cqlrow, False)
+    rangereader.setcolumns(columns)
+
+def exportrange(task):
+    # runs in a worker process, decodes the count partitions stored from
+    # Data.db position start on and returns their JSON text without the
+    # enclosing brackets, or their ndjson lines
+    (start, count, ndjson) = task
+    reader = rangereader
+    reader.setpositionrange(start, count)
+    chunks = []
+    while reader.hasnext():
+        if len(chunks) > 0 and ndjson == False:
+            chunks.append(",\n")
+        chunks.extend(row20json(reader.next(), ndjson))
+        if ndjson:
+            chunks.append("\n")
+    stats = sststats.current
+    if stats != None:
+        return ("".join(chunks), stats.takestate())
+    return ("".join(chunks), None)
+
+def splitranges(index, datasize, workers, first, last):
+    # split the partitions [first, last) into contiguous ranges of about
+    # PARALLEL_TASK_SIZE bytes of data, with at least one range per worker
+    if first >= last:
+        return []
+    positions = index.positions
+    startpos = positions[first]
+    if last < index.rowcount:
+        endpos = positions[last]
+    else:
+        endpos = datasize
+    tasks = max(workers, (endpos - startpos) / PARALLEL_TASK_SIZE + 1)
+    bounds = [first]
+    for i in xrange(1, tasks):
+        b = bisect.bisect_left(positions, startpos + (endpos - startpos) * i / tasks, first, last)
+        if b > bounds[-1]:
+            bounds.append(b)
+    bounds.append(last)
+    return [(bounds[i], bounds[i + 1]) for i in xrange(len(bounds) - 1) if bounds[i] < bounds[i + 1]]
+
+def export20parallel(indexfile, datafile, compfile, compressed, cqlrow, workers, starttoken=None, endtoken=None, out=sys.stdout, blocksize=WRITE_BUFFER_SIZE, ndjson=False, columns=None):
+    reader = SSTableReader20(indexfile, datafile, compfile, compressed, cqlrow, False)
+    (first, last) = reader.tokenbounds(starttoken, endtoken)
+    if compressed:
+        datasize = reader.buf.compmetadata.uncompressedlen
+    else:
+        datasize = reader.buf.datasize
+    ranges = splitranges(reader.index, datasize, workers, first, last)
+    # the workers are given the Data.db position and the number of the
+    # partitions of each range, so only this process reads Index.db
+    positions = reader.index.positions
+    tasks = [(positions[start], end - start, ndjson) for (start, end) in ranges]
+    reader.buf.close()
+    stats = sststats.current
+    pool = multiprocessing.Pool(workers, openrangereader, (indexfile, datafile, compfile, compressed, cqlrow, columns, stats != None))
+    writer = BlockWriter(out, blocksize)
+    if ndjson:
+        for (text, state) in pool.imap(exportrange, tasks):
+            if state != None:
+                stats.merge(state)
+            writer.write(text)
+        pool.close()
+        pool.join()
+        writer.flush()
+        return
+    writer.write("[\n")
+    firstrow = True
+    # imap hands the ranges back in submission order, so the
+    # partitions come out in the same order as a serial export
+    for (text, state) in pool.imap(exportrange, tasks):
+        if state != None:
+            stats.merge(state)
+        if text == "":
+            continue
+        if firstrow == True:
+            firstrow = False
+        else:
+            writer.write(",\n")
+        writer.write(text)
+    pool.close()
+    pool.join()
+    writer.write("\n]\n")
+    writer.flush()
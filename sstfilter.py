@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specif
+
+# a script to check keys against the bloom filters of SSTables
+
+import os
+import sys
+import argparse
+import struct
+import binascii
+import sstmd
+import sstable
+from buffer import Buffer
+from partitioner import murmur3hash, signed64, MASK64
+
+class BloomFilter:
+    def __init__(self, hashcount, bits, oldhashorder):
+        self.hashcount = hashcount
+        # the bitset as serialized, a sequence of big endian longs
+        self.bits = bits
+        self.bitcount = len(bits) * 8
+        self.oldhashorder = oldhashorder
+
+    def parse(self, filename, version):
+        f = open(filename, 'r')
+        buf = Buffer(f.read())
+        f.close()
+        hashcount = buf.unpack_int()
+        wordcount = buf.unpack_int()
+        bits = buf.unpack_bytes(wordcount * 8).tobytes()
+        # sstables before 'ma' swap the two halves of the hash
+        return BloomFilter(hashcount, bits, version < 'ma')
+    parse = classmethod(parse)
+
+    def build(self, keys, hashcount, wordcount, oldhashorder):
+        # a filter holding keys, as the sstable writers create it
+        filter = BloomFilter(hashcount, "\0" * (wordcount * 8), oldhashorder)
+        bits = bytearray(filter.bits)
+        for key in keys:
+            for (byte, mask) in filter.bitpositions(key):
+                bits[byte] |= mask
+        filter.bits = str(bits)
+        return filter
+    build = classmethod(build)
+
+    def bitpositions(self, key):
+        # (byte, mask) of the bits the key sets
+        h1, h2 = murmur3hash(key)
+        if self.oldhashorder:
+            base, inc = h1, h2
+        else:
+            base, inc = h2, h1
+        for i in xrange(self.hashcount):
+            bit = abs(base) % self.bitcount
+            # bit n of a word is bit n % 8 of byte 7 - n / 8 of its big
+            # endian serialization
+            yield ((bit >> 6) * 8 + 7 - ((bit & 63) >> 3), 1 << (bit & 7))
+            base = signed64((base + inc) & MASK64)
+
+    def mightContain(self, key):
+        if self.bitcount == 0:
+            return True
+        for (byte, mask) in self.bitpositions(key):
+            if ord(self.bits[byte]) & mask == 0:
+                return False
+        return True
+
+    def serialize(self):
+        return struct.pack('>ii', self.hashcount, len(self.bits) / 8) + self.bits
+
+    def __repr__(self):
+        return "hashcount: %d bitcount: %d" % (self.hashcount, self.bitcount)
+
+def main():
+    parser = argparse.ArgumentParser(prog="sstfilter")
+    parser.add_argument("-k", "--keys", help="file with one key per line, - for stdin", type=str, default="-")
+    parser.add_argument("-x", "--hex", help="keys are in hex format", action="store_true")
+    parser.add_argument("sstables", type=str, nargs="+", help="SSTable files")
+    args = parser.parse_args()
+
+    filters = []
+    for filename in args.sstables:
+        sst = sstable.SSTableFileName.parse(filename, False)
+        if sst == None or os.path.isfile(sst.filterfile()) != True:
+            print >> sys.stderr, "%s has no filter, skipping" % filename
+            continue
+        filters.append((sst.datafile(), BloomFilter.parse(sst.filterfile(), sst.sstversion)))
+
+    if args.keys == "-":
+        keys = sys.stdin
+    else:
+        keys = open(args.keys, 'r')
+    # one line per key listing the sstables that might contain it
+    for line in keys:
+        name = line.rstrip("\r\n")
+        if name == "":
+            continue
+        key = name
+        if args.hex:
+            key = binascii.unhexlify(name)
+        matches = [datafile for (datafile, bf) in filters if bf.mightContain(key)]
+        sys.stdout.write("%s\t%s\n" % (name, ",".join(matches)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,466 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specif
+
+# a script to write synthetic SSTables in the 2.1 and 2.2 formats ('ka',
+# 'la' and 'lb') for tests and benchmarks
+#
+# partitions have a 4 byte int key and hold CQL rows of an int clustering
+# column and regular columns v0, v1, ... Every component Cassandra writes
+# is generated: Data.db, Index.db, Summary.db, Filter.db, Statistics.db,
+# CompressionInfo.db (LZ4) or CRC.db, the digest and TOC.txt
+
+import os
+import sys
+import math
+import zlib
+import struct
+import bisect
+import binascii
+import random
+import hashlib
+import argparse
+import lz4.block
+import partitioner
+from sstfilter import BloomFilter
+
+INT = struct.Struct('>i')
+LONG = struct.Struct('>q')
+SHORT = struct.Struct('>H')
+DOUBLE = struct.Struct('>d')
+CHECKSUM = struct.Struct('>I')
+SUMMARY_OFFSET = struct.Struct('<i')
+SUMMARY_POSITION = struct.Struct('<q')
+INT_MAX_VALUE = 0x7fffffff
+LONG_MIN_VALUE = -0x8000000000000000
+LIVE_DELETION_TIME = INT.pack(INT_MAX_VALUE) + LONG.pack(LONG_MIN_VALUE)
+DELETION_MASK = 0x01
+EXPIRATION_MASK = 0x02
+RANGE_TOMBSTONE_MASK = 0x10
+END_OF_ROW = SHORT.pack(0)
+START_OF_SLICE = "\xff"
+END_OF_SLICE = "\x01"
+# Cassandra's defaults
+CHUNK_LENGTH = 65536
+CRC_CHUNK_LENGTH = 65536
+MIN_INDEX_INTERVAL = 128
+BASE_SAMPLING_LEVEL = 128
+TOMBSTONE_HISTOGRAM_BINS = 100
+BLOOM_FILTER_FP_CHANCE = 0.01
+# bloom filter buckets per key and hash count for a 1% false positive
+# chance, and the bits OpenBitSet adds
+BLOOM_BUCKETS = 10
+BLOOM_HASHES = 5
+BLOOM_EXCESS = 20
+NO_COMPRESSION_RATIO = -1.0
+COMPRESSOR = "LZ4Compressor"
+# 2020-01-01 in microseconds, generated timestamps count up from here
+BASE_TIMESTAMP = 1577836800000000
+VERSIONS = ['ka', 'la', 'lb']
+
+def utf(s):
+    return SHORT.pack(len(s)) + s
+
+def data(s):
+    return INT.pack(len(s)) + s
+
+def composite(components, eoc="\0"):
+    # every component is followed by its end-of-component byte, the last
+    # one marks the start (0xff) or end (0x01) of a slice in tombstones
+    parts = [utf(c) + "\0" for c in components]
+    parts[-1] = parts[-1][:-1] + eoc
+    return "".join(parts)
+
+def histogramoffsets(size):
+    # EstimatedHistogram's bucket offsets, growing by 20%
+    offsets = [1]
+    while len(offsets) < size:
+        last = offsets[-1]
+        offsets.append(max(last + 1, int(math.floor(last * 1.2 + 0.5))))
+    return offsets
+
+class EstimatedHistogram:
+    def __init__(self, size):
+        self.offsets = histogramoffsets(size)
+        self.buckets = [0] * (size + 1)
+
+    def add(self, value):
+        self.buckets[bisect.bisect_left(self.offsets, value)] += 1
+
+    def serialize(self):
+        # the first offset is written twice, every bucket with the offset
+        # before it
+        parts = [INT.pack(len(self.buckets))]
+        for i in xrange(len(self.buckets)):
+            parts.append(LONG.pack(self.offsets[max(i - 1, 0)]) + LONG.pack(self.buckets[i]))
+        return "".join(parts)
+
+class StreamingHistogram:
+    def __init__(self, maxbinsize):
+        self.maxbinsize = maxbinsize
+        self.bins = {}
+
+    def update(self, point):
+        # Cassandra's StreamingHistogram.update, the closest bins are merged
+        # once there are too many
+        point = float(point)
+        self.bins[point] = self.bins.get(point, 0) + 1
+        if len(self.bins) > self.maxbinsize:
+            points = sorted(self.bins.keys())
+            i = min(xrange(len(points) - 1), key=lambda i: points[i + 1] - points[i])
+            (p1, p2) = (points[i], points[i + 1])
+            (k1, k2) = (self.bins.pop(p1), self.bins.pop(p2))
+            merged = (p1 * k1 + p2 * k2) / (k1 + k2)
+            self.bins[merged] = self.bins.get(merged, 0) + k1 + k2
+
+    def serialize(self):
+        points = sorted(self.bins.keys())
+        return INT.pack(self.maxbinsize) + INT.pack(len(points)) + "".join([DOUBLE.pack(p) + LONG.pack(self.bins[p]) for p in points])
+
+class DataWriter:
+    # writes Data.db, in LZ4 compressed chunks or as is with a CRC.db of
+    # the chunk checksums, and keeps the Adler32 of the whole file
+    def __init__(self, filename, compressed, chunklen):
+        self.file = open(filename, 'wb')
+        self.compressed = compressed
+        self.chunklen = chunklen
+        if compressed != True:
+            self.chunklen = CRC_CHUNK_LENGTH
+        self.pending = []
+        self.pendingsize = 0
+        self.position = 0
+        self.filesize = 0
+        self.digest = 1
+        self.offsets = []
+        self.checksums = []
+
+    def write(self, s):
+        self.pending.append(s)
+        self.pendingsize += len(s)
+        self.position += len(s)
+        if self.pendingsize >= self.chunklen:
+            pending = "".join(self.pending)
+            start = 0
+            while len(pending) - start >= self.chunklen:
+                self.writechunk(pending[start:start + self.chunklen])
+                start += self.chunklen
+            self.pending = [pending[start:]]
+            self.pendingsize = len(self.pending[0])
+
+    def writechunk(self, chunk):
+        if self.compressed:
+            # the uncompressed length goes before the LZ4 block, the Adler32
+            # of the compressed bytes after it
+            compressed = lz4.block.compress(chunk)
+            self.offsets.append(self.filesize)
+            chunk = compressed + CHECKSUM.pack(zlib.adler32(compressed) & 0xffffffff)
+        else:
+            self.checksums.append(zlib.adler32(chunk) & 0xffffffff)
+        self.file.write(chunk)
+        self.filesize += len(chunk)
+        self.digest = zlib.adler32(chunk, self.digest)
+
+    def close(self):
+        if self.pendingsize > 0:
+            self.writechunk("".join(self.pending))
+        self.pending = []
+        self.file.close()
+        return self.digest & 0xffffffff
+
+class SSTableWriter20:
+    def __init__(self, directory, keyspace, table, version='lb', generation=1, compressed=True, chunklen=CHUNK_LENGTH, partitionername='org.apache.cassandra.dht.Murmur3Partitioner'):
+        if version not in VERSIONS:
+            raise ValueError("version %s is not supported, only %s" % (version, ", ".join(VERSIONS)))
+        self.directory = directory
+        self.keyspace = keyspace
+        self.table = table
+        self.version = version
+        self.generation = generation
+        self.compressed = compressed
+        self.partitioner = partitionername
+        self.token = partitioner.gettokenfunction(partitionername)
+        if os.path.isdir(directory) != True:
+            os.makedirs(directory)
+        self.data = DataWriter(self.filename("Data.db"), compressed, chunklen)
+        self.index = open(self.filename("Index.db"), 'wb')
+        self.indexposition = 0
+        self.keys = []
+        self.summary = []
+        self.lasttoken = None
+        self.rowsizes = EstimatedHistogram(150)
+        self.colcounts = EstimatedHistogram(114)
+        self.tombstones = StreamingHistogram(TOMBSTONE_HISTOGRAM_BINS)
+        self.tsmin = None
+        self.tsmax = None
+        self.maxlocaldeletiontime = None
+        self.mincolnames = []
+        self.maxcolnames = []
+
+    def filename(self, component):
+        if self.version >= 'la':
+            name = "%s-%d-big-%s" % (self.version, self.generation, component)
+        else:
+            name = "%s-%s-%s-%d-%s" % (self.keyspace, self.table, self.version, self.generation, component)
+        return os.path.join(self.directory, name)
+
+    def append(self, key, cells, deletiontime=None):
+        # cells are in clustering order: ('cell', name, ts, value),
+        # ('expiring', name, ts, ttl, expiration, value), ('deleted', name,
+        # ts, localdeletiontime) or ('range', min, max, markedfordeleteat,
+        # localdeletiontime), names as lists of components
+        token = (self.token(key), key)
+        if self.lasttoken != None and token <= self.lasttoken:
+            raise ValueError("partitions must be appended in token order")
+        self.lasttoken = token
+        position = self.data.position
+        if len(self.keys) % MIN_INDEX_INTERVAL == 0:
+            self.summary.append((key, self.indexposition))
+        entry = utf(key) + LONG.pack(position) + INT.pack(0)
+        self.index.write(entry)
+        self.indexposition += len(entry)
+        self.keys.append(key)
+        parts = [utf(key)]
+        if deletiontime == None:
+            parts.append(LIVE_DELETION_TIME)
+        else:
+            (markedfordeleteat, localdeletiontime) = deletiontime
+            parts.append(INT.pack(localdeletiontime) + LONG.pack(markedfordeleteat))
+            self.updatetime(markedfordeleteat, localdeletiontime)
+        count = 0
+        for cell in cells:
+            kind = cell[0]
+            if kind == 'range':
+                (kind, start, end, markedfordeleteat, localdeletiontime) = cell
+                parts.append(utf(composite(start, START_OF_SLICE)) + chr(RANGE_TOMBSTONE_MASK) + utf(composite(end, END_OF_SLICE)) + INT.pack(localdeletiontime) + LONG.pack(markedfordeleteat))
+                self.updatetime(markedfordeleteat, localdeletiontime)
+                continue
+            name = cell[1]
+            self.updatenames(name[:-1])
+            count += 1
+            if kind == 'cell':
+                (kind, name, ts, value) = cell
+                parts.append(utf(composite(name)) + "\0" + LONG.pack(ts) + data(value))
+                self.updatetime(ts, None)
+            elif kind == 'expiring':
+                (kind, name, ts, ttl, expiration, value) = cell
+                parts.append(utf(composite(name)) + chr(EXPIRATION_MASK) + INT.pack(ttl) + INT.pack(expiration) + LONG.pack(ts) + data(value))
+                self.updatetime(ts, expiration)
+            else:
+                (kind, name, ts, localdeletiontime) = cell
+                parts.append(utf(composite(name)) + chr(DELETION_MASK) + LONG.pack(ts) + data(INT.pack(localdeletiontime)))
+                self.updatetime(ts, localdeletiontime)
+        parts.append(END_OF_ROW)
+        partition = "".join(parts)
+        self.data.write(partition)
+        self.rowsizes.add(len(partition))
+        self.colcounts.add(count)
+
+    def updatetime(self, ts, localdeletiontime):
+        if self.tsmin == None or ts < self.tsmin:
+            self.tsmin = ts
+        if self.tsmax == None or ts > self.tsmax:
+            self.tsmax = ts
+        if localdeletiontime != None:
+            self.tombstones.update(localdeletiontime)
+            if self.maxlocaldeletiontime == None or localdeletiontime > self.maxlocaldeletiontime:
+                self.maxlocaldeletiontime = localdeletiontime
+
+    def updatenames(self, clustering):
+        # per component minimum and maximum of the clustering values
+        for i in xrange(len(clustering)):
+            if i == len(self.mincolnames):
+                self.mincolnames.append(clustering[i])
+                self.maxcolnames.append(clustering[i])
+            else:
+                self.mincolnames[i] = min(self.mincolnames[i], clustering[i])
+                self.maxcolnames[i] = max(self.maxcolnames[i], clustering[i])
+
+    def close(self):
+        self.index.close()
+        digest = self.data.close()
+        components = ["Data.db", "Index.db", "Summary.db", "Filter.db", "Statistics.db", "TOC.txt"]
+        if self.compressed:
+            self.writecompressioninfo()
+            components.append("CompressionInfo.db")
+        else:
+            self.writecrc()
+            components.append("CRC.db")
+        self.writesummary()
+        self.writefilter()
+        self.writestatistics()
+        # 2.1 writes the Adler32 digest under the old sha1 name
+        digestcomponent = "Digest.adler32"
+        if self.version < 'la':
+            digestcomponent = "Digest.sha1"
+        self.writefile(digestcomponent, str(digest))
+        components.append(digestcomponent)
+        self.writefile("TOC.txt", "".join([c + "\n" for c in components]))
+        return self.filename("Data.db")
+
+    def writefile(self, component, contents):
+        f = open(self.filename(component), 'wb')
+        f.write(contents)
+        f.close()
+
+    def writecompressioninfo(self):
+        parts = [utf(COMPRESSOR), INT.pack(0), INT.pack(self.data.chunklen), LONG.pack(self.data.position), INT.pack(len(self.data.offsets))]
+        parts.extend([LONG.pack(offset) for offset in self.data.offsets])
+        self.writefile("CompressionInfo.db", "".join(parts))
+
+    def writecrc(self):
+        self.writefile("CRC.db", INT.pack(self.data.chunklen) + "".join([CHECKSUM.pack(c) for c in self.data.checksums]))
+
+    def writesummary(self):
+        # the offsets and entries are in native (little endian) byte order,
+        # offsets count from the start of the offsets
+        offsets = []
+        entries = []
+        position = len(self.summary) * SUMMARY_OFFSET.size
+        for (key, indexposition) in self.summary:
+            offsets.append(SUMMARY_OFFSET.pack(position))
+            entries.append(key + SUMMARY_POSITION.pack(indexposition))
+            position += len(key) + SUMMARY_POSITION.size
+        fullsize = (len(self.keys) + MIN_INDEX_INTERVAL - 1) / MIN_INDEX_INTERVAL
+        first = ""
+        last = ""
+        if len(self.keys) > 0:
+            (first, last) = (self.keys[0], self.keys[-1])
+        header = INT.pack(MIN_INDEX_INTERVAL) + INT.pack(len(self.summary)) + LONG.pack(position) + INT.pack(BASE_SAMPLING_LEVEL) + INT.pack(fullsize)
+        self.writefile("Summary.db", header + "".join(offsets) + "".join(entries) + data(first) + data(last))
+
+    def writefilter(self):
+        words = (len(self.keys) * BLOOM_BUCKETS + BLOOM_EXCESS + 63) / 64
+        bloomfilter = BloomFilter.build(self.keys, BLOOM_HASHES, words, True)
+        self.writefile("Filter.db", bloomfilter.serialize())
+
+    def writestatistics(self):
+        # the VALIDATION, COMPACTION and STATS components after their table
+        # of contents
+        validation = utf(self.partitioner) + DOUBLE.pack(BLOOM_FILTER_FP_CHANCE)
+        # no ancestors and an empty cardinality estimate
+        compaction = INT.pack(0) + INT.pack(0)
+        ratio = NO_COMPRESSION_RATIO
+        if self.compressed and self.data.position > 0:
+            ratio = float(self.data.filesize) / self.data.position
+        maxlocaldeletiontime = self.maxlocaldeletiontime
+        if maxlocaldeletiontime == None:
+            maxlocaldeletiontime = INT_MAX_VALUE
+        stats = [self.rowsizes.serialize(), self.colcounts.serialize(), LONG.pack(0), INT.pack(0)]
+        stats.append(LONG.pack(self.tsmin or 0) + LONG.pack(self.tsmax or 0) + INT.pack(maxlocaldeletiontime))
+        stats.append(DOUBLE.pack(ratio) + self.tombstones.serialize() + INT.pack(0) + LONG.pack(0))
+        stats.append(INT.pack(len(self.mincolnames)) + "".join([utf(c) for c in self.mincolnames]))
+        stats.append(INT.pack(len(self.maxcolnames)) + "".join([utf(c) for c in self.maxcolnames]))
+        stats.append("\0")
+        if self.version >= 'lb':
+            # the commit log lower bound
+            stats.append(LONG.pack(0) + INT.pack(0))
+        components = [validation, compaction, "".join(stats)]
+        position = INT.size + len(components) * 2 * INT.size
+        toc = [INT.pack(len(components))]
+        for i in xrange(len(components)):
+            toc.append(INT.pack(i) + INT.pack(position))
+            position += len(components[i])
+        self.writefile("Statistics.db", "".join(toc) + "".join(components))
+
+def valuebytes(rng, size):
+    if size == 0:
+        return ""
+    return binascii.unhexlify("%0*x" % (size * 2, rng.getrandbits(size * 8)))
+
+def generate(writer, partitions, cells, columns, valuesize, ttl, ttlratio, tombstones, rowdeletions, seed):
+    # appends partitions of cells cells each, a row is its marker and one
+    # cell per column. The same seed appends the same partitions
+    rng = random.Random(seed)
+    keys = sorted([INT.pack(i) for i in xrange(partitions)], key=lambda k: (writer.token(k), k))
+    names = ["v%d" % (i) for i in xrange(columns)]
+    (minsize, maxsize) = valuesize
+    ts = BASE_TIMESTAMP
+    for key in keys:
+        partition = []
+        row = 0
+        count = 0
+        while count < cells:
+            clustering = INT.pack(row)
+            row += 1
+            ts += 1
+            now = ts / 1000000
+            # the first row stays live, readers take a partition's first
+            # atom for its row marker
+            if row > 1 and rng.random() < rowdeletions:
+                partition.append(('range', [clustering], [clustering], ts, now))
+                count += 1
+                continue
+            partition.append(('cell', [clustering, ""], ts, ""))
+            count += 1
+            for name in names:
+                if count >= cells:
+                    break
+                count += 1
+                if rng.random() < tombstones:
+                    partition.append(('deleted', [clustering, name], ts, now))
+                    continue
+                value = valuebytes(rng, rng.randint(minsize, maxsize))
+                if ttl > 0 and rng.random() < ttlratio:
+                    partition.append(('expiring', [clustering, name], ts, ttl, now + ttl, value))
+                else:
+                    partition.append(('cell', [clustering, name], ts, value))
+        writer.append(key, partition)
+
+def tabledirectory(output, keyspace, table):
+    # <keyspace>/<table>-<id> as in a Cassandra data directory, the id is
+    # derived from the names so runs are reproducible
+    return os.path.join(output, keyspace, "%s-%s" % (table, hashlib.md5(keyspace + "." + table).hexdigest()))
+
+def parsesize(text):
+    # MIN or MIN:MAX
+    sizes = [int(s) for s in text.split(":")]
+    if len(sizes) == 1:
+        return (sizes[0], sizes[0])
+    return (sizes[0], sizes[1])
+
+def main():
+    parser = argparse.ArgumentParser(prog="sstgen")
+    parser.add_argument("-o", "--output", help="data directory the sstable is written under", type=str, required=True)
+    parser.add_argument("-k", "--keyspace", help="keyspace name", type=str, default="gen")
+    parser.add_argument("-t", "--table", help="table name", type=str, default="data")
+    parser.add_argument("-V", "--sstable-version", help="sstable format version", choices=VERSIONS, default="lb")
+    parser.add_argument("-g", "--generation", help="sstable generation", type=int, default=1)
+    parser.add_argument("-p", "--partitioner", help="partitioner", type=str, default="murmur3")
+    parser.add_argument("-n", "--partitions", help="number of partitions", type=int, default=1000)
+    parser.add_argument("--cells", help="cells per partition, row markers and tombstones included", type=int, default=20)
+    parser.add_argument("--columns", help="regular columns per row", type=int, default=4)
+    parser.add_argument("--value-size", help="value size in bytes, MIN or MIN:MAX", type=str, default="8")
+    parser.add_argument("--ttl", help="TTL in seconds of expiring cells, 0 for none", type=int, default=0)
+    parser.add_argument("--ttl-ratio", help="fraction of the cells that expire when --ttl is set", type=float, default=1.0)
+    parser.add_argument("--tombstones", help="fraction of the cells that are tombstones", type=float, default=0.0)
+    parser.add_argument("--row-deletions", help="fraction of the rows deleted by a range tombstone", type=float, default=0.0)
+    parser.add_argument("--uncompressed", help="write Data.db uncompressed, with a CRC.db", action="store_true")
+    parser.add_argument("--chunk-length", help="compression chunk length in KB", type=int, default=CHUNK_LENGTH / 1024)
+    parser.add_argument("--seed", help="random seed, the same arguments and seed write the same sstable", type=int, default=0)
+    args = parser.parse_args()
+
+    partitionername = partitioner.ALIASES.get(args.partitioner, args.partitioner)
+    directory = tabledirectory(args.output, args.keyspace, args.table)
+    try:
+        writer = SSTableWriter20(directory, args.keyspace, args.table, args.sstable_version, args.generation, args.uncompressed != True, args.chunk_length * 1024, partitionername)
+    except ValueError, e:
+        print >> sys.stderr, e
+        sys.exit(1)
+    generate(writer, args.partitions, args.cells, args.columns, parsesize(args.value_size), args.ttl, args.ttl_ratio, args.tombstones, args.row_deletions, args.seed)
+    print writer.close()
+
+if __name__ == "__main__":
+    main()
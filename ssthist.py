@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specif
+
+# NumPy versions of the Statistics.db histograms, the percentiles follow
+# Cassandra's EstimatedHistogram and StreamingHistogram so they match what
+# nodetool tablehistograms reports
+
+import numpy
+
+LONG_MAX_VALUE = 0x7fffffffffffffff
+PERCENTILES = [0.5, 0.75, 0.95, 0.98, 0.99]
+
+class EstimatedHistogram:
+    # buckets[i] counts the values in (offsets[i - 1], offsets[i]], the last
+    # bucket counts the values over the last offset
+    def __init__(self, offsets, buckets):
+        self.offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        self.buckets = numpy.asarray(buckets, dtype=numpy.int64)
+
+    def fromstats(self, histogram):
+        # the (offsets, buckets) lists SSTableMetadata unpacks
+        return EstimatedHistogram(histogram[0], histogram[1])
+    fromstats = classmethod(fromstats)
+
+    def count(self):
+        return int(self.buckets.sum())
+
+    def isoverflowed(self):
+        return self.buckets[-1] > 0
+
+    def percentiles(self, percentiles):
+        # the offset of the bucket holding the ceil(count * p)th value, for
+        # all percentiles at once
+        if self.isoverflowed():
+            raise ValueError("unable to compute percentiles when the histogram overflowed")
+        pcounts = numpy.ceil(self.count() * numpy.asarray(percentiles, dtype=numpy.float64))
+        cumulative = numpy.cumsum(self.buckets[:-1])
+        i = numpy.searchsorted(cumulative, pcounts, side='left')
+        i = numpy.minimum(i, len(self.offsets) - 1)
+        return numpy.where(pcounts == 0, 0, self.offsets[i])
+
+    def percentile(self, percentile):
+        return int(self.percentiles([percentile])[0])
+
+    def min(self):
+        nonzero = numpy.flatnonzero(self.buckets)
+        if len(nonzero) == 0 or nonzero[0] == 0:
+            return 0
+        return int(self.offsets[nonzero[0] - 1]) + 1
+
+    def max(self):
+        if self.isoverflowed():
+            return LONG_MAX_VALUE
+        nonzero = numpy.flatnonzero(self.buckets)
+        if len(nonzero) == 0:
+            return 0
+        return int(self.offsets[nonzero[-1]])
+
+    def mean(self):
+        elements = self.buckets[:-1].sum()
+        if elements == 0:
+            return 0
+        return int(numpy.ceil(float((self.buckets[:-1] * self.offsets).sum()) / elements))
+
+    def merge(self, other):
+        # sstables of one table share the bucket offsets, a histogram with
+        # fewer buckets has a prefix of the longer one's offsets
+        (longer, shorter) = (self, other)
+        if len(other.offsets) > len(self.offsets):
+            (longer, shorter) = (other, self)
+        n = len(shorter.offsets)
+        if numpy.array_equal(longer.offsets[:n], shorter.offsets) != True:
+            raise ValueError("histograms with different bucket offsets can't be merged")
+        buckets = longer.buckets.copy()
+        buckets[:n] += shorter.buckets[:n]
+        # the shorter one's overflow is only known to be over its last
+        # offset, it's counted in the first bucket above it
+        buckets[n] += shorter.buckets[n]
+        return EstimatedHistogram(longer.offsets, buckets)
+
+class StreamingHistogram:
+    # bins of (point, count) with at most maxbinsize bins, closest bins are
+    # merged into their weighted mean
+    def __init__(self, maxbinsize, points, counts):
+        self.maxbinsize = maxbinsize
+        order = numpy.argsort(points)
+        self.points = numpy.asarray(points, dtype=numpy.float64)[order]
+        self.counts = numpy.asarray(counts, dtype=numpy.int64)[order]
+
+    def fromstats(self, histogram):
+        # the (maxbinsize, {point: count}) SSTableMetadata unpacks
+        (maxbinsize, bins) = histogram
+        points = sorted(bins.keys())
+        return StreamingHistogram(maxbinsize, points, [bins[p] for p in points])
+    fromstats = classmethod(fromstats)
+
+    def count(self):
+        return int(self.counts.sum())
+
+    def merge(self, other):
+        # all bins are added at once, then the closest ones merged until at
+        # most maxbinsize are left
+        (points, inverse) = numpy.unique(numpy.concatenate([self.points, other.points]), return_inverse=True)
+        counts = numpy.zeros(len(points), dtype=numpy.int64)
+        numpy.add.at(counts, inverse, numpy.concatenate([self.counts, other.counts]))
+        points = list(points)
+        counts = list(counts)
+        maxbinsize = max(self.maxbinsize, other.maxbinsize)
+        while len(points) > maxbinsize:
+            i = int(numpy.argmin(numpy.diff(points)))
+            k = counts[i] + counts[i + 1]
+            points[i] = (points[i] * counts[i] + points[i + 1] * counts[i + 1]) / float(k)
+            counts[i] = k
+            del points[i + 1]
+            del counts[i + 1]
+        return StreamingHistogram(maxbinsize, points, counts)
+
+    def sum(self, b):
+        # estimated number of points up to b
+        if len(self.points) == 0:
+            return 0.0
+        i = numpy.searchsorted(self.points, b, side='right')
+        if i == len(self.points):
+            return float(self.counts.sum())
+        if i == 0:
+            return 0.0
+        (p, pnext) = (self.points[i - 1], self.points[i])
+        (m, mnext) = (float(self.counts[i - 1]), float(self.counts[i]))
+        weight = (b - p) / (pnext - p)
+        mb = m + (mnext - m) * weight
+        return float(self.counts[:i - 1].sum()) + (m + mb) * weight / 2 + m / 2
+
+class TableHistograms:
+    # the histograms of all sstables of one table merged, tombstones
+    # deleted before gcbefore (seconds) are reported as droppable
+    def __init__(self, gcbefore=None):
+        self.gcbefore = gcbefore
+        self.sstables = 0
+        self.rowsizes = None
+        self.colcounts = None
+        self.tombstones = None
+
+    def add(self, metadata):
+        rowsizes = EstimatedHistogram.fromstats(metadata.rowsizes)
+        colcounts = EstimatedHistogram.fromstats(metadata.colcounts)
+        self.sstables += 1
+        if self.rowsizes == None:
+            (self.rowsizes, self.colcounts) = (rowsizes, colcounts)
+        else:
+            self.rowsizes = self.rowsizes.merge(rowsizes)
+            self.colcounts = self.colcounts.merge(colcounts)
+        # 'ia' onwards record the tombstone drop times
+        if metadata.tombstonehistogram != []:
+            tombstones = StreamingHistogram.fromstats(metadata.tombstonehistogram)
+            if self.tombstones == None:
+                self.tombstones = tombstones
+            else:
+                self.tombstones = self.tombstones.merge(tombstones)
+
+    def __repr__(self):
+        lines = ["%-12s%18s%18s" % ("Percentile", "Partition Size", "Cell Count"), "%-12s%18s%18s" % ("", "(bytes)", "")]
+        if self.rowsizes.isoverflowed() or self.colcounts.isoverflowed():
+            lines.append("the histograms overflowed, percentiles are not available")
+        else:
+            rowsizes = self.rowsizes.percentiles(PERCENTILES)
+            colcounts = self.colcounts.percentiles(PERCENTILES)
+            for i in xrange(len(PERCENTILES)):
+                lines.append("%-12s%18d%18d" % ("%g%%" % (PERCENTILES[i] * 100), rowsizes[i], colcounts[i]))
+        lines.append("%-12s%18d%18d" % ("Min", self.rowsizes.min(), self.colcounts.min()))
+        lines.append("%-12s%18d%18d" % ("Max", self.rowsizes.max(), self.colcounts.max()))
+        lines.append("Partitions: %d SSTables: %d" % (self.rowsizes.count(), self.sstables))
+        if self.tombstones != None:
+            line = "Tombstones: %d" % (self.tombstones.count())
+            if self.gcbefore != None:
+                line += " droppable: %d" % (round(self.tombstones.sum(self.gcbefore)))
+            lines.append(line)
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specif
+
+# classes to read the row index entries of a given SSTable
+
+import array
+import bisect
+from buffer import MappedBuffer
+
+class IndexInfo:
+    def __init__(self, keys, keyoffsets, positions):
+        # all keys packed back to back, key i is keys[keyoffsets[i]:keyoffsets[i + 1]]
+        self.keys = keys
+        self.keyoffsets = keyoffsets
+        # Data.db position of each partition
+        self.positions = positions
+        self.rowcount = len(positions)
+        self.entries = IndexEntries(self)
+
+    def key(self, i):
+        return self.keys[self.keyoffsets[i]:self.keyoffsets[i + 1]]
+
+    def indexof(self, pos):
+        # entries are stored in Data.db order, so positions are sorted
+        return bisect.bisect_left(self.positions, pos)
+
+    def parse(self, filename):
+        buf = MappedBuffer(filename)
+        keys = bytearray()
+        keyoffsets = array.array('L', [0])
+        positions = array.array('l')
+        while buf.remaining() > 0:
+            keys.extend(buf.unpack_utf_string())
+            keyoffsets.append(len(keys))
+            positions.append(buf.unpack_longlong())
+            buf.skip_data()
+        buf.close()
+        return IndexInfo(str(keys), keyoffsets, positions)
+    parse = classmethod(parse)
+
+    def iterate(self, filename, start=0):
+        # streams (key, position) pairs without holding Index.db in memory
+        buf = MappedBuffer(filename)
+        buf.seek(start)
+        try:
+            while buf.remaining() > 0:
+                key = buf.unpack_utf_string()
+                pos = buf.unpack_longlong()
+                buf.skip_data()
+                yield (key.tobytes(), pos)
+        finally:
+            buf.close()
+    iterate = classmethod(iterate)
+
+    def lookup(self, filename, key, start, end):
+        # scan the entries starting in [start, end) of Index.db for key,
+        # returns (key, position, position of the next partition or None)
+        buf = MappedBuffer(filename)
+        buf.seek(start)
+        found = None
+        while buf.remaining() > 0:
+            if found == None and end != None and buf.offset >= end:
+                break
+            k = buf.unpack_utf_string()
+            pos = buf.unpack_longlong()
+            buf.skip_data()
+            if found != None:
+                found = found + (pos,)
+                break
+            if k == key:
+                found = (k.tobytes(), pos)
+        buf.close()
+        if found != None and len(found) == 2:
+            found = found + (None,)
+        return found
+    lookup = classmethod(lookup)
+
+    def __repr__(self):
+        return "row count: %d keys size: %d" % (self.rowcount, len(self.keys))
+
+class IndexEntries:
+    # read only list of (key, position) tuples over a packed IndexInfo
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return self.index.rowcount
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in xrange(*i.indices(self.index.rowcount))]
+        if i < 0:
+            i += self.index.rowcount
+        if i < 0 or i >= self.index.rowcount:
+            raise IndexError("index entry %d out of range" % (i))
+        return (self.index.key(i), self.index.positions[i])
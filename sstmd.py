@@ -18,14 +18,73 @@
 # a stand alone script to read metadata of a given SSTable
 import os
 from buffer import Buffer
-from sstable import IndexSummary
-from sstable import CompressionInfo
-from datetime import datetime
-import time
-from pytz import utc
+import sstable
+from partitioner import signed64
+import calendar
+import struct
 import argparse
 
-class SSTableMetadata:
+MARSHAL = 'org.apache.cassandra.db.marshal.'
+# clustering types whose serialized bytes don't sort like their values
+CLUSTERING_FORMATS = {
+    MARSHAL + 'Int32Type': struct.Struct('>i'),
+    MARSHAL + 'LongType': struct.Struct('>q'),
+    MARSHAL + 'TimestampType': struct.Struct('>q'),
+    MARSHAL + 'DateType': struct.Struct('>q'),
+    MARSHAL + 'FloatType': struct.Struct('>f'),
+    MARSHAL + 'DoubleType': struct.Struct('>d'),
+}
+
+def clusteringcomparator(type):
+    # compares two serialized clustering values of the given type, unknown
+    # types (and 2.x sstables, which don't record them) compare as bytes
+    if type != None and type.startswith(MARSHAL + 'ReversedType(') and type.endswith(')'):
+        compare = clusteringcomparator(type[len(MARSHAL + 'ReversedType('):-1])
+        return lambda a, b: compare(b, a)
+    fmt = CLUSTERING_FORMATS.get(type)
+    if fmt == None:
+        return cmp
+    def compare(a, b):
+        # empty values sort first
+        if len(a) != fmt.size or len(b) != fmt.size:
+            return cmp(len(a), len(b))
+        return cmp(fmt.unpack(a)[0], fmt.unpack(b)[0])
+    return compare
+
+# the fields each Statistics.db component holds, by component type
+KA_COMPONENT_FIELDS = {
+    0: ['partitioner', 'bloomfilterfpchance'],
+    1: ['ancestors', 'cardinality'],
+    2: ['rowsizes', 'colcounts', 'replaysegid', 'replaypos', 'tsmin', 'tsmax', 'maxlocaldeletiontime', 'compressionratio', 'tombstonehistogram', 'sstablelevel', 'repairedat', 'mincolnames', 'maxcolnames', 'haslegacycountershards'],
+}
+MC_COMPONENT_FIELDS = {
+    0: ['partitioner', 'bloomfilterfpchance'],
+    1: ['cardinality'],
+    2: ['rowsizes', 'colcounts', 'replaysegid', 'replaypos', 'tsmin', 'tsmax', 'minlocaldeletiontime', 'maxlocaldeletiontime', 'minttl', 'maxttl', 'compressionratio', 'tombstonehistogram', 'sstablelevel', 'repairedat', 'minclusteringvalues', 'maxclusteringvalues', 'haslegacycountershards', 'totalcolsset', 'totalrows', 'commitloglbreplaysegid', 'commitloglbreplaypos', 'commitlogintervals'],
+    3: ['esminttl', 'esmintimestap', 'esminlocaldeletiontime', 'keytype', 'clusteringtypes', 'staticcols', 'regularcols'],
+}
+
+def fieldcomponents(componentfields):
+    components = {}
+    for (component, names) in componentfields.items():
+        for name in names:
+            components[name] = component
+    return components
+
+class LazyField(object):
+    # a metadata field that is decoded on first access. Once loaded the
+    # value is an instance attribute, which takes precedence over this
+    def __init__(self, name, default):
+        self.name = name
+        self.default = default
+
+    def __get__(self, metadata, cls):
+        if metadata is None:
+            return self.default
+        metadata.loadfield(self.name)
+        return metadata.__dict__.get(self.name, self.default)
+
+class SSTableMetadata(object):
     descriptor = ''
     version = ''
     rowsizes = []
@@ -53,11 +112,16 @@ class SSTableMetadata:
     clusteringtypes = []
     staticcols = []
     regularcols = []
-    dt = datetime(year=2015, month=9, day=22)
-    microepoch = (time.mktime(utc.localize(dt).utctimetuple()) * 1000 * 1000)
-    secepoch = time.mktime(utc.localize(dt).utctimetuple())
+    # the EncodingStats epoch of 3.x deltas, 2015-09-22 00:00 UTC
+    secepoch = calendar.timegm((2015, 9, 22, 0, 0, 0))
+    microepoch = secepoch * 1000 * 1000
     summary = None
     compression = None
+    statfile = None
+    buf = None
+    toc = {}
+    pending = ()
+    components = {}
 
     def setsummary(self, summary):
         self.summary = summary
@@ -65,6 +129,54 @@ class SSTableMetadata:
     def setcompression(self, compression):
         self.compression = compression
 
+    def loadfield(self, name):
+        # decodes the Statistics.db component holding name, or reads the
+        # Summary.db or CompressionInfo.db file
+        if name in ('summary', 'compression') and self.statfile == None:
+            return
+        if name == 'summary':
+            summaryfile = self.statfile.replace("Statistics", "Summary")
+            summary = None
+            if os.path.isfile(summaryfile):
+                summary = sstable.IndexSummary.parse(summaryfile)
+            self.setsummary(summary)
+        elif name == 'compression':
+            compressionfile = self.statfile.replace("Statistics", "CompressionInfo")
+            compression = None
+            if os.path.isfile(compressionfile):
+                compression = sstable.CompressionInfo.parse(compressionfile)
+            self.setcompression(compression)
+        else:
+            component = self.components.get(name)
+            if component in self.pending:
+                self.loadcomponent(component)
+
+    def loadcomponent(self, component):
+        self.pending.remove(component)
+        self.buf.seek(self.toc[component])
+        if self.version >= 'mc':
+            self.parse_component_mc(self.buf, component)
+        else:
+            self.parse_component_ka(self.buf, component)
+
+    def loadall(self):
+        for component in sorted(self.pending):
+            self.loadcomponent(component)
+        if self.statfile != None:
+            self.summary
+            self.compression
+
+    def __getstate__(self):
+        # everything is decoded before pickling, the file buffer isn't kept
+        # and memoryviews into it are kept as bytes
+        self.loadall()
+        state = self.__dict__.copy()
+        state.pop('buf', None)
+        for (name, value) in state.items():
+            if isinstance(value, memoryview):
+                state[name] = value.tobytes()
+        return state
+
     def parse(self, filename, version):
         size = os.stat(filename).st_size
         remaining = size
@@ -74,6 +186,8 @@ class SSTableMetadata:
         metadata = SSTableMetadata()
         metadata.descriptor = os.path.abspath(filename)
         metadata.version = version
+        # Summary.db and CompressionInfo.db are read on first access
+        metadata.statfile = filename
         if version >= 'mc':
             metadata.parse_metadata_version_mc(buf, version)
         elif version >= 'ka':
@@ -86,12 +200,6 @@ class SSTableMetadata:
             metadata.parse_metadata_version_ia(buf, version)
         else:
             print "version %s not supported" % (version)
-        summaryfile = filename.replace("Statistics", "Summary")
-        summary = IndexSummary.parse(summaryfile)
-        metadata.setsummary(summary)
-        compressionfile = filename.replace("Statistics", "CompressionInfo")
-        compression = CompressionInfo.parse(compressionfile)
-        metadata.setcompression(compression)
         return metadata
     parse = classmethod(parse)
 
@@ -108,7 +216,7 @@ class SSTableMetadata:
         if version >= 'hb':
             self.compressionratio = buf.unpack_double()
         if version >= 'hc':
-            self.partitioner = buf.unpack_utf_string()
+            self.partitioner = buf.unpack_utf_string().tobytes()
         if version >= 'he':
             ancestorscount = buf.unpack_int()
             self.ancestors = []
@@ -127,7 +235,7 @@ class SSTableMetadata:
         self.maxlocaldeletiontime = buf.unpack_int()
         self.bloomfilterfpchance = buf.unpack_double()
         self.compressionratio = buf.unpack_double()
-        self.partitioner = buf.unpack_utf_string()
+        self.partitioner = buf.unpack_utf_string().tobytes()
         ancestorscount = buf.unpack_int()
         self.ancestors = []
         for i in xrange(ancestorscount):
@@ -138,118 +246,167 @@ class SSTableMetadata:
         self.maxcolnames = []
         count = buf.unpack_int()
         for i in xrange(count):
-            self.mincolnames.append(buf.unpack_utf_string())
+            self.mincolnames.append(buf.unpack_utf_string().tobytes())
         count = buf.unpack_int()
         for i in xrange(count):
-            self.maxcolnames.append(buf.unpack_utf_string())
+            self.maxcolnames.append(buf.unpack_utf_string().tobytes())
 
     def parse_metadata_version_ka(self, buf, version):
+        # only the table of contents is read here, the components are
+        # decoded when one of their fields is first used
+        self.parse_toc(buf, KA_COMPONENT_FIELDS)
+
+    def parse_toc(self, buf, componentfields):
         numcomponents = buf.unpack_int()
-        toc = {}
-        
+        self.toc = {}
         for i in xrange(numcomponents):
             type = buf.unpack_int()
             val = buf.unpack_int()
-            toc[type] = val
-        for j in xrange(3):
-            if j in toc:
-                buf.seek(toc[j])
-                if j == 0:
-                    self.partitioner = buf.unpack_utf_string()
-                    self.bloomfilterfpchance = buf.unpack_double()
-                elif j == 1:
-                    ancestorscount = buf.unpack_int()
-                    self.ancestors = []
-                    for a in xrange(ancestorscount):
-                        self.ancestors.append(buf.unpack_int())
-                    self.cardinality = buf.unpack_data()
-                else:
-                    self.rowsizes = SSTableMetadata.unpack_estimated_histogram(buf)
-                    self.colcounts = SSTableMetadata.unpack_estimated_histogram(buf)
-                    self.replaysegid = buf.unpack_longlong()
-                    self.replaypos = buf.unpack_int()
-                    self.tsmin = buf.unpack_longlong()
-                    self.tsmax = buf.unpack_longlong()
-                    self.maxlocaldeletiontime = buf.unpack_int()
-                    self.compressionratio = buf.unpack_double()
-                    self.tombstonehistogram = self.unpack_streaming_histogram(buf)
-                    self.sstablelevel = buf.unpack_int()
-                    self.repairedat = buf.unpack_longlong()
-                    self.mincolnames = []
-                    self.maxcolnames = []
-                    count = buf.unpack_int()
-                    for i in xrange(count):
-                        self.mincolnames.append(buf.unpack_utf_string())
-                    count = buf.unpack_int()
-                    for i in xrange(count):
-                        self.maxcolnames.append(buf.unpack_utf_string())
-                    self.haslegacycountershards = buf.unpack_byte()
-        
+            self.toc[type] = val
+        self.buf = buf
+        self.components = fieldcomponents(componentfields)
+        self.pending = set([j for j in componentfields if j in self.toc])
+
+    def parse_component_ka(self, buf, j):
+        if j == 0:
+            self.partitioner = buf.unpack_utf_string().tobytes()
+            self.bloomfilterfpchance = buf.unpack_double()
+        elif j == 1:
+            ancestorscount = buf.unpack_int()
+            self.ancestors = []
+            for a in xrange(ancestorscount):
+                self.ancestors.append(buf.unpack_int())
+            self.cardinality = buf.unpack_data()
+        else:
+            self.rowsizes = SSTableMetadata.unpack_estimated_histogram(buf)
+            self.colcounts = SSTableMetadata.unpack_estimated_histogram(buf)
+            self.replaysegid = buf.unpack_longlong()
+            self.replaypos = buf.unpack_int()
+            self.tsmin = buf.unpack_longlong()
+            self.tsmax = buf.unpack_longlong()
+            self.maxlocaldeletiontime = buf.unpack_int()
+            self.compressionratio = buf.unpack_double()
+            self.tombstonehistogram = self.unpack_streaming_histogram(buf)
+            self.sstablelevel = buf.unpack_int()
+            self.repairedat = buf.unpack_longlong()
+            self.mincolnames = []
+            self.maxcolnames = []
+            count = buf.unpack_int()
+            for i in xrange(count):
+                self.mincolnames.append(buf.unpack_utf_string().tobytes())
+            count = buf.unpack_int()
+            for i in xrange(count):
+                self.maxcolnames.append(buf.unpack_utf_string().tobytes())
+            self.haslegacycountershards = buf.unpack_byte()
+
     def parse_metadata_version_mc(self, buf, version):
-        numcomponents = buf.unpack_int()
-        toc = {}
-        for i in xrange(numcomponents):
-            type = buf.unpack_int()
-            val = buf.unpack_int()
-            toc[type] = val
-        for j in xrange(4):
-            if j in toc:
-                buf.seek(toc[j])
-                if j == 0: # VALIDATION
-                    self.partitioner = buf.unpack_utf_string()
-                    self.bloomfilterfpchance = buf.unpack_double()
-                elif j == 1: # COMPACTION
-                    self.cardinality = buf.unpack_data()
-                elif j == 2: # STATS
-                    self.rowsizes = SSTableMetadata.unpack_estimated_histogram(buf)
-                    self.colcounts = SSTableMetadata.unpack_estimated_histogram(buf)
-                    self.replaysegid = buf.unpack_longlong()
-                    self.replaypos = buf.unpack_int()
-                    self.tsmin = buf.unpack_longlong()
-                    self.tsmax = buf.unpack_longlong()
-                    self.minlocaldeletiontime = buf.unpack_int()
-                    self.maxlocaldeletiontime = buf.unpack_int()
-                    self.minttl = buf.unpack_int()
-                    self.maxttl = buf.unpack_int()
-                    self.compressionratio = buf.unpack_double()
-                    self.tombstonehistogram = self.unpack_streaming_histogram(buf)
-                    self.sstablelevel = buf.unpack_int()
-                    self.repairedat = buf.unpack_longlong()
-                    self.minclusteringvalues = []
-                    self.maxclusteringvalues = []
-                    count = buf.unpack_int()
-                    for i in xrange(count):
-                        self.minclusteringvalues.append(buf.unpack_utf_string())
-                    count = buf.unpack_int()
-                    for i in xrange(count):
-                        self.maxclusteringvalues.append(buf.unpack_utf_string())
-                    self.haslegacycountershards = buf.unpack_byte()
-                    self.totalcolsset = buf.unpack_longlong()
-                    self.totalrows = buf.unpack_longlong()
-                    self.commitloglbreplaysegid = buf.unpack_longlong()
-                    self.commitloglbreplaypos = buf.unpack_int()
-                    self.commitlogintervals = []
-                    count = buf.unpack_int()
-                    for i in xrange(count):
-                        self.commitlogintervals.append((buf.unpack_longlong(), buf.unpack_int()))
-                elif j == 3: # HEADER
-                    self.esmintimestap = (buf.unpack_vint() + self.microepoch)
-                    self.esminlocaldeletiontime = (buf.unpack_vint() + self.secepoch)
-                    self.esminttl = buf.unpack_vint()
-                    self.keytype = buf.unpack_vintlendata()
-                    clusteringtypecount = buf.unpack_vint()
-                    for i in xrange(clusteringtypecount):
-                        self.clusteringtypes.append(buf.unpack_vintlendata())
-                    staticcolcount = buf.unpack_vint()
-                    for i in xrange(staticcolcount):
-                        name = buf.unpack_vintlendata()
-                        value = buf.unpack_vintlendata()
-                        self.staticcols.append((name, value))
-                    regularcolcount = buf.unpack_vint()
-                    for i in xrange(regularcolcount):
-                        name = buf.unpack_vintlendata()
-                        value = buf.unpack_vintlendata()
-                        self.regularcols.append((name, value))
+        self.parse_toc(buf, MC_COMPONENT_FIELDS)
+
+    def parse_component_mc(self, buf, j):
+        if j == 0: # VALIDATION
+            self.partitioner = buf.unpack_utf_string().tobytes()
+            self.bloomfilterfpchance = buf.unpack_double()
+        elif j == 1: # COMPACTION
+            self.cardinality = buf.unpack_data()
+        elif j == 2: # STATS
+            self.rowsizes = SSTableMetadata.unpack_estimated_histogram(buf)
+            self.colcounts = SSTableMetadata.unpack_estimated_histogram(buf)
+            self.replaysegid = buf.unpack_longlong()
+            self.replaypos = buf.unpack_int()
+            self.tsmin = buf.unpack_longlong()
+            self.tsmax = buf.unpack_longlong()
+            self.minlocaldeletiontime = buf.unpack_int()
+            self.maxlocaldeletiontime = buf.unpack_int()
+            self.minttl = buf.unpack_int()
+            self.maxttl = buf.unpack_int()
+            self.compressionratio = buf.unpack_double()
+            self.tombstonehistogram = self.unpack_streaming_histogram(buf)
+            self.sstablelevel = buf.unpack_int()
+            self.repairedat = buf.unpack_longlong()
+            self.minclusteringvalues = []
+            self.maxclusteringvalues = []
+            count = buf.unpack_int()
+            for i in xrange(count):
+                self.minclusteringvalues.append(buf.unpack_utf_string().tobytes())
+            count = buf.unpack_int()
+            for i in xrange(count):
+                self.maxclusteringvalues.append(buf.unpack_utf_string().tobytes())
+            self.haslegacycountershards = buf.unpack_byte()
+            self.totalcolsset = buf.unpack_longlong()
+            self.totalrows = buf.unpack_longlong()
+            self.commitloglbreplaysegid = buf.unpack_longlong()
+            self.commitloglbreplaypos = buf.unpack_int()
+            self.commitlogintervals = []
+            count = buf.unpack_int()
+            for i in xrange(count):
+                self.commitlogintervals.append((buf.unpack_longlong(), buf.unpack_int()))
+        elif j == 3: # HEADER
+            # the header lists are filled below, don't append to the class ones
+            self.clusteringtypes = []
+            self.staticcols = []
+            self.regularcols = []
+            (mintimestamp, minlocaldeletiontime, self.esminttl) = buf.unpack_vints(3)
+            self.esmintimestap = (signed64(mintimestamp) + self.microepoch)
+            self.esminlocaldeletiontime = (minlocaldeletiontime + self.secepoch)
+            self.keytype = buf.unpack_vintlendata().tobytes()
+            clusteringtypecount = buf.unpack_vint()
+            for i in xrange(clusteringtypecount):
+                self.clusteringtypes.append(buf.unpack_vintlendata().tobytes())
+            staticcolcount = buf.unpack_vint()
+            for i in xrange(staticcolcount):
+                name = buf.unpack_vintlendata().tobytes()
+                value = buf.unpack_vintlendata().tobytes()
+                self.staticcols.append((name, value))
+            regularcolcount = buf.unpack_vint()
+            for i in xrange(regularcolcount):
+                name = buf.unpack_vintlendata().tobytes()
+                value = buf.unpack_vintlendata().tobytes()
+                self.regularcols.append((name, value))
+
+    def overlapstime(self, start, end):
+        # whether cells written in [start, end] (microseconds, None is open)
+        # can be in this sstable
+        if self.version < 'hd':
+            return True
+        if start != None and signed64(self.tsmax) < start:
+            return False
+        # the minimum is 0 before 'ib', which never excludes anything
+        if end != None and signed64(self.tsmin) > end:
+            return False
+        return True
+
+    def overlapsclustering(self, start, end):
+        # whether rows with a clustering between the start and end prefixes
+        # (lists of serialized components, None is open) can be in this
+        # sstable, following Cassandra's ColumnSlice.intersects
+        if self.version >= 'mc':
+            (mins, maxs, types) = (self.minclusteringvalues, self.maxclusteringvalues, self.clusteringtypes)
+        elif self.version >= 'ja':
+            (mins, maxs, types) = (self.mincolnames, self.maxcolnames, [])
+        else:
+            return True
+        start = start or []
+        end = end or []
+        for i in xrange(min(len(mins), len(maxs))):
+            type = None
+            if i < len(types):
+                type = types[i]
+            compare = clusteringcomparator(type)
+            if i < len(end) and compare(end[i], mins[i]) < 0:
+                return False
+            if i < len(start) and compare(start[i], maxs[i]) > 0:
+                return False
+            # later components are only bounded while the earlier ones are fixed
+            if i >= len(start) or i >= len(end) or compare(start[i], end[i]) != 0:
+                break
+        return True
+
+    def isexpired(self, now):
+        # whether every cell of this sstable is deleted or expired at now
+        # (seconds), the max local deletion time is recorded from 'ja'
+        if self.version < 'ja':
+            return False
+        return self.maxlocaldeletiontime < now
 
     def unpack_estimated_histogram(self, buf):
         size = buf.unpack_int()
@@ -285,10 +442,21 @@ class SSTableMetadata:
 
     def __repr__(self):
         if self.version >= 'mc':
-            return "SSTable: %s\nPartitioner: %s\nBloom Filter FP chance: %f\nMinimum timestamp: %d\nMaximum timestamp: %d\nSSTable min local deletion time: %d\nSSTable max local deletion time: %d\nCompressor: %s\nCompression ratio: %f\nTTL min: %d\nTTL max: %s\nFirst key: %s\nLast key: %s\nminClustringValues: %s\nmaxClustringValues: %s\nSSTable Level: %d\nRepaird at: %d\ncommitLogIntervals: %s\ntotalColumnsSet: %d\ntotalRows: %d\nreplaySegId: %d\nreplayPosition: %d\ntombstoneHistogram: %s\nES cardinalityLength: %d\nES minTTL: %d\nES minLocalDeletionTime: %d\nES minTimestamp: %d\nkeyType: %s\nClusteringTypes: %s\nStaticColumns: %s\nRegularColumns: %s\n" % (self.descriptor,self.partitioner, self.bloomfilterfpchance, self.tsmin, self.tsmax, self.minlocaldeletiontime, self.maxlocaldeletiontime, self.compression.classname, self.compressionratio, self.minttl, self.maxttl, self.summary.first, self.summary.last, self.minclusteringvalues, self.maxclusteringvalues, self.sstablelevel, self.repairedat, self.commitlogintervals, self.totalcolsset, self.totalrows, self.replaysegid, self.replaypos, self.tombstonehistogram, len(self.cardinality), self.esminttl, self.esminlocaldeletiontime,self.esmintimestap, self.keytype, self.clusteringtypes, self.staticcols, self.regularcols)
+            # the Summary.db and CompressionInfo.db fields, when the files exist
+            (compressor, first, last) = ("none", None, None)
+            if self.compression != None:
+                compressor = self.compression.classname
+            if self.summary != None:
+                (first, last) = (self.summary.first, self.summary.last)
+            return "SSTable: %s\nPartitioner: %s\nBloom Filter FP chance: %f\nMinimum timestamp: %d\nMaximum timestamp: %d\nSSTable min local deletion time: %d\nSSTable max local deletion time: %d\nCompressor: %s\nCompression ratio: %f\nTTL min: %d\nTTL max: %s\nFirst key: %s\nLast key: %s\nminClustringValues: %s\nmaxClustringValues: %s\nSSTable Level: %d\nRepaird at: %d\ncommitLogIntervals: %s\ntotalColumnsSet: %d\ntotalRows: %d\nreplaySegId: %d\nreplayPosition: %d\ntombstoneHistogram: %s\nES cardinalityLength: %d\nES minTTL: %d\nES minLocalDeletionTime: %d\nES minTimestamp: %d\nkeyType: %s\nClusteringTypes: %s\nStaticColumns: %s\nRegularColumns: %s\n" % (self.descriptor,self.partitioner, self.bloomfilterfpchance, self.tsmin, self.tsmax, self.minlocaldeletiontime, self.maxlocaldeletiontime, compressor, self.compressionratio, self.minttl, self.maxttl, first, last, self.minclusteringvalues, self.maxclusteringvalues, self.sstablelevel, self.repairedat, self.commitlogintervals, self.totalcolsset, self.totalrows, self.replaysegid, self.replaypos, self.tombstonehistogram, len(self.cardinality), self.esminttl, self.esminlocaldeletiontime,self.esmintimestap, self.keytype, self.clusteringtypes, self.staticcols, self.regularcols)
         elif self.version >= 'ka':
             return "rowSizes: %s\ncolumnCounts: %s\nreplaySegId: %d\nreplayPosition: %d\nminTimestamp: %d\nmaxTimestamp: %d\nmaxLocalDeletionTime: %d\nbloomFilterFPChance: %f\ncompressionRatio: %f\npartitioner: %s\nancestors: %s\ntombstoneHistogram: %s\nsstableLevel: %d\nrepairdAt: %d\nminColumnNames: %s\nmaxColumnNames: %s\nhasLegacyCounterShards: %s\n" % (self.rowsizes, self.colcounts, self.replaysegid, self.replaypos, self.tsmin, self.tsmax, self.maxlocaldeletiontime, self.bloomfilterfpchance, self.compressionratio, self.partitioner, self.ancestors, self.tombstonehistogram, self.sstablelevel, self.repairedat, self.mincolnames, self.maxcolnames, self.haslegacycountershards)
         elif self.version >= 'ja':
             return "rowSizes: %s\ncolumnCounts: %s\nreplaySegId: %d\nreplayPosition: %d\nminTimestamp: %d\nmaxTimestamp: %d\nmaxLocalDeletionTime: %d\nbloomFilterFPChance: %f\ncompressionRatio: %f\npartitioner: %s\nancestors: %s\ntombstoneHistogram: %s\nsstableLevel: %d\nminColumnNames: %s\nmaxColumnNames: %s\n" % (self.rowsizes, self.colcounts, self.replaysegid, self.replaypos, self.tsmin, self.tsmax, self.maxlocaldeletiontime, self.bloomfilterfpchance, self.compressionratio, self.partitioner, self.ancestors, self.tombstonehistogram, self.sstablelevel, self.mincolnames, self.maxcolnames)
         elif self.version >= 'ia':
             return "rowSizes: %s\ncolumnCounts: %s\nreplaySegId: %d\nreplayPosition: %d\nminTimestamp: %d\nmaxTimestamp: %d\ncompressionRatio: %f\npartitioner: %s\nancestors: %s\ntombstoneHistogram: %s\n" % (self.rowsizes, self.colcounts, self.replaysegid, self.replaypos, self.tsmin, self.tsmax, self.compressionratio, self.partitioner, self.ancestors, self.tombstonehistogram)
+
+# the Statistics.db component fields of 'ka' onwards and the Summary.db and
+# CompressionInfo.db contents are decoded on first access
+for name in set(fieldcomponents(KA_COMPONENT_FIELDS).keys() + fieldcomponents(MC_COMPONENT_FIELDS).keys() + ['summary', 'compression']):
+    setattr(SSTableMetadata, name, LazyField(name, getattr(SSTableMetadata, name, None)))
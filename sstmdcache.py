@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specif
+
+# a persistent cache of parsed SSTable metadata
+#
+# entries are keyed by the path of the Statistics.db file and stamped with
+# the size and modification time of the component files the metadata is
+# parsed from, a changed stamp means the sstable is parsed again
+
+import os
+import sqlite3
+import cPickle
+from sstmd import SSTableMetadata
+
+def componentfiles(statfile):
+    # the files SSTableMetadata.parse reads
+    return [statfile, statfile.replace("Statistics", "Summary"), statfile.replace("Statistics", "CompressionInfo")]
+
+def stamp(statfile):
+    stamps = []
+    for filename in componentfiles(statfile):
+        try:
+            st = os.stat(filename)
+        except OSError:
+            stamps.append("-")
+            continue
+        stamps.append("%d:%r" % (st.st_size, st.st_mtime))
+    return ",".join(stamps)
+
+class MetadataCache:
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.text_factory = str
+        self.db.execute("CREATE TABLE IF NOT EXISTS metadata (path TEXT PRIMARY KEY, version TEXT, stamp TEXT, data BLOB)")
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, statfile, version):
+        # the cached metadata if the sstable didn't change since, else None
+        path = os.path.abspath(statfile)
+        row = self.db.execute("SELECT version, stamp, data FROM metadata WHERE path = ?", (path,)).fetchone()
+        if row == None or row[0] != version or row[1] != stamp(statfile):
+            self.misses += 1
+            return None
+        try:
+            metadata = cPickle.loads(str(row[2]))
+        except Exception:
+            # written by an incompatible version of SSTableMetadata
+            self.misses += 1
+            return None
+        self.hits += 1
+        return metadata
+
+    def store(self, statfile, version, metadata, filestamp=None):
+        # filestamp is taken before parsing, so a file changed meanwhile is
+        # parsed again next time
+        if filestamp == None:
+            filestamp = stamp(statfile)
+        data = cPickle.dumps(metadata, cPickle.HIGHEST_PROTOCOL)
+        self.db.execute("INSERT OR REPLACE INTO metadata (path, version, stamp, data) VALUES (?, ?, ?, ?)", (os.path.abspath(statfile), version, filestamp, sqlite3.Binary(data)))
+
+    def parse(self, statfile, version):
+        # SSTableMetadata.parse, parsing only new or changed sstables
+        metadata = self.lookup(statfile, version)
+        if metadata == None:
+            filestamp = stamp(statfile)
+            metadata = SSTableMetadata.parse(statfile, version)
+            self.store(statfile, version, metadata, filestamp)
+        return metadata
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
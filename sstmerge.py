@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specif
+
+# a script to merge the SSTables of a table the way compaction would, and
+# export the reconciled partitions
+
+import os
+import sys
+import time
+import heapq
+import argparse
+import binascii
+import sstable2json
+import partitioner
+from buffer import Buffer
+from sstable import SSTableFileName, SSTableReader20, RangeTombstone, DeletedColumn, ExpiringColumn
+
+def livecell(cell, now):
+    # expired cells reconcile like tombstones
+    if isinstance(cell, DeletedColumn):
+        return False
+    if isinstance(cell, ExpiringColumn):
+        return cell.expiration > now
+    return True
+
+def reconcile(a, b, now):
+    # Cassandra's AbstractCell.reconcile: the highest timestamp wins, on a
+    # tie a tombstone wins over a live cell and then the greatest value
+    if a.ts != b.ts:
+        if a.ts < b.ts:
+            return b
+        return a
+    if livecell(a, now) != livecell(b, now):
+        if livecell(a, now):
+            return b
+        return a
+    if valuebytes(a.value) < valuebytes(b.value):
+        return b
+    return a
+
+def valuebytes(value):
+    if isinstance(value, memoryview):
+        return value.tobytes()
+    return value
+
+def deletedat(deletiontime):
+    # markedForDeleteAt is read unsigned, a live partition has Long.MIN_VALUE
+    return partitioner.signed64(deletiontime.markedForDeleteAt)
+
+def compositebound(name):
+    # raw composite name bytes to the hex components format of cell names
+    buf = Buffer(name)
+    components = []
+    while buf.remaining() > 0:
+        length = buf.unpack_short()
+        components.append(binascii.hexlify(buf.unpack_bytes(length) or ""))
+        buf.unpack_byte()
+    return ":".join(components)
+
+class MergedRow:
+    # the reconciled cells of one partition, read like a Row20
+    def __init__(self, key, rows, cqlrow, now):
+        self.key = key
+        self.cqlrow = cqlrow
+        self.deletiontime = None
+        for row in rows:
+            deletiontime = row.getdeletioninfo()
+            if self.deletiontime == None or deletedat(deletiontime) > deletedat(self.deletiontime):
+                self.deletiontime = deletiontime
+        cells = {}
+        tombstones = {}
+        for row in rows:
+            while row.hasnextcolumn():
+                cell = row.nextcolumn()
+                if isinstance(cell, RangeTombstone):
+                    bounds = (cell.mincol, cell.maxcol)
+                    other = tombstones.get(bounds)
+                    if other == None or deletedat(cell.deletiontime) > deletedat(other.deletiontime):
+                        tombstones[bounds] = cell
+                    continue
+                other = cells.get(cell.name)
+                if other == None:
+                    cells[cell.name] = cell
+                else:
+                    cells[cell.name] = reconcile(other, cell, now)
+        self.tombstones = [t for t in tombstones.values() if self.live(deletedat(t.deletiontime))]
+        self.cells = [c for c in cells.values() if self.live(c.ts) and self.covering(c) == None]
+        self.cells.extend(self.tombstones)
+        self.cells.sort(key=self.sortkey)
+        self.cells.reverse()
+
+    def live(self, ts):
+        # whether the partition deletion doesn't shadow data written at ts
+        if self.deletiontime.islive():
+            return True
+        return ts > deletedat(self.deletiontime)
+
+    def namekey(self, name):
+        # cell names compare by their components as bytes
+        if self.cqlrow:
+            return tuple([binascii.unhexlify(c) for c in name.split(":")])
+        return (name,)
+
+    def maxkey(self, tombstone):
+        if self.cqlrow:
+            return self.namekey(compositebound(tombstone.maxcol))
+        return (tombstone.maxcol,)
+
+    def covering(self, cell):
+        # the range tombstone shadowing cell, if any
+        key = self.namekey(cell.name)
+        for t in self.tombstones:
+            if cell.ts > deletedat(t.deletiontime):
+                continue
+            maxkey = self.maxkey(t)
+            if key >= self.namekey(t.mincol) and key[:len(maxkey)] <= maxkey:
+                return t
+        return None
+
+    def sortkey(self, cell):
+        if isinstance(cell, RangeTombstone):
+            return self.namekey(cell.mincol)
+        return self.namekey(cell.name)
+
+    def getdeletioninfo(self):
+        return self.deletiontime
+
+    def hasnextcolumn(self):
+        return len(self.cells) > 0
+
+    def nextcolumn(self):
+        return self.cells.pop()
+
+class MergedReader:
+    # k-way merge of the partitions of several sstables in token order,
+    # holding the current partition of each input only
+    def __init__(self, readers, now=None):
+        self.readers = readers
+        self.now = now
+        if self.now == None:
+            self.now = int(time.time())
+        partitioners = set([r.metadata.partitioner for r in readers])
+        if len(partitioners) != 1:
+            raise ValueError("sstables use different partitioners: %s" % (", ".join(partitioners)))
+        self.token = partitioner.gettokenfunction(partitioners.pop())
+        self.cqlrow = readers[0].cqlrow
+        self.heap = []
+        for i in xrange(len(readers)):
+            self.advance(i)
+
+    def advance(self, i):
+        reader = self.readers[i]
+        if reader.hasnext():
+            row = reader.next()
+            key = row.key.tobytes()
+            heapq.heappush(self.heap, (self.token(key), key, i, row))
+
+    def hasnext(self):
+        return len(self.heap) > 0
+
+    def next(self):
+        (token, key, i, row) = heapq.heappop(self.heap)
+        rows = [(i, row)]
+        while len(self.heap) > 0 and self.heap[0][0] == token and self.heap[0][1] == key:
+            (token, key, i, row) = heapq.heappop(self.heap)
+            rows.append((i, row))
+        merged = MergedRow(key, [row for (i, row) in rows], self.cqlrow, self.now)
+        # the inputs move on once their partition is consumed
+        for (i, row) in rows:
+            self.advance(i)
+        return merged
+
+    def close(self):
+        for reader in self.readers:
+            reader.buf.close()
+
+def openreaders(filenames, cqlrow, verbose):
+    readers = []
+    for filename in filenames:
+        sstable = SSTableFileName.parse(filename, verbose)
+        if sstable == None:
+            raise ValueError("%s is not an sstable file" % (filename))
+        if sstable.sstversion >= 'ma':
+            raise ValueError("merging version %s sstables is not supported" % (sstable.sstversion))
+        compressed = os.path.isfile(sstable.compfile())
+        readers.append(SSTableReader20(sstable.indexfile(), sstable.datafile(), sstable.compfile(), compressed, cqlrow, verbose))
+    return readers
+
+def main():
+    parser = argparse.ArgumentParser(prog="sstmerge")
+    parser.add_argument("-c", "--cql", help="merge SSTable cql rows", action="store_true")
+    parser.add_argument("-f", "--format", help="output format", choices=["json", "ndjson"], default="json")
+    parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
+    parser.add_argument("sstables", type=str, nargs="+", help="SSTable files of one table")
+    args = parser.parse_args()
+
+    try:
+        reader = MergedReader(openreaders(args.sstables, args.cql, args.verbose))
+    except ValueError, e:
+        print >> sys.stderr, e
+        sys.exit(1)
+    if args.format == "ndjson":
+        sstable2json.export20ndjson(reader)
+    else:
+        sstable2json.export20(reader)
+    reader.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specif
+
+# classes to export the cells of a given SSTable as NumPy .npy column files
+#
+# every CQL row (partition key and clustering prefix) is one record. The
+# directory gets key.npy and clustering.npy with one entry per record, and
+# for each regular column <name>.value.npy, <name>.length.npy,
+# <name>.timestamp.npy and <name>.ttl.npy. Byte strings of any length are
+# a flat uint8 array with a <name>.offsets.npy of count + 1 int64 offsets,
+# value i is data[offsets[i]:offsets[i + 1]]. A length of -1 marks a record
+# without a live cell for that column.
+#
+# records are written as they are decoded, the shape in each header is
+# filled in at close
+
+import os
+import struct
+import binascii
+from sstable import RangeTombstone, DeletedColumn, ExpiringColumn
+
+NPY_MAGIC = "\x93NUMPY\x01\x00"
+NPY_HEADER_LENGTH = struct.Struct('<H')
+# digits of the largest record count, the header keeps room for them
+SHAPE_DIGITS = 20
+# records buffered by each file between writes
+FLUSH_RECORDS = 4096
+# Long.MIN_VALUE, the timestamp of a missing cell
+NO_TIMESTAMP = -0x8000000000000000
+
+class NpyFile:
+    # a version 1.0 .npy file holding a one dimensional array of unknown
+    # size, the header is rewritten with the final shape at close
+    def __init__(self, filename, descr):
+        self.descr = descr
+        self.count = 0
+        # the data starts at a multiple of 64 bytes
+        self.headersize = (len(NPY_MAGIC) + NPY_HEADER_LENGTH.size + len(self.dictionary("9" * SHAPE_DIGITS)) + 1 + 63) / 64 * 64
+        self.file = open(filename, 'wb')
+        self.file.write(self.header())
+
+    def dictionary(self, shape):
+        return "{'descr': '%s', 'fortran_order': False, 'shape': (%s,), }" % (self.descr, shape)
+
+    def header(self):
+        text = self.dictionary("%d" % (self.count))
+        text += " " * (self.headersize - len(NPY_MAGIC) - NPY_HEADER_LENGTH.size - len(text) - 1) + "\n"
+        return NPY_MAGIC + NPY_HEADER_LENGTH.pack(len(text)) + text
+
+    def write(self, data, count):
+        self.file.write(data)
+        self.count += count
+
+    def close(self):
+        self.file.seek(0)
+        self.file.write(self.header())
+        self.file.close()
+
+class FixedArray:
+    # integers of a struct type code, 'q' or 'i', packed little endian
+    # with their standard size whatever the platform
+    def __init__(self, filename, typecode):
+        self.typecode = typecode
+        self.values = []
+        self.file = NpyFile(filename, "<i%d" % (struct.calcsize("<" + typecode)))
+
+    def append(self, value):
+        self.values.append(value)
+        if len(self.values) >= FLUSH_RECORDS:
+            self.flush()
+
+    def extend(self, values):
+        self.values.extend(values)
+        if len(self.values) >= FLUSH_RECORDS:
+            self.flush()
+
+    def flush(self):
+        count = len(self.values)
+        self.file.write(struct.pack("<%d%s" % (count, self.typecode), *self.values), count)
+        self.values = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+class VariableArray:
+    # byte strings as a flat uint8 array and their offsets
+    def __init__(self, filename):
+        self.data = NpyFile(filename + ".npy", "|u1")
+        self.offsets = FixedArray(filename + ".offsets.npy", 'q')
+        self.parts = []
+        self.size = 0
+        self.offsets.append(0)
+
+    def append(self, value):
+        self.parts.append(value)
+        self.size += len(value)
+        self.offsets.append(self.size)
+        if len(self.parts) >= FLUSH_RECORDS:
+            self.flush()
+
+    def flush(self):
+        data = "".join(self.parts)
+        self.data.write(data, len(data))
+        self.parts = []
+
+    def close(self):
+        self.flush()
+        self.data.close()
+        self.offsets.close()
+
+class ColumnFiles:
+    # the files of one column, its cell for the current record is kept
+    # until the record ends as a later cell of the record replaces it
+    def __init__(self, directory, name):
+        self.name = name
+        filename = os.path.join(directory, filenamefor(name))
+        self.values = VariableArray(filename + ".value")
+        self.lengths = FixedArray(filename + ".length.npy", 'i')
+        self.timestamps = FixedArray(filename + ".timestamp.npy", 'q')
+        self.ttls = FixedArray(filename + ".ttl.npy", 'i')
+        self.cell = None
+
+    def set(self, value, ts, ttl):
+        self.cell = (value, ts, ttl)
+
+    def endrecord(self):
+        if self.cell == None:
+            self.missing(1)
+            return
+        (value, ts, ttl) = self.cell
+        self.cell = None
+        self.values.append(value)
+        self.lengths.append(len(value))
+        self.timestamps.append(ts)
+        self.ttls.append(ttl)
+
+    def missing(self, count):
+        # records without a cell for this column
+        while count > 0:
+            n = min(count, FLUSH_RECORDS)
+            for i in xrange(n):
+                self.values.append("")
+            self.lengths.extend([-1] * n)
+            self.timestamps.extend([NO_TIMESTAMP] * n)
+            self.ttls.extend([0] * n)
+            count -= n
+
+    def close(self):
+        self.values.close()
+        self.lengths.close()
+        self.timestamps.close()
+        self.ttls.close()
+
+def filenamefor(name):
+    # column names that are not plain identifiers are written in hex format
+    if name != "" and name.replace("_", "").isalnum():
+        return name
+    return binascii.hexlify(name)
+
+class ColumnarWriter:
+    def __init__(self, directory, cqlrow, regularcols=[]):
+        self.directory = directory
+        self.cqlrow = cqlrow
+        if os.path.isdir(self.directory) != True:
+            os.makedirs(self.directory)
+        self.keys = VariableArray(os.path.join(directory, "key"))
+        self.clusterings = VariableArray(os.path.join(directory, "clustering"))
+        self.count = 0
+        self.key = None
+        self.clustering = None
+        self.columns = {}
+        # the serialization header order first, then columns as they appear
+        self.order = []
+        for (name, type) in regularcols:
+            self.column(name)
+
+    def column(self, name):
+        if name not in self.columns:
+            column = ColumnFiles(self.directory, name)
+            # the records before the current one had no cell for it
+            column.missing(max(self.count - 1, 0))
+            self.columns[name] = column
+            self.order.append(name)
+        return self.columns[name]
+
+    def splitname(self, name):
+        # CQL cell names are the hex clustering components followed by the
+        # hex column name, all separated by ':'
+        if self.cqlrow == False:
+            return ("", name)
+        i = name.rfind(":")
+        if i < 0:
+            return ("", binascii.unhexlify(name))
+        return (name[:i], binascii.unhexlify(name[i + 1:]))
+
+    def endrecord(self):
+        for name in self.order:
+            self.columns[name].endrecord()
+
+    def addrow(self, row):
+        key = row.key.tobytes()
+        while row.hasnextcolumn():
+            column = row.nextcolumn()
+            if isinstance(column, RangeTombstone) or isinstance(column, DeletedColumn):
+                continue
+            (clustering, name) = self.splitname(column.name)
+            if self.count == 0 or self.key != key or self.clustering != clustering:
+                if self.count > 0:
+                    self.endrecord()
+                self.keys.append(key)
+                self.clusterings.append(clustering)
+                self.key = key
+                self.clustering = clustering
+                self.count += 1
+            # the empty column is the CQL row marker, it only starts a record
+            if name == "":
+                continue
+            ttl = 0
+            if isinstance(column, ExpiringColumn):
+                ttl = column.ttl
+            value = column.value
+            if isinstance(value, memoryview):
+                value = value.tobytes()
+            self.column(name).set(value or "", column.ts, ttl)
+
+    def close(self):
+        if self.count > 0:
+            self.endrecord()
+        self.keys.close()
+        self.clusterings.close()
+        for name in self.order:
+            self.columns[name].close()
+
+def export20npy(reader, directory):
+    writer = ColumnarWriter(directory, reader.cqlrow, reader.metadata.regularcols)
+    while reader.hasnext():
+        writer.addrow(reader.next())
+    writer.close()
+    return writer
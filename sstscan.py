@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specif
+
+# a script to run metadata, index or export jobs over all SSTables of a
+# data directory on a process pool
+
+import os
+import sys
+import time
+import argparse
+import itertools
+import traceback
+import multiprocessing
+import sstable2json
+import sstmdcache
+from sstmd import SSTableMetadata
+from sstidx import IndexInfo
+from sstable import SSTableFileName, SSTableReader20
+
+class SSTableFiles:
+    # the component files of one sstable found in a directory
+    def __init__(self, sstable, components, missing):
+        self.sstable = sstable
+        self.components = components
+        self.missing = missing
+        self.datasize = 0
+        if os.path.isfile(sstable.datafile()):
+            self.datasize = os.stat(sstable.datafile()).st_size
+
+    def __repr__(self):
+        return "%s components: %s missing: %s" % (self.sstable.datafile(), ",".join(self.components), ",".join(self.missing))
+
+def readtoc(filename):
+    # TOC.txt lists the component file suffixes, one per line
+    f = open(filename, 'r')
+    components = [line.strip() for line in f if line.strip() != ""]
+    f.close()
+    return components
+
+def findsstables(root):
+    # walks root and groups component files by sstable, the components
+    # are the ones listed in TOC.txt when it is present
+    found = []
+    for (dirpath, dirnames, filenames) in os.walk(root):
+        dirnames.sort()
+        groups = {}
+        order = []
+        for name in sorted(filenames):
+            sstable = SSTableFileName.parse(os.path.join(dirpath, name), False)
+            if sstable == None:
+                continue
+            prefix = sstable.prefix()
+            if prefix not in groups:
+                groups[prefix] = (sstable, [])
+                order.append(prefix)
+            groups[prefix][1].append(name[len(os.path.basename(prefix)) + 1:])
+        for prefix in order:
+            (sstable, present) = groups[prefix]
+            components = present
+            if "TOC.txt" in present:
+                components = readtoc(sstable.tocfile())
+            missing = [c for c in components if c not in present]
+            if "Data.db" not in components:
+                continue
+            found.append(SSTableFiles(sstable, components, missing))
+    return found
+
+def exportfile(sstable, root, output, format):
+    # <output>/<sstable directory relative to root>/<sstable prefix>.<format>
+    datafile = os.path.abspath(sstable.datafile())
+    directory = os.path.join(output, os.path.relpath(os.path.dirname(datafile), os.path.abspath(root)))
+    if os.path.isdir(directory) != True:
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # another worker created it meanwhile
+            if os.path.isdir(directory) != True:
+                raise
+    return os.path.join(directory, "%s.%s" % (os.path.basename(sstable.prefix()), format))
+
+def runjob(task):
+    # runs in a worker process, returns (datafile, ok, text) so one broken
+    # sstable doesn't stop the scan
+    (files, job, root, cqlrow, output, format) = task
+    sstable = files.sstable
+    try:
+        if len(files.missing) > 0:
+            return (sstable.datafile(), False, "missing components %s" % (",".join(files.missing)))
+        if job == "metadata":
+            metadata = SSTableMetadata.parse(sstable.statfile(), sstable.sstversion)
+            return (sstable.datafile(), True, metadata)
+        if job == "index":
+            count = 0
+            for entry in IndexInfo.iterate(sstable.indexfile()):
+                count += 1
+            return (sstable.datafile(), True, "row count: %d" % (count))
+        if sstable.sstversion >= 'ma':
+            return (sstable.datafile(), False, "export is not supported for version %s" % (sstable.sstversion))
+        compressed = os.path.isfile(sstable.compfile())
+        reader = SSTableReader20(sstable.indexfile(), sstable.datafile(), sstable.compfile(), compressed, cqlrow, False)
+        filename = exportfile(sstable, root, output, format)
+        out = open(filename, 'w')
+        if format == "ndjson":
+            sstable2json.export20ndjson(reader, out)
+        else:
+            sstable2json.export20(reader, out)
+        out.close()
+        reader.buf.close()
+        return (sstable.datafile(), True, filename)
+    except Exception:
+        return (sstable.datafile(), False, traceback.format_exc())
+
+def cachedresults(found, cache, stamps):
+    # the metadata of the unchanged sstables, the others are left in stamps
+    # to be parsed and stored
+    for files in found:
+        sstable = files.sstable
+        if len(files.missing) > 0:
+            continue
+        metadata = cache.lookup(sstable.statfile(), sstable.sstversion)
+        if metadata != None:
+            yield (sstable.datafile(), True, metadata)
+        else:
+            stamps[sstable.datafile()] = sstmdcache.stamp(sstable.statfile())
+
+def scan(root, found, job, workers, cqlrow=False, output=None, format="json", progress=sys.stderr, cache=None):
+    # yields the job results as they complete, the largest sstables are
+    # started first so a big one doesn't finish the scan alone. With a
+    # metadata cache only new or changed sstables go to the workers
+    total = len(found)
+    totalsize = sum([files.datasize for files in found])
+    sizes = dict([(files.sstable.datafile(), files.datasize) for files in found])
+    sstables = dict([(files.sstable.datafile(), files.sstable) for files in found])
+    stamps = {}
+    cached = []
+    if job == "metadata" and cache != None:
+        cached = list(cachedresults(found, cache, stamps))
+        hits = set([result[0] for result in cached])
+        found = [files for files in found if files.sstable.datafile() not in hits]
+    tasks = [(files, job, root, cqlrow, output, format) for files in sorted(found, key=lambda f: -f.datasize)]
+    start = time.time()
+    if workers > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap_unordered(runjob, tasks)
+    else:
+        pool = None
+        results = (runjob(task) for task in tasks)
+    done = 0
+    donesize = 0
+    for result in itertools.chain(cached, results):
+        done += 1
+        donesize += sizes[result[0]]
+        if result[1] == True and result[0] in stamps:
+            sstable = sstables[result[0]]
+            cache.store(sstable.statfile(), sstable.sstversion, result[2], stamps[result[0]])
+        if progress != None:
+            status = "ok"
+            if result[1] != True:
+                status = "failed"
+            print >> progress, "[%d/%d] %d of %d bytes %.1fs %s %s" % (done, total, donesize, totalsize, time.time() - start, status, result[0])
+        yield result
+    if pool != None:
+        pool.close()
+        pool.join()
+
+def main():
+    parser = argparse.ArgumentParser(prog="sstscan")
+    parser.add_argument("-m", "--metadata", help="display the metadata of every SSTable", action="store_true")
+    parser.add_argument("-i", "--index", help="count the index entries of every SSTable", action="store_true")
+    parser.add_argument("-d", "--data", help="export every SSTable to the --output directory", action="store_true")
+    parser.add_argument("-c", "--cql", help="export SSTable cql rows", action="store_true")
+    parser.add_argument("-f", "--format", help="export format", choices=["json", "ndjson"], default="json")
+    parser.add_argument("-o", "--output", help="directory for the exports, laid out like the data directory", type=str)
+    parser.add_argument("-j", "--jobs", help="number of SSTables processed at the same time", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("-l", "--list", help="only list the SSTables found", action="store_true")
+    parser.add_argument("--metadata-cache", help="file caching the parsed metadata, only new or changed SSTables are parsed", type=str)
+    parser.add_argument("-q", "--quiet", help="don't report progress", action="store_true")
+    parser.add_argument("directory", type=str, help="data directory")
+    args = parser.parse_args()
+
+    found = findsstables(args.directory)
+    if args.list:
+        for files in found:
+            print files
+        return
+    job = None
+    if args.metadata:
+        job = "metadata"
+    elif args.index:
+        job = "index"
+    elif args.data:
+        job = "export"
+        if args.output is None:
+            parser.error("please specify the output directory of the export")
+    if job is None:
+        parser.error("please specify -m, -i, -d or -l")
+    progress = sys.stderr
+    if args.quiet:
+        progress = None
+    cache = None
+    if args.metadata_cache != None:
+        cache = sstmdcache.MetadataCache(args.metadata_cache)
+    failed = 0
+    for (datafile, ok, text) in scan(args.directory, found, job, args.jobs, args.cql, args.output, args.format, progress, cache):
+        if ok != True:
+            failed += 1
+            print >> sys.stderr, "%s: %s" % (datafile, text)
+        elif job == "metadata":
+            print "%s\n%s" % (datafile, text)
+        else:
+            print "%s: %s" % (datafile, text)
+    if cache != None:
+        cache.close()
+    if failed > 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specif
+
+# counters and timers of the export stages
+#
+# they are off unless enable() is called, the readers and writers look up
+# current when they are created and skip all accounting while it is None
+
+import sys
+import time
+import json
+import threading
+
+current = None
+
+class Stats:
+    def __init__(self):
+        self.counters = {}
+        self.timers = {}
+        self.start = time.time()
+        # chunks are read and decompressed on prefetch threads too
+        self.lock = threading.Lock()
+
+    def count(self, name, n=1):
+        self.lock.acquire()
+        self.counters[name] = self.counters.get(name, 0) + n
+        self.lock.release()
+
+    def addtime(self, name, seconds):
+        self.lock.acquire()
+        self.timers[name] = self.timers.get(name, 0.0) + seconds
+        self.lock.release()
+
+    def state(self):
+        # what a worker process hands back to be merged
+        return (self.counters, self.timers)
+
+    def takestate(self):
+        # the state since the last call, for workers that hand it back
+        # after every task
+        self.lock.acquire()
+        state = (self.counters, self.timers)
+        self.counters = {}
+        self.timers = {}
+        self.lock.release()
+        return state
+
+    def merge(self, state):
+        (counters, timers) = state
+        for (name, n) in counters.items():
+            self.count(name, n)
+        for (name, seconds) in timers.items():
+            self.addtime(name, seconds)
+
+    def summary(self):
+        elapsed = time.time() - self.start
+        summary = {"elapsed": elapsed, "counters": dict(self.counters), "seconds": dict(self.timers)}
+        # the time not spent reading, decompressing or writing is decoding.
+        # Prefetch threads and worker processes overlap with it, so this is
+        # only exact for a serial export
+        if "export" in self.timers:
+            other = sum([self.timers.get(name, 0.0) for name in ("read", "decompress", "write")])
+            summary["seconds"]["decode"] = max(self.timers["export"] - other, 0.0)
+        if elapsed > 0:
+            summary["throughput"] = dict([(name + "/s", n / elapsed) for (name, n) in self.counters.items()])
+        return summary
+
+    def report(self, out=sys.stderr):
+        json.dump(self.summary(), out, sort_keys=True)
+        out.write("\n")
+
+def enable():
+    global current
+    current = Stats()
+    return current
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specif
+
+# decoders of the Cassandra marshal types, built once per SSTable from the
+# serialization header of 3.x Statistics.db
+#
+# every column gets a ColumnType holding its value length (fixed length
+# values are written without one) and a function formatting the raw
+# value, so rows are decoded without looking at the type names again
+
+import uuid
+import socket
+import struct
+import binascii
+import datetime
+import decimal
+
+MARSHAL_PACKAGE = "org.apache.cassandra.db.marshal."
+# types that only change the sort order or the mutability of the one
+# they wrap
+WRAPPER_TYPES = ["ReversedType", "FrozenType"]
+# multi-cell types, unless frozen
+COMPLEX_TYPES = ["ListType", "SetType", "MapType", "UserType"]
+# clustering values are preceded by a header of 2 bits per value, in
+# blocks of 32 values
+CLUSTERING_BLOCK = 32
+# SimpleDateType counts days from 1970-01-01 shifted by 2^31
+SIMPLE_DATE_EPOCH = 1 << 31
+EPOCH = datetime.datetime(1970, 1, 1)
+FLOAT = struct.Struct('>f')
+# user type cell paths are the field position
+FIELD_POSITION = struct.Struct('>h')
+DOUBLE = struct.Struct('>d')
+
+def structformatter(fmt, text):
+    s = struct.Struct(fmt)
+    def format(value):
+        return text % s.unpack(value)
+    return format
+
+def formatfloat(value):
+    # the shortest text that reads back as the same float
+    f = FLOAT.unpack(value)[0]
+    for digits in xrange(6, 9):
+        text = "%.*g" % (digits, f)
+        if FLOAT.pack(float(text)) == value:
+            return text
+    return "%.9g" % (f)
+
+def formatdouble(value):
+    return repr(DOUBLE.unpack(value)[0])
+
+def formatboolean(value):
+    if value == "\0":
+        return "false"
+    return "true"
+
+def formatvarint(value):
+    # big endian two's complement of any length
+    n = int(binascii.hexlify(value), 16)
+    if ord(value[0]) & 0x80:
+        n -= 1 << (8 * len(value))
+    return n
+
+def formatinteger(value):
+    return "%d" % (formatvarint(value))
+
+def formatdecimal(value):
+    # an int scale followed by the varint unscaled value
+    scale = struct.unpack('>i', value[:4])[0]
+    return str(decimal.Decimal(formatvarint(value[4:])).scaleb(-scale))
+
+def formattimestamp(value):
+    # milliseconds since the epoch
+    ms = struct.unpack('>q', value)[0]
+    try:
+        date = EPOCH + datetime.timedelta(milliseconds=ms)
+    except OverflowError:
+        return "%d" % (ms)
+    return "%s.%03dZ" % (date.strftime("%Y-%m-%d %H:%M:%S"), date.microsecond / 1000)
+
+def formatdate(value):
+    days = struct.unpack('>I', value)[0] - SIMPLE_DATE_EPOCH
+    try:
+        return (EPOCH + datetime.timedelta(days=days)).strftime("%Y-%m-%d")
+    except OverflowError:
+        return "%d" % (days)
+
+def formattime(value):
+    # nanoseconds since midnight
+    ns = struct.unpack('>q', value)[0]
+    (seconds, ns) = divmod(ns, 1000000000)
+    (minutes, seconds) = divmod(seconds, 60)
+    return "%02d:%02d:%02d.%09d" % (minutes / 60, minutes % 60, seconds, ns)
+
+def formatuuid(value):
+    return str(uuid.UUID(bytes=value))
+
+def formatinet(value):
+    if len(value) == 4:
+        return socket.inet_ntop(socket.AF_INET, value)
+    return socket.inet_ntop(socket.AF_INET6, value)
+
+def formattext(value):
+    return value
+
+def formatempty(value):
+    return ""
+
+# (fixed value length or None, formatter) by type name, the types that are
+# missing here (collections, tuples, user types, durations, ...) are
+# written as hex
+TYPES = {
+    "AsciiType": (None, formattext),
+    "UTF8Type": (None, formattext),
+    "BytesType": (None, binascii.hexlify),
+    "BooleanType": (1, formatboolean),
+    "ByteType": (None, structformatter('>b', "%d")),
+    "ShortType": (None, structformatter('>h', "%d")),
+    "Int32Type": (4, structformatter('>i', "%d")),
+    "LongType": (8, structformatter('>q', "%d")),
+    "CounterColumnType": (8, structformatter('>q', "%d")),
+    "FloatType": (4, formatfloat),
+    "DoubleType": (8, formatdouble),
+    "IntegerType": (None, formatinteger),
+    "DecimalType": (None, formatdecimal),
+    "TimestampType": (8, formattimestamp),
+    "DateType": (8, formattimestamp),
+    "SimpleDateType": (None, formatdate),
+    "TimeType": (None, formattime),
+    "UUIDType": (16, formatuuid),
+    "TimeUUIDType": (16, formatuuid),
+    "LexicalUUIDType": (16, formatuuid),
+    "InetAddressType": (None, formatinet),
+    "EmptyType": (0, formatempty),
+}
+
+def basetype(name):
+    # the short name of a type, without the package and the wrappers
+    while True:
+        if name.startswith(MARSHAL_PACKAGE):
+            name = name[len(MARSHAL_PACKAGE):]
+        i = name.find("(")
+        if i < 0 or name[:i] not in WRAPPER_TYPES or name.endswith(")") != True:
+            return name
+        name = name[i + 1:-1]
+
+def typeparams(name):
+    # the parameters of a parameterized type, which can be parameterized
+    # types themselves
+    i = name.find("(")
+    if i < 0:
+        return []
+    params = []
+    depth = 0
+    start = i + 1
+    for j in xrange(i + 1, len(name) - 1):
+        if name[j] == "(":
+            depth += 1
+        elif name[j] == ")":
+            depth -= 1
+        elif name[j] == "," and depth == 0:
+            params.append(name[start:j].strip())
+            start = j + 1
+    params.append(name[start:len(name) - 1].strip())
+    return params
+
+def complextype(name):
+    # the collection or user type of a column with a cell per element
+    # (neither frozen nor a clustering column), None for other columns
+    while True:
+        if name.startswith(MARSHAL_PACKAGE):
+            name = name[len(MARSHAL_PACKAGE):]
+        if name.startswith("ReversedType(") != True:
+            break
+        name = name[len("ReversedType("):-1]
+    if name.split("(")[0] in COMPLEX_TYPES:
+        return name
+    return None
+
+class ColumnType:
+    def __init__(self, name):
+        self.name = name
+        self.basetype = basetype(name)
+        (self.length, self.formatter) = TYPES.get(self.basetype, (None, binascii.hexlify))
+        if self.length == None:
+            self.unpack = self.unpack_variable
+        else:
+            self.unpack = self.unpack_fixed
+        # the value types of the cells of a complex column: the elements
+        # of a list, none for a set, the values of a map and the fields
+        # of a user type, picked by the cell path
+        self.complex = False
+        self.element = None
+        self.fields = None
+        complex = complextype(name)
+        if complex != None:
+            self.complex = True
+            kind = complex.split("(")[0]
+            params = typeparams(complex)
+            if kind == "ListType":
+                self.element = ColumnType(params[0])
+            elif kind == "SetType":
+                self.element = ColumnType(MARSHAL_PACKAGE + "EmptyType")
+            elif kind == "MapType":
+                self.element = ColumnType(params[1])
+            else:
+                # keyspace, hex name, then hex field name:type
+                self.fields = [ColumnType(p[p.find(":") + 1:]) for p in params[2:]]
+
+    def celltype(self, path):
+        # the type of the value of a complex cell
+        if self.fields != None:
+            return self.fields[FIELD_POSITION.unpack(path.tobytes())[0]]
+        return self.element
+
+    def unpack_fixed(self, buf):
+        if self.length == 0:
+            return None
+        return buf.readview(self.length)
+
+    def unpack_variable(self, buf):
+        return buf.unpack_vintlendata()
+
+    def format(self, value):
+        # None is an empty value
+        if value is None:
+            return ""
+        return self.formatter(value.tobytes())
+
+    def __repr__(self):
+        return self.name
+
+class SchemaDecoder:
+    # the clustering, static and regular column types of one SSTable
+    def __init__(self, clusteringtypes, staticcols, regularcols):
+        self.clustering = [ColumnType(t) for t in clusteringtypes]
+        self.static = [(name, ColumnType(t)) for (name, t) in staticcols]
+        self.regular = [(name, ColumnType(t)) for (name, t) in regularcols]
+        # the (null bit, empty bit, type) of the values of each header
+        # block, by number of clustering values (bounds can be prefixes)
+        self.blocks = {}
+        self.blocks[len(self.clustering)] = self.headerblocks(len(self.clustering))
+
+    def frommetadata(self, metadata):
+        return SchemaDecoder(metadata.clusteringtypes, metadata.staticcols, metadata.regularcols)
+    frommetadata = classmethod(frommetadata)
+
+    def headerblocks(self, size):
+        blocks = []
+        for start in xrange(0, size, CLUSTERING_BLOCK):
+            block = self.clustering[start:min(start + CLUSTERING_BLOCK, size)]
+            blocks.append([(1 << (2 * i + 1), 1 << (2 * i), block[i]) for i in xrange(len(block))])
+        return blocks
+
+    def unpack_clustering(self, buf, size=None):
+        # the raw clustering values of a row, or the size first ones of a
+        # bound, None for null and empty ones
+        if size == None:
+            size = len(self.clustering)
+        blocks = self.blocks.get(size)
+        if blocks == None:
+            blocks = self.headerblocks(size)
+            self.blocks[size] = blocks
+        values = []
+        for block in blocks:
+            header = buf.unpack_vint()
+            for (nullbit, emptybit, type) in block:
+                if header & (nullbit | emptybit):
+                    values.append(None)
+                else:
+                    values.append(type.unpack(buf))
+        return values
+
+    def format_clustering(self, values):
+        return ":".join([self.clustering[i].format(values[i]) for i in xrange(len(values))])
+
+    def __repr__(self):
+        return "clustering: %s static: %s regular: %s" % (self.clustering, self.static, self.regular)
@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specif
+
+# a script to verify the chunk checksums and the whole file digest of the
+# Data.db of SSTables, the way nodetool verify and sstableverify do
+#
+# Data.db is split into ranges of whole chunks that are verified on a
+# process pool. Every worker also returns the checksum of its range, the
+# parent combines them into the checksum of the whole file, so Data.db is
+# read only once.
+
+import os
+import sys
+import zlib
+import array
+import bisect
+import struct
+import hashlib
+import argparse
+import binascii
+import multiprocessing
+import lz4.block
+import sstmd
+from sstable import SSTableFileName, CompressionInfo
+from sstidx import IndexInfo
+from sstscan import findsstables
+
+CHECKSUM = struct.Struct('>I')
+# bytes of Data.db verified by one task
+RANGE_SIZE = 16 * 1024 * 1024
+# Data.db bytes read at a time when computing a sha1 digest
+READ_SIZE = 1024 * 1024
+ADLER_BASE = 65521
+
+def adler32(data, value=1):
+    return zlib.adler32(data, value) & 0xffffffff
+
+def crc32(data, value=0):
+    return zlib.crc32(data, value) & 0xffffffff
+
+def adler32combine(adler1, adler2, len2):
+    # port of zlib's adler32_combine, the checksum of the concatenation of
+    # two byte ranges from their checksums and the length of the second
+    rem = len2 % ADLER_BASE
+    sum1 = adler1 & 0xffff
+    sum2 = (rem * sum1) % ADLER_BASE
+    sum1 = (sum1 + (adler2 & 0xffff) + ADLER_BASE - 1) % ADLER_BASE
+    sum2 = (sum2 + (adler1 >> 16) + (adler2 >> 16) + ADLER_BASE - rem) % ADLER_BASE
+    return sum1 | (sum2 << 16)
+
+def gf2multiply(matrix, vector):
+    result = 0
+    i = 0
+    while vector:
+        if vector & 1:
+            result ^= matrix[i]
+        vector >>= 1
+        i += 1
+    return result
+
+def gf2square(matrix):
+    return [gf2multiply(matrix, matrix[n]) for n in xrange(32)]
+
+def crc32combine(crc1, crc2, len2):
+    # port of zlib's crc32_combine, appends len2 zero bytes to crc1 by
+    # squaring the operator for one zero bit
+    if len2 <= 0:
+        return crc1
+    odd = [0xedb88320] + [1 << n for n in xrange(31)]
+    even = gf2square(odd)
+    odd = gf2square(even)
+    while True:
+        even = gf2square(odd)
+        if len2 & 1:
+            crc1 = gf2multiply(even, crc1)
+        len2 >>= 1
+        if len2 == 0:
+            break
+        odd = gf2square(even)
+        if len2 & 1:
+            crc1 = gf2multiply(odd, crc1)
+        len2 >>= 1
+        if len2 == 0:
+            break
+    return crc1 ^ crc2
+
+CHECKSUMS = {
+    'adler32': (adler32, adler32combine, 1),
+    'crc32': (crc32, crc32combine, 0),
+}
+
+def chunkchecksum(version):
+    # (algorithm, whether it covers the uncompressed bytes) of the chunk
+    # checksums, Adler32 of the compressed bytes from 'jb' until 3.0 moved
+    # to CRC32, CRC32 of the uncompressed bytes before
+    if version >= 'ma':
+        return ('crc32', False)
+    if version >= 'jb':
+        return ('adler32', False)
+    return ('crc32', True)
+
+def crcchecksum(version):
+    # the algorithm of the CRC.db checksums of uncompressed sstables
+    if version >= 'ka' and version < 'ma':
+        return 'adler32'
+    return 'crc32'
+
+def digestalgorithm(version):
+    # (algorithm, digest file suffix), 2.1 already wrote an Adler32 but
+    # kept the Digest.sha1 name, 2.2 named the file after the algorithm
+    if version >= 'ma':
+        return ('crc32', 'crc32')
+    if version >= 'la':
+        return ('adler32', 'adler32')
+    if version >= 'ka':
+        return ('adler32', 'sha1')
+    return ('sha1', 'sha1')
+
+def readcrcfile(filename):
+    # the chunk length followed by one checksum per chunk
+    f = open(filename, 'rb')
+    data = f.read()
+    f.close()
+    chunklen = CHECKSUM.unpack_from(data, 0)[0]
+    checksums = array.array('I', data[4:4 + (len(data) - 4) / 4 * 4])
+    if sys.byteorder == 'little':
+        checksums.byteswap()
+    return (chunklen, checksums)
+
+class ChunkLayout:
+    # the chunks of a Data.db as (file start, file end, uncompressed start,
+    # checksum or None when it follows the chunk)
+    def __init__(self, chunks, algorithm, uncompressed, datalength):
+        self.chunks = chunks
+        self.algorithm = algorithm
+        self.uncompressed = uncompressed
+        self.datalength = datalength
+
+    def positions(self, chunkno):
+        # the uncompressed data range of a chunk
+        end = self.datalength
+        if chunkno + 1 < len(self.chunks):
+            end = self.chunks[chunkno + 1][2]
+        return (self.chunks[chunkno][2], end)
+
+    def compressed(self, compfile, datasize, version):
+        metadata = CompressionInfo.parse(compfile)
+        offsets = metadata.chunkoffsets + [datasize]
+        chunks = [(offsets[i], offsets[i + 1], i * metadata.chunklen, None) for i in xrange(metadata.chunkcount)]
+        (algorithm, uncompressed) = chunkchecksum(version)
+        return ChunkLayout(chunks, algorithm, uncompressed, metadata.uncompressedlen)
+    compressed = classmethod(compressed)
+
+    def checksummed(self, crcfile, datasize, version):
+        (chunklen, checksums) = readcrcfile(crcfile)
+        chunks = []
+        for i in xrange(len(checksums)):
+            start = i * chunklen
+            chunks.append((start, min(start + chunklen, datasize), start, checksums[i]))
+        return ChunkLayout(chunks, crcchecksum(version), False, datasize)
+    checksummed = classmethod(checksummed)
+
+    def tasks(self, datafile, digest):
+        # consecutive chunks grouped into ranges of about RANGE_SIZE bytes
+        tasks = []
+        first = 0
+        for i in xrange(len(self.chunks)):
+            if i + 1 == len(self.chunks) or self.chunks[i + 1][1] - self.chunks[first][0] > RANGE_SIZE:
+                tasks.append((datafile, first, self.chunks[first:i + 1], self.algorithm, self.uncompressed, digest))
+                first = i + 1
+        return tasks
+
+def verifyrange(task):
+    # runs in a worker process, returns (first chunk, corrupt chunk numbers,
+    # range length, range checksum)
+    (datafile, first, chunks, algorithm, uncompressed, digest) = task
+    start = chunks[0][0]
+    end = chunks[-1][1]
+    f = open(datafile, 'rb')
+    f.seek(start)
+    data = f.read(end - start)
+    f.close()
+    checksum = CHECKSUMS[algorithm][0]
+    corrupt = []
+    for i in xrange(len(chunks)):
+        (chunkstart, chunkend, pos, expected) = chunks[i]
+        chunk = data[chunkstart - start:chunkend - start]
+        if len(chunk) != chunkend - chunkstart or len(chunk) < 4:
+            # cut short by a truncated file
+            corrupt.append(first + i)
+            continue
+        if expected is None:
+            expected = CHECKSUM.unpack_from(chunk, len(chunk) - 4)[0]
+            chunk = chunk[:-4]
+            if uncompressed:
+                try:
+                    chunk = lz4.block.decompress(chunk)
+                except Exception:
+                    corrupt.append(first + i)
+                    continue
+        if checksum(chunk) != expected:
+            corrupt.append(first + i)
+    value = None
+    if digest in CHECKSUMS:
+        value = CHECKSUMS[digest][0](data)
+    return (first, corrupt, len(data), value)
+
+def readdigest(filename):
+    # the digest is the checksum in decimal, or a sha1 in hex followed by
+    # the file name
+    f = open(filename, 'r')
+    text = f.read().strip()
+    f.close()
+    return text.split()[0]
+
+def filedigest(datafile, algorithm):
+    # the digest of the whole file in one sequential pass
+    sha1 = hashlib.sha1()
+    value = None
+    f = open(datafile, 'rb')
+    while True:
+        data = f.read(READ_SIZE)
+        if data == "":
+            break
+        if algorithm == 'sha1':
+            sha1.update(data)
+        elif value == None:
+            value = CHECKSUMS[algorithm][0](data)
+        else:
+            value = CHECKSUMS[algorithm][0](data, value)
+    f.close()
+    if algorithm == 'sha1':
+        return sha1.hexdigest()
+    if value == None:
+        value = CHECKSUMS[algorithm][2]
+    return str(value)
+
+class VerifyResult:
+    def __init__(self, datafile):
+        self.datafile = datafile
+        self.chunks = 0
+        self.corrupt = []
+        self.digest = None
+        self.expected = None
+        self.errors = []
+        # what couldn't be verified
+        self.warnings = []
+
+    def ok(self):
+        return len(self.corrupt) == 0 and len(self.errors) == 0 and (self.expected == None or self.digest == self.expected)
+
+def partitionrange(index, start, end):
+    # the keys of the first and last partitions with data in [start, end)
+    first = max(bisect.bisect_right(index.positions, start) - 1, 0)
+    last = max(bisect.bisect_left(index.positions, end) - 1, first)
+    return (binascii.hexlify(index.key(first)), binascii.hexlify(index.key(last)))
+
+def verify(sstable, pool=None):
+    datafile = sstable.datafile()
+    result = VerifyResult(datafile)
+    datasize = os.stat(datafile).st_size
+    version = sstable.sstversion
+    if os.path.isfile(sstable.compfile()):
+        layout = ChunkLayout.compressed(sstable.compfile(), datasize, version)
+    elif os.path.isfile(sstable.crcfile()):
+        layout = ChunkLayout.checksummed(sstable.crcfile(), datasize, version)
+    else:
+        layout = ChunkLayout([], None, False, datasize)
+        result.warnings.append("no CompressionInfo.db or CRC.db, chunks not verified")
+    (digest, suffix) = digestalgorithm(version)
+    if os.path.isfile(sstable.digestfile(suffix)):
+        result.expected = readdigest(sstable.digestfile(suffix))
+    else:
+        result.warnings.append("no Digest.%s, digest not verified" % (suffix))
+        digest = None
+    tasks = layout.tasks(datafile, digest)
+    if pool != None:
+        results = pool.imap(verifyrange, tasks)
+    else:
+        results = (verifyrange(task) for task in tasks)
+    result.chunks = len(layout.chunks)
+    value = None
+    length = 0
+    for (first, corrupt, rangelength, rangevalue) in results:
+        result.corrupt.extend(corrupt)
+        if digest in CHECKSUMS:
+            if value == None:
+                value = rangevalue
+            else:
+                value = CHECKSUMS[digest][1](value, rangevalue, rangelength)
+        length += rangelength
+    if value != None:
+        result.digest = str(value)
+    elif digest != None:
+        # a sha1 digest, or no chunks to compute the checksum from
+        result.digest = filedigest(datafile, digest)
+    if length != datasize and len(layout.chunks) > 0:
+        result.errors.append("chunks cover %d of %d bytes" % (length, datasize))
+    index = None
+    if len(result.corrupt) > 0 and os.path.isfile(sstable.indexfile()):
+        index = IndexInfo.parse(sstable.indexfile())
+    for chunkno in result.corrupt:
+        (start, end) = layout.positions(chunkno)
+        error = "corrupt chunk %d (data positions %d to %d)" % (chunkno, start, end)
+        if index != None and index.rowcount > 0:
+            error += " partitions %s to %s" % partitionrange(index, start, end)
+        result.errors.append(error)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(prog="sstverify")
+    parser.add_argument("-j", "--jobs", help="number of processes verifying chunks in parallel", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("-v", "--verbose", help="report every SSTable, not only the corrupt ones", action="store_true")
+    parser.add_argument("sstables", type=str, nargs="+", help="SSTable files, or directories searched for SSTables")
+    args = parser.parse_args()
+
+    sstables = []
+    for filename in args.sstables:
+        if os.path.isdir(filename):
+            sstables.extend([files.sstable for files in findsstables(filename)])
+            continue
+        sstable = SSTableFileName.parse(filename, False)
+        if sstable == None:
+            parser.error("%s is not an sstable file" % (filename))
+        sstables.append(sstable)
+    pool = None
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(args.jobs)
+    failed = 0
+    for sstable in sstables:
+        result = verify(sstable, pool)
+        if result.ok() != True:
+            failed += 1
+        if result.ok() != True or args.verbose:
+            status = "ok"
+            if result.ok() != True:
+                status = "failed"
+            print "%s: %s, %d chunks, %d corrupt, digest %s expected %s" % (result.datafile, status, result.chunks, len(result.corrupt), result.digest, result.expected)
+            for error in result.errors + result.warnings:
+                print "  %s" % (error)
+    if pool != None:
+        pool.close()
+        pool.join()
+    if failed > 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -16,26 +16,32 @@
 # See the License for the specif
 
 
-# a script to convert a given key in hex format to token using RandomPartitioner
+# a script to convert a given key in hex format to token, or a list of keys
+# in bulk, using RandomPartitioner or Murmur3Partitioner
 
-import hashlib
+import argparse
 import binascii
+import multiprocessing
 import sys
-
-if len(sys.argv) < 2:
-    print "usage: python token.py <key in hex format>"
+import partitioner
+
+parser = argparse.ArgumentParser(prog="token-hexkey")
+parser.add_argument("-p", "--partitioner", help="random (default), murmur3 or a partitioner class name", type=str, default="random")
+parser.add_argument("-f", "--file", help="read one key in hex format per line from file, - for stdin, and print key<TAB>token lines", type=str)
+parser.add_argument("-j", "--jobs", help="number of processes for large inputs", type=int, default=multiprocessing.cpu_count())
+parser.add_argument("key", type=str, nargs="?", help="key in hex format")
+args = parser.parse_args()
+
+if args.file != None:
+    if args.file == "-":
+        keys = sys.stdin
+    else:
+        keys = open(args.file, 'r')
+    partitioner.tokenize(keys, sys.stdout, args.partitioner, True, args.jobs)
+elif args.key != None:
+    key = binascii.unhexlify(args.key)
+    token = partitioner.gettokenfunction(args.partitioner)
+    print partitioner.formattoken(token(key))
+else:
+    parser.print_usage()
     sys.exit(1)
-
-key = binascii.unhexlify(sys.argv[1])
-
-# Calculate MD5 digest and convert it to hex format
-digest = hashlib.md5(key).hexdigest()
-
-# Convert the hash digest to 2's complement form
-token  = long(digest, 16)
-bits   = 128
-if ((token & (1 << (bits - 1))) != 0):
-    token = token - (1 << bits)
-
-# Convert the resulting number to unsigned form
-print abs(token)